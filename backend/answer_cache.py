@@ -0,0 +1,150 @@
+# answer_cache.py
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, Optional
+
+from llm_gateway import LLMError
+
+# Two tiers for /ask: retrieval results keyed by (normalized question, corpus
+# version) and generated answers keyed by (prompt hash, corpus version).
+# The corpus version comes from the catalog, so an upload or delete in any
+# worker invalidates both tiers.
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "600"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+
+# Cached answers are replayed in pieces of this many characters
+REPLAY_CHUNK_CHARS = 256
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after `ttl` seconds.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+retrieval_cache = TTLCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+answer_cache = TTLCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL)
+
+
+def normalize_question(question: str) -> str:
+    return re.sub(r"\s+", " ", question).strip().lower().rstrip("?!. ")
+
+
+def retrieval_key(question: str, corpus_version: int, *scope) -> tuple:
+    return (normalize_question(question), corpus_version, *scope)
+
+
+def answer_key(prompt: str, corpus_version: int) -> tuple:
+    return (hashlib.sha256(prompt.encode("utf-8")).hexdigest(), corpus_version)
+
+
+def replay(text: str) -> Iterator[str]:
+    for i in range(0, len(text), REPLAY_CHUNK_CHARS):
+        yield text[i:i + REPLAY_CHUNK_CHARS]
+
+
+async def _replay_async(text: str) -> AsyncIterator[str]:
+    for piece in replay(text):
+        yield piece
+
+
+async def _record(key, stream: AsyncIterator[str], on_complete, raise_errors: bool) -> AsyncIterator[str]:
+    parts = []
+    try:
+        async for piece in stream:
+            parts.append(piece)
+            yield piece
+    except LLMError as e:
+        logger.warning("answer stream interrupted", extra={"error": str(e)})
+        if raise_errors:
+            raise
+        # Headers are already sent; end the response and cache nothing
+        return
+    answer = "".join(parts)
+    # Only complete, successful generations are cached
+    if answer:
+        answer_cache.put(key, answer)
+        if on_complete is not None:
+            on_complete(answer)
+
+
+async def cached_stream(
+    prompt: str,
+    corpus_version: int,
+    open_stream: Callable[[str], Awaitable[AsyncIterator[str]]],
+    on_complete: Callable[[str], None] = None,
+    raise_errors: bool = False,
+) -> AsyncIterator[str]:
+    """
+    Stream the answer for `prompt`: replay it from the cache if present,
+    otherwise stream `await open_stream(prompt)` and cache the full text when
+    done. Errors raised by open_stream (before any text) propagate to the
+    caller. An LLMError after that ends the stream quietly, for responses
+    whose headers are already sent, unless raise_errors is set (callers
+    that collect the whole answer). on_complete(answer) is called after a
+    successful fresh generation.
+    """
+    key = answer_key(prompt, corpus_version)
+    cached = answer_cache.get(key)
+    if cached is not None:
+        return _replay_async(cached)
+    return _record(key, await open_stream(prompt), on_complete, raise_errors)
+
+
+def clear() -> None:
+    retrieval_cache.clear()
+    answer_cache.clear()
+
+
+def stats() -> dict:
+    return {"retrieval": retrieval_cache.stats(), "answer": answer_cache.stats()}
@@ -0,0 +1,263 @@
+# benchmark.py
+"""
+Offline benchmark for ingestion and /ask, with no network services: a
+synthetic legal corpus, the local vector store (or in-memory Qdrant) and the
+fake LLM provider (LLM_PROVIDER=fake). Prints one JSON report.
+
+    python benchmark.py [--docs 20] [--pages 5] [--backend local|qdrant]
+                        [--requests 200] [--concurrency 16] [--k 5]
+                        [--llm-latency-ms 50] [--seed 7] [--cached]
+                        [--output report.json]
+
+Measures ingestion throughput (pages/s, chunks/s), /ask latency
+percentiles under concurrent load (caches off unless --cached; hit rates
+are reported either way), recall@k and MRR of
+search_similar_chunks on labelled questions, and peak RSS. Compare the
+JSON of two releases to catch regressions. The embedding model is the
+real one (EMBEDDER_MODEL).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+
+COMPANIES = [
+    "Acme Holdings", "Borealis Freight", "Cedar Analytics", "Delta Marine", "Evergreen Foods",
+    "Falcon Robotics", "Granite Capital", "Harbor Textiles", "Ion Therapeutics", "Juniper Energy",
+    "Kestrel Mining", "Lumen Media", "Meridian Logistics", "Northwind Retail", "Orchid Biotech",
+    "Pinnacle Software", "Quarry Materials", "Redwood Insurance", "Summit Aerospace", "Tidewater Utilities",
+]
+STATES = ["New York", "Delaware", "California", "Texas", "Illinois", "Florida", "Washington", "Ohio"]
+TOPICS = [
+    # (clause heading, fact sentence template, question template)
+    ("Termination", "Either party may terminate this Agreement on {n} days written notice to {company}.",
+     "How many days notice are needed to terminate the {company} agreement?"),
+    ("Governing Law", "This Agreement with {company} is governed by the laws of the State of {state}.",
+     "Which state's law governs the agreement with {company}?"),
+    ("Payment", "{company} shall pay each invoice within {n} days of receipt, with late interest of {pct} percent.",
+     "Within how many days must {company} pay invoices?"),
+    ("Confidentiality", "{company} shall keep Confidential Information secret for {n} years after expiry.",
+     "How long must {company} keep information confidential?"),
+    ("Liability", "The aggregate liability of {company} is capped at {n} thousand dollars.",
+     "What is the liability cap for {company}?"),
+    ("Insurance", "{company} shall maintain general liability insurance of at least {n} million dollars.",
+     "How much liability insurance must {company} maintain?"),
+]
+FILLER = [
+    "The parties acknowledge that this clause has been negotiated at arm's length.",
+    "Nothing in this section limits any other right or remedy available under this Agreement.",
+    "Headings are for convenience only and do not affect interpretation.",
+    "Any notice under this section must be in writing and delivered to the registered address.",
+    "The obligations in this section survive expiry or termination of this Agreement.",
+    "Each party shall act reasonably and in good faith when exercising its rights.",
+    "Where a provision is held invalid, the remaining provisions continue in full force.",
+]
+
+
+def generate_corpus(n_docs: int, n_pages: int, seed: int):
+    """
+    Return (documents, questions). Each document is a list of
+    (text, page, file_name) pages; each question is labelled with the file,
+    page and sentence holding its answer.
+    """
+    rng = random.Random(seed)
+    documents, questions = [], []
+    for d in range(n_docs):
+        company = f"{COMPANIES[d % len(COMPANIES)]} {d // len(COMPANIES) + 1}"
+        file_name = f"agreement_{d:04d}.txt"
+        pages = []
+        section = 1
+        for page in range(1, n_pages + 1):
+            lines = []
+            for heading, fact, question in rng.sample(TOPICS, 2):
+                values = dict(company=company, n=rng.randint(2, 90), state=rng.choice(STATES), pct=rng.randint(1, 9))
+                lines.append(f"Section {section}. {heading}")
+                answer = fact.format(**values)
+                body = rng.sample(FILLER, 3)
+                body.insert(rng.randint(0, 3), answer)
+                lines.append(" ".join(body))
+                questions.append({
+                    "question": question.format(**values), "file_name": file_name, "page": page, "answer": answer
+                })
+                section += 1
+            pages.append(("\n".join(lines), page, file_name))
+        documents.append(pages)
+    return documents, questions
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+    return round(ordered[index] * 1000, 2)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1 / (1024 * 1024) if sys.platform == "darwin" else 1 / 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale, 1)
+
+
+def configure_environment(backend: str, workdir: str, llm_latency_ms: float, caches: bool = False) -> None:
+    """
+    Point every store at a scratch directory and use the fake LLM. Must run
+    before any backend module is imported, since they read config at import.
+    Summary trees are off so no background LLM calls skew /ask, and so are
+    the retrieval, answer and semantic caches unless `caches` is set.
+    """
+    os.environ["VECTOR_BACKEND"] = "local" if backend == "local" else "qdrant"
+    if backend == "qdrant":
+        os.environ["QDRANT_LOCATION"] = ":memory:"
+    os.environ["LOCAL_STORE_PATH"] = os.path.join(workdir, "vector_store")
+    os.environ["CATALOG_DB_PATH"] = os.path.join(workdir, "catalog.db")
+    os.environ["LEXICAL_INDEX_PATH"] = os.path.join(workdir, "lexical_index.db")
+    os.environ["JOBS_DB_PATH"] = os.path.join(workdir, "jobs.db")
+    os.environ["EMBED_CACHE_PATH"] = os.path.join(workdir, "embedding_cache.db")
+    os.environ["HISTORY_BACKEND"] = "memory"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["LLM_PROVIDER"] = "fake"
+    os.environ["FAKE_LLM_LATENCY_MS"] = str(llm_latency_ms)
+    os.environ["SUMMARIES_ENABLED"] = "false"
+    if not caches:
+        os.environ["QUERY_CACHE_SIZE"] = "0"
+        os.environ["ANSWER_CACHE_SIZE"] = "0"
+        os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+
+
+def bench_ingestion(documents) -> dict:
+    from build_vector_store import build_and_save_index
+
+    pages = chunks = 0
+    start = time.perf_counter()
+    for doc in documents:
+        result = build_and_save_index(doc)
+        pages += len(doc)
+        chunks += result.get("chunks", 0)
+    elapsed = time.perf_counter() - start
+    return {
+        "documents": len(documents),
+        "pages": pages,
+        "chunks": chunks,
+        "seconds": round(elapsed, 3),
+        "pages_per_s": round(pages / elapsed, 2),
+        "chunks_per_s": round(chunks / elapsed, 2),
+    }
+
+
+def bench_retrieval(questions, k: int) -> dict:
+    from retrieval import search_similar_chunks
+
+    hits, reciprocal_ranks, latencies = 0, [], []
+    for q in questions:
+        start = time.perf_counter()
+        chunks, _ = search_similar_chunks(q["question"], top_k=k)
+        latencies.append(time.perf_counter() - start)
+        # Chunks can span pages, so a hit is a chunk of the right file holding the answer
+        rank = next(
+            (i + 1 for i, c in enumerate(chunks) if c["file_name"] == q["file_name"] and q["answer"] in c["text"]),
+            None,
+        )
+        if rank is not None:
+            hits += 1
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+    n = max(len(questions), 1)
+    return {
+        "questions": len(questions),
+        "k": k,
+        f"recall_at_{k}": round(hits / n, 4),
+        "mrr": round(sum(reciprocal_ranks) / n, 4),
+        "search_p50_ms": percentile(latencies, 50),
+        "search_p95_ms": percentile(latencies, 95),
+    }
+
+
+async def bench_ask(questions, n_requests: int, concurrency: int) -> dict:
+    import httpx
+    import main
+
+    for handler in main.app.router.on_startup:
+        await handler()
+    latencies, statuses = [], {}
+    queue = asyncio.Queue()
+    # Each question once before any repeats (repeats only past len(questions))
+    for i in range(n_requests):
+        queue.put_nowait(questions[i % len(questions)]["question"])
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        async def worker(n: int):
+            while not queue.empty():
+                question = queue.get_nowait()
+                start = time.perf_counter()
+                response = await client.post(
+                    "/ask", data={"question": question}, headers={"X-Session-Id": f"bench-{n}"}
+                )
+                await response.aread()
+                latencies.append(time.perf_counter() - start)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(n) for n in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    for handler in main.app.router.on_shutdown:
+        await handler()
+    caches = main.answer_cache.stats()
+    return {
+        "requests": n_requests,
+        "distinct_questions": min(n_requests, len(questions)),
+        "concurrency": concurrency,
+        "retrieval_cache_hit_rate": caches["retrieval"]["hit_rate"],
+        "answer_cache_hit_rate": caches["answer"]["hit_rate"],
+        "semantic_cache_hit_rate": main.semantic_cache.stats()["hit_rate"] if main.semantic_cache else None,
+        "status_counts": {str(k): v for k, v in sorted(statuses.items())},
+        "requests_per_s": round(n_requests / elapsed, 2),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline ingestion/retrieval/ask benchmark")
+    parser.add_argument("--docs", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--backend", choices=["local", "qdrant"], default="local")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--llm-latency-ms", type=float, default=50)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--cached", action="store_true", help="keep the retrieval/answer/semantic caches on")
+    parser.add_argument("--output", help="also write the JSON report here")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="legal-bench-")
+    configure_environment(args.backend, workdir, args.llm_latency_ms, caches=args.cached)
+    documents, questions = generate_corpus(args.docs, args.pages, args.seed)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "ingestion": bench_ingestion(documents),
+        "retrieval": bench_retrieval(questions, args.k),
+        "ask": asyncio.run(bench_ask(questions, args.requests, args.concurrency)),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,88 +1,275 @@
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue
-from sentence_transformers import SentenceTransformer
-from chunk import chunk_text
+from chunk import iter_chunks, batched
+from observability import span
+from embedder import encode_passages, get_dimension
+from vector_store import VectorStore, Record, get_store
+from workers import embed_blocking
+import lexical_index
+import catalog
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import logging
 import os
+import queue
+import threading
 import uuid
 
 
-COLLECTION_NAME = "legal_chunks"
-EMBEDDER_MODEL = "all-MiniLM-L6-v2"
+logger = logging.getLogger(__name__)
 
+# Point ids are derived from (file_id, page, chunk hash), so re-ingesting the
+# same content yields the same ids and only the difference is written.
+POINT_NAMESPACE = uuid.UUID("5d0f6c1e-8a4b-4f7e-9a51-3b2c6f0d7e21")
 
-def file_exists(client: QdrantClient, file_name: str) -> bool:
+# Ingestion pipeline: chunker thread -> embedding (in the embedding pool, one
+# batch at a time) -> upload workers. Chunks are embedded INGEST_BATCH_SIZE at
+# a time and written in UPSERT_BATCH_SIZE upserts by UPLOAD_WORKERS threads, so
+# network time overlaps model compute. PIPELINE_DEPTH bounds the batches
+# buffered per stage.
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "256"))
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "128"))
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "4"))
+PIPELINE_DEPTH = int(os.getenv("PIPELINE_DEPTH", "2"))
+
+_DONE = object()
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def document_hash(pages: list) -> str:
+    """
+    Hash of the extracted text of every page, in order.
+    """
+    h = hashlib.sha256()
+    for text, page, _ in pages:
+        h.update(f"\x00{page}\x00".encode("utf-8"))
+        h.update(text.encode("utf-8"))
+    return h.hexdigest()
+
+
+def file_exists(store: VectorStore, file_name: str) -> bool:
+    """
+    Check if a file_name already exists in the vector store.
+    """
+    return store.exists({"file_name": file_name})
+
+
+def _point_ids(file_id: str, chunks: list, seen: dict = None) -> list:
+    # The occurrence counter keeps repeated boilerplate on one page distinct;
+    # pass the same `seen` dict for successive batches of one document
+    seen = {} if seen is None else seen
+    ids = []
+    for chunk in chunks:
+        key = f"{chunk['page']}:{chunk['chunk_hash']}"
+        seen[key] = seen.get(key, 0) + 1
+        ids.append(str(uuid.uuid5(POINT_NAMESPACE, f"{file_id}:{key}:{seen[key]}")))
+    return ids
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    # Blocking put that gives up once the consumer has stopped
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _produce_batches(pages, out: queue.Queue, stop: threading.Event) -> None:
+    """
+    Chunker stage: push hashed chunk batches, then _DONE (or the exception).
+    """
+    try:
+        for batch in batched(iter_chunks(pages), INGEST_BATCH_SIZE):
+            for chunk in batch:
+                chunk["chunk_hash"] = content_hash(chunk["text"])
+            if not _put(out, batch, stop):
+                return
+        _put(out, _DONE, stop)
+    except Exception as e:
+        _put(out, e, stop)
+
+
+def _upload(store: VectorStore, points: list, wait: bool = False) -> None:
+    """
+    Upload stage. Intermediate upserts don't wait for indexing; the last one
+    is sent with wait=True once the others have been accepted.
+    """
+    with span("upsert"):
+        store.upsert(points, wait=wait)
+    lexical_index.add_chunks((p.id, p.payload["text"], p.payload) for p in points)
+
+
+def _copy_document(store: VectorStore, doc_hash: str, file_name: str) -> int:
     """
-    Check if a file_name already exists in Qdrant.
+    Same content already stored under another name: copy its vectors instead
+    of embedding again. Returns the number of points copied (0 if none).
     """
-    results, _ = client.scroll(
-        collection_name=COLLECTION_NAME,
-        scroll_filter=Filter(
-            must=[FieldCondition(key="file_name", match=MatchValue(value=file_name))]
-        ),
-        limit=1,
-        with_payload=False
-    )
-    return len(results) > 0
-
-
-def build_and_save_index(pages: list):
+    existing = store.scroll({"doc_hash": doc_hash}, with_vectors=True)
+    if not existing:
+        return 0
+
+    source_file_id = existing[0].payload["file_id"]
+    existing = [p for p in existing if p.payload["file_id"] == source_file_id]
+    file_id = str(uuid.uuid4())
+    chunks = [dict(p.payload, file_id=file_id, file_name=file_name, source=file_name) for p in existing]
+    ids = _point_ids(file_id, chunks)
+    records = [
+        Record(id=point_id, vector=p.vector, payload=chunk)
+        for point_id, p, chunk in zip(ids, existing, chunks)
+    ]
+    # Same upsert size as a fresh ingest, waiting for indexing on the last one
+    parts = list(batched(records, UPSERT_BATCH_SIZE))
+    for i, part in enumerate(parts):
+        _upload(store, part, wait=i == len(parts) - 1)
+    catalog.upsert_document(file_id, file_name, doc_hash, len({c.get("page") for c in chunks}), len(ids))
+    return len(ids)
+
+
+def build_and_save_index(pages: list, progress=None):
     """
-    Builds Qdrant index (collection) and uploads chunks + metadata to Qdrant Cloud.
-    Returns status dict: {"file_name": str, "status": "uploaded"|"skipped"}
+    Builds the vector index (collection) and uploads chunks + metadata to the vector store.
+    Ingestion is keyed on content hashes: an unchanged document is skipped, a
+    document already stored under another name reuses its vectors, and a new
+    revision of an existing file only embeds the chunks that changed.
+    progress(stage, **fields), if given, is called as each pipeline stage starts.
+    Returns status dict: {"file_name": str, "status": "uploaded"|"skipped", ...counts}
     """
+    progress = progress or (lambda stage, **fields: None)
     if not pages:
         return {"file_name": None, "status": "skipped"}
 
     file_name = pages[0][2]  # from (text, page, source)
+    doc_hash = document_hash(pages)
 
-    client = QdrantClient(
-        url=os.getenv("QDRANT_URL"),
-        api_key=os.getenv("QDRANT_API_KEY")
-    )
+    store = get_store()
+    store.ensure_collection(get_dimension())
 
-    # check if file already exists
-    if file_exists(client, file_name):
-        print(f"⚠️ Skipping upload: {file_name} already exists in Qdrant")
+    # Fast path: the catalog already has this exact revision
+    known = catalog.get_document(file_name)
+    if known and known["doc_hash"] == doc_hash:
+        logger.info("skipping unchanged file", extra={"file": file_name})
         return {"file_name": file_name, "status": "skipped"}
 
-    # Convert tuples into dicts
-    pages_as_dicts = [{"text": t, "page": p, "source": s} for (t, p, s) in pages]
+    existing = []
+    if file_exists(store, file_name):
+        existing = store.scroll({"file_name": file_name}, fields=["file_id", "doc_hash", "chunk_hash"])
 
-    # Chunk the uploaded document(s)
-    chunks = chunk_text(pages_as_dicts)
+    # Same content under a different name
+    if not existing and catalog.has_hash(doc_hash):
+        copied = _copy_document(store, doc_hash, file_name)
+        if copied:
+            logger.info("reused vectors of a duplicate document", extra={"file": file_name, "reused": copied})
+            return {"file_name": file_name, "status": "uploaded", "chunks": copied, "embedded": 0, "reused": copied, "deleted": 0}
 
-    # Encode using sentence-transformers
-    model = SentenceTransformer(EMBEDDER_MODEL)
-    embeddings = model.encode([c["text"] for c in chunks]).tolist()
+    # Keep the file_id stable across revisions of the same file
+    file_id = existing[0].payload["file_id"] if existing else str(uuid.uuid4())
+    existing_ids = {str(p.id) for p in existing}
+    # Any stored chunk with the same text can lend its vector (e.g. moved pages)
+    existing_by_hash = {p.payload["chunk_hash"]: p.id for p in existing if p.payload.get("chunk_hash")}
 
-    # Create collection if not exists (do not delete existing data)
-    try:
-        client.create_collection(
-            collection_name=COLLECTION_NAME,
-            vectors_config=VectorParams(size=len(embeddings[0]), distance=Distance.COSINE)
-        )
-    except Exception:
-        pass  # Collection already exists
-
-    # Generate a unique file_id for this upload
-    file_id = str(uuid.uuid4())
+    # Chunks are streamed from the chunker batch by batch, so memory stays
+    # flat regardless of document size; only point ids are kept. Point ids
+    # are deterministic and the catalog row is written last, so a run that
+    # fails partway resumes on the next upload: points already written are
+    # skipped and only the rest is embedded.
+    progress("chunking")
+    pages_as_dicts = ({"text": t, "page": p, "source": s} for (t, p, s) in pages)
+    seen_counts, new_ids = {}, set()
+    n_chunks = n_embedded = 0
 
-    points = [
-        PointStruct(
-            id=str(uuid.uuid4()),
-            vector=embedding,
-            payload={
-                "text": chunk["text"],
-                "page": chunk["page"],
-                "source": chunk["source"],
-                "file_id": file_id,
-                "file_name": chunk["source"]
-            }
-        )
-        for chunk, embedding in zip(chunks, embeddings)
-    ]
+    stop = threading.Event()
+    batches = queue.Queue(maxsize=PIPELINE_DEPTH)
+    producer = threading.Thread(target=_produce_batches, args=(pages_as_dicts, batches, stop), daemon=True)
+    producer.start()
+    in_flight = deque()
+    last_part = None
+
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="upload") as uploader:
+        try:
+            while True:
+                batch = batches.get()
+                if batch is _DONE:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+
+                ids = _point_ids(file_id, batch, seen_counts)
+                new_ids.update(ids)
+                n_chunks += len(batch)
+                to_write = [(point_id, chunk) for point_id, chunk in zip(ids, batch) if point_id not in existing_ids]
+                if not to_write:
+                    continue
+
+                progress("embedding", chunks=n_chunks)
+                reuse_ids = {existing_by_hash[c["chunk_hash"]] for _, c in to_write if c["chunk_hash"] in existing_by_hash}
+                vectors = {p.payload["chunk_hash"]: p.vector for p in store.retrieve(list(reuse_ids), with_vectors=True)} if reuse_ids else {}
+                to_embed = list({c["chunk_hash"]: c for _, c in to_write if c["chunk_hash"] not in vectors}.values())
+
+                # Encode using the shared sentence-transformers model; only this
+                # batch occupies an embedding pool thread, not the whole upload
+                if to_embed:
+                    with span("embed_passages"):
+                        vectors.update(zip(
+                            (c["chunk_hash"] for c in to_embed),
+                            embed_blocking(encode_passages, [c["text"] for c in to_embed]).tolist()
+                        ))
+                n_embedded += len(to_embed)
+
+                points = [
+                    Record(
+                        id=point_id,
+                        vector=vectors[chunk["chunk_hash"]],
+                        payload={
+                            "text": chunk["text"],
+                            "page": chunk["page"],
+                            "source": chunk["source"],
+                            "file_id": file_id,
+                            "file_name": chunk["source"],
+                            "doc_hash": doc_hash,
+                            "chunk_hash": chunk["chunk_hash"]
+                        }
+                    )
+                    for point_id, chunk in to_write
+                ]
+                progress("upserting")
+                for part in batched(points, UPSERT_BATCH_SIZE):
+                    if last_part is not None:
+                        in_flight.append(uploader.submit(_upload, store, last_part))
+                    last_part = part
+                    # Backpressure: wait for the oldest upload when too many are pending
+                    while len(in_flight) > UPLOAD_WORKERS * PIPELINE_DEPTH:
+                        in_flight.popleft().result()
+
+            while in_flight:
+                in_flight.popleft().result()
+            if last_part is not None:
+                _upload(store, last_part, wait=True)
+        finally:
+            stop.set()
 
-    client.upsert(collection_name=COLLECTION_NAME, points=points)
+    stale_ids = list(existing_ids - new_ids)
+    kept_ids = list(existing_ids & new_ids)
+    if kept_ids:
+        store.set_payload(kept_ids, {"doc_hash": doc_hash})
+    if stale_ids:
+        store.delete_ids(stale_ids)
+        lexical_index.remove_chunks(stale_ids)
+    catalog.upsert_document(file_id, file_name, doc_hash, len(pages), n_chunks)
 
-    print(f"✅ Chunks uploaded for file_name={file_name}")
-    return {"file_name": file_name, "status": "uploaded"}
+    reused = n_chunks - n_embedded
+    logger.info("chunks uploaded", extra={
+        "file": file_name, "chunks": n_chunks, "embedded": n_embedded, "reused": reused, "deleted": len(stale_ids)
+    })
+    return {
+        "file_name": file_name,
+        "status": "uploaded",
+        "chunks": n_chunks,
+        "embedded": n_embedded,
+        "reused": reused,
+        "deleted": len(stale_ids),
+    }
@@ -0,0 +1,252 @@
+# catalog.py
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+# One row per ingested document, maintained at ingest/delete time so listing
+# files never scans chunk payloads in the vector store.
+CATALOG_DB_PATH = os.getenv("CATALOG_DB_PATH", "catalog.db")
+
+_lock = threading.Lock()
+_initialized = False
+
+
+def _connect() -> sqlite3.Connection:
+    global _initialized
+    conn = sqlite3.connect(CATALOG_DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    if not _initialized:
+        with _lock:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    file_id TEXT PRIMARY KEY,
+                    file_name TEXT NOT NULL,
+                    doc_hash TEXT,
+                    page_count INTEGER NOT NULL DEFAULT 0,
+                    chunk_count INTEGER NOT NULL DEFAULT 0,
+                    ingested_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_file_name ON documents (file_name)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_doc_hash ON documents (doc_hash)")
+            # Root of the document's summary tree, NULL until summarized (and
+            # again after every new revision); catalogs from before it get the column
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(documents)")}
+            if "summary" not in columns:
+                conn.execute("ALTER TABLE documents ADD COLUMN summary TEXT")
+            # When a worker started summarizing the current revision (see claim_summary)
+            if "summary_started_at" not in columns:
+                conn.execute("ALTER TABLE documents ADD COLUMN summary_started_at REAL")
+            # The rest of the tree: section summaries (level 0) and reduce levels
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS summary_nodes (
+                    file_id TEXT NOT NULL,
+                    level INTEGER NOT NULL,
+                    position INTEGER NOT NULL,
+                    page_from INTEGER,
+                    page_to INTEGER,
+                    text TEXT NOT NULL,
+                    PRIMARY KEY (file_id, level, position)
+                )
+            """)
+            # Bumped on every corpus change; caches key on it
+            conn.execute("CREATE TABLE IF NOT EXISTS corpus (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO corpus (id, version) VALUES (1, 0)")
+            conn.commit()
+            _initialized = True
+    return conn
+
+
+def _bump_version(conn: sqlite3.Connection) -> None:
+    conn.execute("UPDATE corpus SET version = version + 1 WHERE id = 1")
+
+
+def _drop_stale_summaries(conn: sqlite3.Connection) -> None:
+    # Tree nodes of documents that were deleted, replaced or not yet re-summarized
+    conn.execute(
+        "DELETE FROM summary_nodes WHERE file_id NOT IN "
+        "(SELECT file_id FROM documents WHERE summary IS NOT NULL)"
+    )
+
+
+def corpus_version() -> int:
+    """
+    Counter that changes whenever documents are added, replaced or deleted.
+    """
+    with _connect() as conn:
+        return conn.execute("SELECT version FROM corpus WHERE id = 1").fetchone()[0]
+
+
+def upsert_document(file_id: str, file_name: str, doc_hash: Optional[str], page_count: int, chunk_count: int) -> None:
+    with _connect() as conn:
+        # A file name maps to one document; drop rows left by an older file_id
+        conn.execute("DELETE FROM documents WHERE file_name = ? AND file_id != ?", (file_name, file_id))
+        conn.execute(
+            "INSERT INTO documents (file_id, file_name, doc_hash, page_count, chunk_count, ingested_at) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(file_id) DO UPDATE SET file_name = excluded.file_name, doc_hash = excluded.doc_hash, "
+            "page_count = excluded.page_count, chunk_count = excluded.chunk_count, ingested_at = excluded.ingested_at, "
+            "summary = NULL, summary_started_at = NULL",
+            (file_id, file_name, doc_hash, page_count, chunk_count, time.time()),
+        )
+        _drop_stale_summaries(conn)
+        _bump_version(conn)
+
+
+def delete_document(file_name: str) -> None:
+    with _connect() as conn:
+        conn.execute("DELETE FROM documents WHERE file_name = ?", (file_name,))
+        _drop_stale_summaries(conn)
+        _bump_version(conn)
+
+
+def list_documents() -> List[Dict]:
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT file_id, file_name, doc_hash, page_count, chunk_count, ingested_at "
+            "FROM documents ORDER BY ingested_at"
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def get_document(file_name: str) -> Optional[Dict]:
+    with _connect() as conn:
+        row = conn.execute("SELECT * FROM documents WHERE file_name = ?", (file_name,)).fetchone()
+    return dict(row) if row else None
+
+
+def has_hash(doc_hash: str) -> bool:
+    with _connect() as conn:
+        return conn.execute("SELECT 1 FROM documents WHERE doc_hash = ? LIMIT 1", (doc_hash,)).fetchone() is not None
+
+
+def is_empty() -> bool:
+    with _connect() as conn:
+        return conn.execute("SELECT 1 FROM documents LIMIT 1").fetchone() is None
+
+
+def rebuild(records) -> None:
+    """
+    Rebuild the catalog from vector store records (payload needs file_id,
+    file_name, page and optionally doc_hash).
+    """
+    docs = {}
+    for r in records:
+        p = r.payload
+        if "file_id" not in p:
+            continue
+        doc = docs.setdefault(p["file_id"], {"file_name": p.get("file_name"), "doc_hash": p.get("doc_hash"), "pages": set(), "chunks": 0})
+        doc["pages"].add(p.get("page"))
+        doc["chunks"] += 1
+    with _connect() as conn:
+        conn.execute("DELETE FROM documents")
+        conn.executemany(
+            "INSERT INTO documents (file_id, file_name, doc_hash, page_count, chunk_count, ingested_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [(fid, d["file_name"], d["doc_hash"], len(d["pages"]), d["chunks"], time.time()) for fid, d in docs.items()],
+        )
+        _drop_stale_summaries(conn)
+        _bump_version(conn)
+
+
+def save_summary(file_id: str, doc_hash: Optional[str], summary: str, nodes: List[Dict]) -> bool:
+    """
+    Store a document's summary tree: the root summary and its nodes
+    ({"level", "position", "page_from", "page_to", "text"}). Ignored (returns
+    False) if the document was deleted or re-ingested meanwhile.
+    """
+    with _connect() as conn:
+        updated = conn.execute(
+            "UPDATE documents SET summary = ? WHERE file_id = ? AND doc_hash IS ?",
+            (summary, file_id, doc_hash),
+        ).rowcount
+        if not updated:
+            return False
+        conn.execute("DELETE FROM summary_nodes WHERE file_id = ?", (file_id,))
+        conn.executemany(
+            "INSERT INTO summary_nodes (file_id, level, position, page_from, page_to, text) VALUES (?, ?, ?, ?, ?, ?)",
+            [(file_id, n["level"], n["position"], n["page_from"], n["page_to"], n["text"]) for n in nodes],
+        )
+    return True
+
+
+def get_summaries(file_id: Optional[str] = None, file_name: Optional[str] = None) -> List[Dict]:
+    """
+    file_id, file_name, page_count and summary (None if not built yet) of
+    every document, or only the one matching file_id/file_name.
+    """
+    query = "SELECT file_id, file_name, page_count, summary FROM documents WHERE 1 = 1"
+    params = []
+    if file_id:
+        query += " AND file_id = ?"
+        params.append(file_id)
+    if file_name:
+        query += " AND file_name = ?"
+        params.append(file_name)
+    with _connect() as conn:
+        rows = conn.execute(query + " ORDER BY ingested_at", params).fetchall()
+    return [dict(r) for r in rows]
+
+
+def get_summary_nodes(file_id: str, level: int = 0) -> List[Dict]:
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT level, position, page_from, page_to, text FROM summary_nodes "
+            "WHERE file_id = ? AND level = ? ORDER BY position",
+            (file_id, level),
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def documents_without_summary() -> List[Dict]:
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT file_id, file_name, doc_hash FROM documents WHERE summary IS NULL ORDER BY ingested_at"
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def claim_summary(file_id: str, doc_hash: Optional[str], expires_after: float) -> bool:
+    """
+    Mark the document's current revision as being summarized, so other
+    workers skip it. False if it is summarized already, or claimed less than
+    expires_after seconds ago (a claim left by a failed or killed run
+    expires, and the document is retried).
+    """
+    now = time.time()
+    with _connect() as conn:
+        return conn.execute(
+            "UPDATE documents SET summary_started_at = ? WHERE file_id = ? AND doc_hash IS ? AND summary IS NULL "
+            "AND (summary_started_at IS NULL OR summary_started_at < ?)",
+            (now, file_id, doc_hash, now - expires_after),
+        ).rowcount == 1
+
+
+def release_summary_claim(file_id: str, doc_hash: Optional[str]) -> None:
+    with _connect() as conn:
+        conn.execute(
+            "UPDATE documents SET summary_started_at = NULL WHERE file_id = ? AND doc_hash IS ? AND summary IS NULL",
+            (file_id, doc_hash),
+        )
+
+
+def find_summary(doc_hash: str, exclude_file_id: str) -> Optional[Dict]:
+    """
+    file_name, summary and every tree node of another document with the
+    same content that is already summarized, or None.
+    """
+    with _connect() as conn:
+        doc = conn.execute(
+            "SELECT file_id, file_name, summary FROM documents "
+            "WHERE doc_hash = ? AND file_id != ? AND summary IS NOT NULL LIMIT 1",
+            (doc_hash, exclude_file_id),
+        ).fetchone()
+        if doc is None:
+            return None
+        nodes = conn.execute(
+            "SELECT level, position, page_from, page_to, text FROM summary_nodes WHERE file_id = ?",
+            (doc["file_id"],),
+        ).fetchall()
+    return {"file_name": doc["file_name"], "summary": doc["summary"], "nodes": [dict(n) for n in nodes]}
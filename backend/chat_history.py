@@ -1,29 +1,145 @@
 # chat_history.py
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
 
-# In-memory chat history (single user)
-history = []
+# Per-session chat history. Each session keeps a bounded ring buffer of its
+# last messages; sessions idle for longer than SESSION_IDLE_TTL are evicted.
+# HISTORY_BACKEND=memory keeps everything in this process (LRU-bounded to
+# MAX_SESSIONS); HISTORY_BACKEND=sqlite shares history across uvicorn workers.
+HISTORY_BACKEND = os.getenv("HISTORY_BACKEND", "memory").lower()
+HISTORY_DB_PATH = os.getenv("HISTORY_DB_PATH", "chat_history.db")
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "10"))
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "10000"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "3600"))
+# How often (seconds) the SQLite store deletes messages older than SESSION_IDLE_TTL
+HISTORY_PURGE_INTERVAL = float(os.getenv("HISTORY_PURGE_INTERVAL", "60"))
 
-def update_chat_history(user_input: str):
+DEFAULT_SESSION = "default"
+
+# Limit history to last 3 messages for brevity
+CONTEXT_MESSAGES = 3
+
+
+class MemoryHistoryStore:
+    def __init__(self):
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()  # id -> (last_seen, deque)
+        self._lock = threading.Lock()
+
+    def _evict(self, now: float) -> None:
+        # Oldest sessions are at the front
+        while self._sessions:
+            session_id, (last_seen, _) = next(iter(self._sessions.items()))
+            if len(self._sessions) > MAX_SESSIONS or now - last_seen > SESSION_IDLE_TTL:
+                self._sessions.popitem(last=False)
+            else:
+                break
+
+    def append(self, session_id: str, message: str) -> None:
+        now = time.time()
+        with self._lock:
+            _, messages = self._sessions.pop(session_id, (now, None))
+            if messages is None:
+                messages = deque(maxlen=HISTORY_MAX_MESSAGES)
+            messages.append(message)
+            self._sessions[session_id] = (now, messages)
+            self._evict(now)
+
+    def recent(self, session_id: str, n: int) -> list:
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or now - entry[0] > SESSION_IDLE_TTL:
+                return []
+            messages = entry[1]
+            return [messages[i] for i in range(max(0, len(messages) - n), len(messages))]
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class SQLiteHistoryStore:
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_created ON messages (created_at)")
+        self._conn.commit()
+
+    def append(self, session_id: str, message: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO messages (session_id, content, created_at) VALUES (?, ?, ?)",
+                (session_id, message, now),
+            )
+            # Keep the ring buffer bounded
+            self._conn.execute(
+                "DELETE FROM messages WHERE session_id = ? AND id NOT IN "
+                "(SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?)",
+                (session_id, session_id, HISTORY_MAX_MESSAGES),
+            )
+            # Expired messages are invisible to recent(); drop them now and
+            # then with a range delete on idx_messages_created
+            if now - self._last_purge > HISTORY_PURGE_INTERVAL:
+                self._conn.execute("DELETE FROM messages WHERE created_at < ?", (now - SESSION_IDLE_TTL,))
+                self._last_purge = now
+            self._conn.commit()
+
+    def recent(self, session_id: str, n: int) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT content FROM messages WHERE session_id = ? AND created_at >= ? ORDER BY id DESC LIMIT ?",
+                (session_id, time.time() - SESSION_IDLE_TTL, n),
+            ).fetchall()
+        return [r[0] for r in reversed(rows)]
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+
+if HISTORY_BACKEND == "sqlite":
+    store = SQLiteHistoryStore(HISTORY_DB_PATH)
+elif HISTORY_BACKEND == "memory":
+    store = MemoryHistoryStore()
+else:
+    raise ValueError(f"Unsupported HISTORY_BACKEND: {HISTORY_BACKEND}")
+
+
+def update_chat_history(user_input: str, session_id: str = DEFAULT_SESSION):
     """
-    Append the new user message to the chat history.
+    Append the new user message to the session's chat history.
     """
-    history.append(user_input)
+    store.append(session_id, user_input)
 
-def get_chat_context() -> str:
+def get_chat_context(session_id: str = DEFAULT_SESSION) -> str:
     """
-    Returns the last few messages as context for follow-up questions.
+    Returns the session's last few messages as context for follow-up questions.
     """
-    if not history:
+    recent_history = store.recent(session_id, CONTEXT_MESSAGES)
+    if not recent_history:
         return ""
 
-    # Limit history to last 3 messages for brevity
-    recent_history = history[-3:]
     context = "\n".join(f"User: {q}" for q in recent_history)
     return context
 
-def clear_chat_history():
+def clear_chat_history(session_id: str = DEFAULT_SESSION):
     """
-    Clear history when needed (e.g., on new upload).
+    Clear a session's history when needed (e.g., on new upload).
     """
-    global history
-    history.clear()
+    store.clear(session_id)
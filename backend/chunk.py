@@ -1,28 +1,126 @@
 import re
+from itertools import islice
 
-def chunk_text(pages, chunk_size=200, overlap=20):
-  
-    chunks = []
+# Shared with the lexical (BM25) index so both see the same tokens
+TOKEN_PATTERN = re.compile(r'\w+|\S')
+
+# Words that open a legal section when they start a line
+HEADING_WORDS = {"article", "section", "clause", "schedule", "annex", "exhibit", "appendix"}
+SENTENCE_END = {".", "?", "!", ";"}
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text)
+
+
+def batched(iterable, n):
+    """
+    Yield lists of up to n items from iterable.
+    """
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, n))
+        if not batch:
+            return
+        yield batch
+
+
+class _Token:
+    __slots__ = ("page", "start", "end", "heading", "sentence_end")
 
-    for page in pages:
-        text = page["text"]
-        page_number = page["page"]
-        source = page["source"]
+    def __init__(self, page, start, end, heading):
+        self.page = page
+        self.start = start
+        self.end = end
+        self.heading = heading
+        self.sentence_end = False
 
-        words = re.findall(r'\w+|\S', text)
-        start = 0
 
-        while start < len(words):
-            end = start + chunk_size
-            chunk_words = words[start:end]
-            chunk_text = " ".join(chunk_words)
+def _page_tokens(page_key, text):
+    """
+    Yield _Token offsets into text; no token strings are kept.
+    """
+    prev = None
+    line_start = True
+    for m in TOKEN_PATTERN.finditer(text):
+        if prev is not None:
+            gap = text[prev.end:m.start()]
+            line_start = "\n" in gap
+            # "." followed by whitespace ends a sentence; "1.2" does not
+            if gap and text[prev.start:prev.end] in SENTENCE_END:
+                prev.sentence_end = True
+        word = m.group()
+        heading = line_start and (word.lower() in HEADING_WORDS or word.isdigit())
+        tok = _Token(page_key, m.start(), m.end(), heading)
+        yield tok
+        prev = tok
+    if prev is not None:
+        prev.sentence_end = True  # a page end is a soft boundary too
 
-            chunks.append({
-                "text": chunk_text,
-                "page": page_number,
-                "source": source
-            })
 
-            start += chunk_size - overlap
+def _cut_point(window, chunk_size):
+    """
+    Best place to end a full window: before a heading, else after a sentence
+    end, searching back to half the budget; otherwise at the hard limit.
+    Returns (cut, at_heading).
+    """
+    floor = max(1, chunk_size // 2)
+    for i in range(chunk_size - 1, floor - 1, -1):
+        if window[i].heading:
+            return i, True
+    for i in range(chunk_size - 1, floor - 1, -1):
+        if window[i].sentence_end:
+            return i + 1, False
+    return chunk_size, False
 
-    return chunks
+
+def iter_chunks(pages, chunk_size=200, overlap=20, split_on_structure=True):
+    """
+    Lazily yield {"text", "page", "source"} chunks of at most chunk_size tokens
+    with `overlap` tokens carried into the next chunk. Chunks run across page
+    boundaries (page is where the chunk starts), and with split_on_structure
+    they end at section headings or sentence ends when one is in budget.
+    Chunk text is sliced from the page text, so only the pages still
+    referenced by the current window are held in memory.
+    """
+    texts = {}   # page key -> (text, page number, source)
+    window = []
+    fresh = 0    # tokens in window not yet emitted in any chunk
+
+    def emit(n):
+        toks = window[:n]
+        parts, first = [], toks[0]
+        run_start = first
+        for prev, tok in zip(toks, toks[1:] + [None]):
+            if tok is None or tok.page != prev.page:
+                parts.append(texts[prev.page][0][run_start.start:prev.end])
+                run_start = tok
+        _, page_number, source = texts[first.page]
+        return {"text": "\n".join(parts), "page": page_number, "source": source}
+
+    for key, page in enumerate(pages):
+        texts[key] = (page["text"], page["page"], page["source"])
+        for tok in _page_tokens(key, page["text"]):
+            window.append(tok)
+            fresh += 1
+            if len(window) >= chunk_size:
+                cut, at_heading = _cut_point(window, chunk_size) if split_on_structure else (chunk_size, False)
+                yield emit(cut)
+                # A new section starts clean; elsewhere carry the overlap
+                keep = 0 if at_heading else max(min(overlap, cut - 1), 0)
+                del window[:cut - keep]
+                fresh = len(window) - keep
+                # Forget pages no token refers to any more
+                oldest = window[0].page if window else key
+                for stale in [k for k in texts if k < oldest]:
+                    del texts[stale]
+
+    if window and fresh > 0:
+        yield emit(len(window))
+
+
+def chunk_text(pages, chunk_size=200, overlap=20):
+    """
+    List form of iter_chunks, for callers that need every chunk at once.
+    """
+    return list(iter_chunks(pages, chunk_size, overlap))
@@ -0,0 +1,194 @@
+# context_builder.py
+import os
+import threading
+from typing import Any, Dict, List, Tuple
+
+from chunk import TOKEN_PATTERN, tokenize
+
+# Packs retrieved chunks into the prompt context: chunks that continue each
+# other (same file and page, overlapping tokens) are stitched together,
+# near-duplicates are dropped with MMR, and the rest is packed under
+# CONTEXT_TOKEN_BUDGET. Tokens are counted with the chunker's tokenizer.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+DUPLICATE_THRESHOLD = float(os.getenv("DUPLICATE_THRESHOLD", "0.8"))
+
+# Longest token overlap looked for between two chunks (chunking uses 20)
+MAX_OVERLAP_TOKENS = 50
+SHINGLE_SIZE = 3
+
+
+class _Piece:
+    __slots__ = ("chunk", "text", "tokens", "rank")
+
+    def __init__(self, chunk: Dict[str, Any], rank: int):
+        self.chunk = chunk
+        self.text = chunk["text"]
+        self.tokens = tokenize(self.text)
+        self.rank = rank
+
+
+def _overlap(left: List[str], right: List[str]) -> int:
+    """
+    Number of tokens at the end of left that open right (0 if none).
+    """
+    for k in range(min(MAX_OVERLAP_TOKENS, len(left) - 1, len(right) - 1), 0, -1):
+        if left[-k:] == right[:k]:
+            return k
+    return 0
+
+
+def _after_tokens(text: str, k: int) -> str:
+    """
+    The part of text that follows its first k tokens.
+    """
+    end = 0
+    for i, m in enumerate(TOKEN_PATTERN.finditer(text)):
+        if i == k:
+            return text[end:]
+        end = m.end()
+    return ""
+
+
+def _merge_adjacent(pieces: List[_Piece]) -> List[_Piece]:
+    """
+    Stitch pieces whose tail overlaps another piece's head from the same file
+    and page. The merged piece keeps the better rank of the two.
+    """
+    merged = True
+    while merged:
+        merged = False
+        for a in pieces:
+            for b in pieces:
+                if a is b or a.chunk.get("file_name") != b.chunk.get("file_name") \
+                        or a.chunk.get("page") != b.chunk.get("page"):
+                    continue
+                k = _overlap(a.tokens, b.tokens)
+                if not k:
+                    continue
+                a.text = a.text + _after_tokens(b.text, k)
+                a.tokens = a.tokens + b.tokens[k:]
+                a.rank = min(a.rank, b.rank)
+                pieces = [p for p in pieces if p is not b]
+                merged = True
+                break
+            if merged:
+                break
+    return sorted(pieces, key=lambda p: p.rank)
+
+
+def stitch_chunks(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    The chunks with those that continue each other (same file and page,
+    overlapping tokens) merged into one, in order of first appearance.
+    """
+    pieces = _merge_adjacent([_Piece(chunk, rank) for rank, chunk in enumerate(chunks)])
+    return [dict(p.chunk, text=p.text) for p in pieces]
+
+
+def _shingles(tokens: List[str]) -> set:
+    words = [t.lower() for t in tokens if t.isalnum()]
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def _similarity(a: set, b: set) -> float:
+    # Overlap coefficient: a chunk contained in a merged piece counts as a duplicate
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+def _mmr_order(pieces: List[_Piece]) -> List[_Piece]:
+    """
+    Maximal marginal relevance over the search ranking. Relevance is the
+    piece's rank position; redundancy is shingle overlap with the
+    pieces already picked. Near-duplicates of a picked piece are dropped.
+    """
+    n = len(pieces)
+    shingles = [_shingles(p.tokens) for p in pieces]
+    relevance = [1.0 - i / n for i in range(n)]
+    remaining = list(range(n))
+    picked: List[int] = []
+    while remaining:
+        best, best_score = None, None
+        for i in list(remaining):
+            redundancy = max((_similarity(shingles[i], shingles[j]) for j in picked), default=0.0)
+            if redundancy >= DUPLICATE_THRESHOLD:
+                remaining.remove(i)
+                continue
+            score = MMR_LAMBDA * relevance[i] - (1 - MMR_LAMBDA) * redundancy
+            if best_score is None or score > best_score:
+                best, best_score = i, score
+        if best is None:
+            break
+        picked.append(best)
+        remaining.remove(best)
+    return [pieces[i] for i in picked]
+
+
+def _format(piece: _Piece) -> str:
+    meta = f"[Source: {piece.chunk['file_name']} - Page {piece.chunk['page']}]"
+    return f"{meta}\n{piece.text}"
+
+
+def build_context(chunks: List[Dict[str, Any]], token_budget: int = None) -> Tuple[str, Dict[str, int]]:
+    """
+    Build the prompt context from ranked chunks.
+    Returns (context, report) where report has the token counts before and
+    after assembly and how many tokens were saved.
+    """
+    budget = CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    pieces = [_Piece(chunk, rank) for rank, chunk in enumerate(chunks)]
+    tokens_in = sum(len(p.tokens) for p in pieces)
+
+    selected, used = [], 0
+    for piece in _mmr_order(_merge_adjacent(pieces)):
+        size = len(piece.tokens)
+        # Skip what does not fit; a smaller, lower-ranked piece still may.
+        # The best piece is always kept so the context is never empty.
+        if selected and used + size > budget:
+            continue
+        selected.append(piece)
+        used += size
+
+    report = {
+        "chunks_in": len(chunks),
+        "chunks_out": len(selected),
+        "tokens_in": tokens_in,
+        "tokens_out": used,
+        "tokens_saved": tokens_in - used,
+    }
+    _totals.add(report)
+    return "\n\n".join(_format(p) for p in selected), report
+
+
+class _Totals:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.tokens_in = 0
+        self.tokens_saved = 0
+
+    def add(self, report: Dict[str, int]) -> None:
+        with self._lock:
+            self.requests += 1
+            self.tokens_in += report["tokens_in"]
+            self.tokens_saved += report["tokens_saved"]
+
+    def stats(self) -> dict:
+        return {
+            "token_budget": CONTEXT_TOKEN_BUDGET,
+            "requests": self.requests,
+            "tokens_in": self.tokens_in,
+            "tokens_saved": self.tokens_saved,
+            "saved_ratio": round(self.tokens_saved / self.tokens_in, 4) if self.tokens_in else 0.0,
+        }
+
+
+_totals = _Totals()
+
+
+def stats() -> dict:
+    return _totals.stats()
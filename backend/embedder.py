@@ -0,0 +1,105 @@
+# embedder.py
+import logging
+import os
+import threading
+from typing import List
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from embedding_cache import get_cache, text_hash
+
+EMBEDDER_MODEL = os.getenv("EMBEDDER_MODEL", "all-MiniLM-L6-v2")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0"))  # 0 = torch default
+
+logger = logging.getLogger(__name__)
+
+# One model per process, shared by retrieval and ingestion
+_model = None
+_ready = False
+_lock = threading.Lock()
+
+
+def get_model() -> SentenceTransformer:
+    """
+    Return the process-wide SentenceTransformer, loading it on first use.
+    """
+    global _model
+    if _model is None:
+        with _lock:
+            if _model is None:
+                if EMBED_THREADS > 0:
+                    import torch
+                    torch.set_num_threads(EMBED_THREADS)
+                _model = SentenceTransformer(EMBEDDER_MODEL)
+    return _model
+
+
+def warm_up() -> None:
+    """
+    Load the model and run one dummy encode so the first request is fast.
+    Called from the FastAPI startup hook.
+    """
+    global _ready
+    get_model().encode(["warm up"], batch_size=1)
+    _ready = True
+    logger.info("embedder ready", extra={"model": EMBEDDER_MODEL})
+
+
+def is_ready() -> bool:
+    """
+    Readiness probe: True once the model is loaded and warmed up.
+    """
+    return _ready
+
+
+def get_dimension() -> int:
+    return get_model().get_sentence_embedding_dimension()
+
+
+def _run_model(texts: List[str], batch_size: int = None) -> np.ndarray:
+    return get_model().encode(
+        texts,
+        batch_size=batch_size or EMBED_BATCH_SIZE,
+        convert_to_numpy=True,
+        show_progress_bar=False,
+    ).astype(np.float32, copy=False)
+
+
+def _encode(texts: List[str], batch_size: int = None) -> np.ndarray:
+    if not texts:
+        return np.zeros((0, get_dimension()), dtype=np.float32)
+
+    cache = get_cache()
+    if cache is None:
+        return _run_model(texts, batch_size)
+
+    # Only run the model on texts the embedding cache has not seen
+    hashes = [text_hash(t) for t in texts]
+    cached = cache.get_many(EMBEDDER_MODEL, hashes)
+    missing = {}
+    for h, t in zip(hashes, texts):
+        if h not in cached and h not in missing:
+            missing[h] = t
+    if missing:
+        fresh = _run_model(list(missing.values()), batch_size)
+        computed = dict(zip(missing.keys(), fresh))
+        cache.put_many(EMBEDDER_MODEL, computed)
+        cached.update(computed)
+
+    return np.stack([cached[h] for h in hashes])
+
+
+def encode_queries(queries: List[str], batch_size: int = None) -> np.ndarray:
+    """
+    Encode user questions. Returns a (len(queries), dim) float32 array.
+    """
+    return _encode(queries, batch_size)
+
+
+def encode_passages(passages: List[str], batch_size: int = None) -> np.ndarray:
+    """
+    Encode document chunks. Returns a (len(passages), dim) float32 array.
+    """
+    return _encode(passages, batch_size)
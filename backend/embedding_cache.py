@@ -0,0 +1,145 @@
+# embedding_cache.py
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# On-disk cache of embeddings keyed by (model, normalized text hash), shared
+# by ingestion (repeated boilerplate clauses) and queries (repeated questions).
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "true").lower() == "true"
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "embedding_cache.db")
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "500000"))
+# LRU recency is written back at most this often (seconds); eviction only
+# needs it roughly right, and lookups stay read-only on the query path
+EMBED_CACHE_TOUCH_INTERVAL = float(os.getenv("EMBED_CACHE_TOUCH_INTERVAL", "30"))
+
+
+def normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(normalize(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    SQLite-backed LRU cache of float32 vectors with hit/miss counters.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._touched: Dict[tuple, float] = {}  # (model, hash) -> last use not yet written
+        self._last_flush = time.monotonic()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # A cache can lose its last transactions on power loss; no fsync per commit
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, np.ndarray]:
+        """
+        Return {text_hash: vector} for the hashes present in the cache.
+        """
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for i in range(0, len(unique), 500):
+                batch = unique[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector, last_used FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    (model, *batch),
+                ).fetchall()
+                now = time.time()
+                for h, blob, last_used in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32)
+                    if now - last_used > EMBED_CACHE_TOUCH_INTERVAL:
+                        self._touched[(model, h)] = now
+            if self._touched and time.monotonic() - self._last_flush > EMBED_CACHE_TOUCH_INTERVAL:
+                self._flush_touched()
+                self._conn.commit()
+            self.hits += sum(1 for h in hashes if h in found)
+            self.misses += sum(1 for h in hashes if h not in found)
+        return found
+
+    def _flush_touched(self) -> None:
+        # Caller holds the lock and commits
+        self._conn.executemany(
+            "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+            [(now, model, h) for (model, h), now in self._touched.items()],
+        )
+        self._touched.clear()
+        self._last_flush = time.monotonic()
+
+    def put_many(self, model: str, entries: Dict[str, np.ndarray]) -> None:
+        if not entries:
+            return
+        now = time.time()
+        with self._lock:
+            if self._touched:
+                self._flush_touched()  # evict by up-to-date recency
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(model, h, np.asarray(v, dtype=np.float32).tobytes(), now) for h, v in entries.items()],
+            )
+            self._size += self._conn.total_changes - before
+            overflow = self._size - self.max_entries
+            if overflow > 0:
+                # Evict least recently used entries
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN "
+                    "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (overflow,),
+                )
+                self._size -= overflow
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": self._size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[EmbeddingCache]:
+    """
+    Return the process-wide cache, or None when EMBED_CACHE_ENABLED=false.
+    """
+    global _cache
+    if not EMBED_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache(EMBED_CACHE_PATH, EMBED_CACHE_MAX_ENTRIES)
+    return _cache
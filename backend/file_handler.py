@@ -1,78 +1,284 @@
+import logging
 import os
-import fitz  # PyMuPDF
-import docx
-from pptx import Presentation
-from PyPDF2 import PdfReader
-from typing import List, Tuple
-from pdf2image import convert_from_bytes
-import pytesseract
-
-def extract_text_from_file(filename: str, content: bytes) -> List[Tuple[str, int, str]]:
-    ext = os.path.splitext(filename)[1].lower()
-    
-    if ext == ".txt":
-        return extract_text_from_txt(content, filename)
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from io import BytesIO
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-    elif ext == ".pdf":
-        return extract_text_from_pdf(content, filename)
+from workers import MAX_CONCURRENT_UPLOADS
 
-    elif ext == ".docx":
-        return extract_text_from_docx(content, filename)
+# OCR settings; tesseract/poppler default to whatever is on PATH
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+# Up to MAX_CONCURRENT_UPLOADS files are extracted at once, each with its own
+# OCR pool, so every pool gets its share of the cores
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(max(1, (os.cpu_count() or 1) // MAX_CONCURRENT_UPLOADS))))
+# OpenMP threads per tesseract process; parallelism comes from OCR_WORKERS
+OCR_THREADS = os.getenv("OCR_THREADS", "1")
+OCR_WINDOW = int(os.getenv("OCR_WINDOW", str(2 * OCR_WORKERS)))  # pages rendered/in flight at once
+TESSERACT_CMD = os.getenv("TESSERACT_CMD")
+POPPLER_PATH = os.getenv("POPPLER_PATH")
+# "blocks" reads PyMuPDF text blocks in layout order; "plain" is get_text()
+PDF_TEXT_MODE = os.getenv("PDF_TEXT_MODE", "blocks").lower()
+# Minimum seconds between extract_document progress reports
+EXTRACT_PROGRESS_INTERVAL = 0.5
 
-    elif ext == ".pptx":
-        return extract_text_from_pptx(content, filename)
+Page = Tuple[str, int, str]  # (page_text, page_number, source)
 
-    else:
+logger = logging.getLogger(__name__)
+
+# Extension -> page generator. Each loader imports its parser on first use,
+# so the API and worker processes only pay for the formats they see.
+LOADERS: Dict[str, Callable[[bytes, str], Iterator[Page]]] = {}
+
+
+def register_loader(*extensions: str):
+    def decorator(fn):
+        for ext in extensions:
+            LOADERS[ext] = fn
+        return fn
+    return decorator
+
+
+def iter_pages(filename: str, content: bytes) -> Iterator[Page]:
+    """
+    Yield (page_text, page_number, source) for the file, page by page.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    loader = LOADERS.get(ext)
+    if loader is None:
         raise ValueError(f"Unsupported file format: {ext}")
+    return loader(content, filename)
+
+
+def extract_text_from_file(filename: str, content: bytes) -> List[Page]:
+    # List form of iter_pages; results cross a process boundary in jobs.py
+    return list(iter_pages(filename, content))
+
+
+_ocr_pages = 0  # pages OCR'd by the current extract_document call
+_pages_done = 0  # pages read or OCR'd so far by the current call
+_progress: Optional[Callable[[int], None]] = None
+_progress_at = 0.0
+
+
+def _advance(pages_done: int) -> None:
+    # Report at most every EXTRACT_PROGRESS_INTERVAL seconds
+    global _pages_done, _progress_at
+    _pages_done = max(_pages_done, pages_done)
+    now = time.monotonic()
+    if _progress is not None and now - _progress_at >= EXTRACT_PROGRESS_INTERVAL:
+        _progress_at = now
+        _progress(_pages_done)
+
+
+def extract_document(
+    filename: str,
+    content: bytes,
+    progress: Optional[Callable[[int], None]] = None
+) -> Tuple[List[Page], Dict[str, int]]:
+    """
+    extract_text_from_file plus extraction stats: {"ocr_pages": n}.
+    progress(pages_done), if given, is called as pages are read and OCR'd.
+    """
+    global _ocr_pages, _pages_done, _progress, _progress_at
+    _ocr_pages, _pages_done, _progress, _progress_at = 0, 0, progress, 0.0
+    try:
+        pages = []
+        for page in iter_pages(filename, content):
+            pages.append(page)
+            _advance(len(pages))
+    finally:
+        _progress = None
+    return pages, {"ocr_pages": _ocr_pages}
+
+_ocr_content = None
+
+
+def _init_ocr_worker(content: bytes) -> None:
+    # Each OCR process receives the PDF bytes once, not once per page
+    global _ocr_content
+    _ocr_content = content
+
+
+def _ocr_page(page_number: int, content: Optional[bytes] = None) -> Tuple[str, int]:
+    """
+    Render a single page and OCR it, so only one page image is in memory.
+    """
+    from pdf2image import convert_from_bytes
+    import pytesseract
+
+    if TESSERACT_CMD:
+        pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+    # Inherited by the tesseract subprocess; only ever set in extraction/OCR processes
+    os.environ["OMP_THREAD_LIMIT"] = OCR_THREADS
+    images = convert_from_bytes(
+        content if content is not None else _ocr_content,
+        dpi=OCR_DPI,
+        first_page=page_number,
+        last_page=page_number,
+        poppler_path=POPPLER_PATH,
+    )
+    text = pytesseract.image_to_string(images[0]) if images else ""
+    return text, page_number
+
+
+def iter_ocr_pages(content: bytes, page_numbers: Iterable[int]) -> Iterator[Tuple[str, int]]:
+    """
+    OCR the given 1-based pages across a process pool, keeping at most
+    OCR_WINDOW pages in flight. Yields (text, page_number) as each page
+    finishes, so results may arrive out of order.
+    """
+    page_numbers = list(page_numbers)
+    if OCR_WORKERS <= 1 or len(page_numbers) <= 1:
+        for page_number in page_numbers:
+            yield _ocr_page(page_number, content)
+        return
+
+    workers = min(OCR_WORKERS, len(page_numbers))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_ocr_worker, initargs=(content,)) as pool:
+        remaining = iter(page_numbers)
+        pending = set()
+        for page_number in remaining:
+            pending.add(pool.submit(_ocr_page, page_number))
+            if len(pending) >= OCR_WINDOW:
+                break
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+                next_page = next(remaining, None)
+                if next_page is not None:
+                    pending.add(pool.submit(_ocr_page, next_page))
 
-# --- Each function returns List[(page_text, page_number, source)] ---
-pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 
 def extract_text_with_ocr_from_bytes(content: bytes) -> List[Tuple[str, int]]:
-    pages = convert_from_bytes(content, dpi=300,poppler_path=r'C:\Users\Admin\Downloads\Release-24.08.0-0\poppler-24.08.0\Library\bin')
-    ocr_pages = []  # <- define this list here
+    import fitz  # PyMuPDF
+
+    with fitz.open(stream=content, filetype="pdf") as doc:
+        page_count = doc.page_count
+    return sorted(iter_ocr_pages(content, range(1, page_count + 1)), key=lambda p: p[1])
 
-    for i, page_img in enumerate(pages):
-        text = pytesseract.image_to_string(page_img)
-        ocr_pages.append((text, i + 1))  # Append tuple (text, page number)
 
-    return ocr_pages
+def _page_text(page) -> str:
+    if PDF_TEXT_MODE == "plain":
+        return page.get_text()
+    # Text blocks (type 0) sorted into reading order; image blocks are skipped
+    blocks = page.get_text("blocks", sort=True)
+    return "\n".join(b[4].strip() for b in blocks if b[6] == 0 and b[4].strip())
 
-def extract_text_from_pdf(content: bytes, source: str) -> List[Tuple[str, int, str]]:
-    pages = []
+
+@register_loader(".pdf")
+def iter_pdf_pages(content: bytes, source: str) -> Iterator[Page]:
+    import fitz  # PyMuPDF
+
+    # One pass with PyMuPDF; pages are streamed as they are read until one
+    # without a text layer shows up, after which pages wait for its OCR
+    pending: List[Page] = []
+    empty_pages = []
+    processed = 0
     with fitz.open(stream=content, filetype="pdf") as doc:
         for i, page in enumerate(doc):
-            pages.append((page.get_text(), i + 1, source))
-     # Check total extracted text length
-    total_text = "".join([p[0].strip() for p in pages])
-    if len(total_text) < 100:
-        print("Normal PDF extraction returned too little text; falling back to OCR...")
-        # OCR extracts full text as a single string
-        ocr_pages = extract_text_with_ocr_from_bytes(content)
-       
-        pages = [(text, page_num, source) for text, page_num in ocr_pages]
+            text = _page_text(page)
+            if not text.strip():
+                empty_pages.append(i + 1)
+            else:
+                processed += 1
+                _advance(processed)
+            if empty_pages:
+                pending.append((text, i + 1, source))
+            else:
+                yield text, i + 1, source
+
+    # OCR only the pages PyMuPDF found no text on (scans, image-only pages)
+    if empty_pages:
+        global _ocr_pages
+        _ocr_pages += len(empty_pages)
+        logger.info("running OCR on pages without a text layer", extra={"source": source, "pages": len(empty_pages)})
+        first = pending[0][1]
+        for text, page_num in iter_ocr_pages(content, empty_pages):
+            pending[page_num - first] = (text, page_num, source)
+            processed += 1
+            _advance(processed)
+        yield from pending
     else:
-        print("Normal PDF extraction succeeded.")
-    return pages
+        logger.info("pdf text extracted", extra={"source": source})
+
+
+def extract_text_from_pdf(content: bytes, source: str) -> List[Page]:
+    return list(iter_pdf_pages(content, source))
+
+
+def _docx_table_lines(table) -> Iterator[str]:
+    for row in table.rows:
+        cells = []
+        for cell in row.cells:
+            text = cell.text.strip()
+            # Merged cells repeat across the span; keep them once
+            if not cells or cells[-1] != text:
+                cells.append(text)
+        if any(cells):
+            yield " | ".join(cells)
+
+
+@register_loader(".docx")
+def iter_docx_pages(content: bytes, source: str) -> Iterator[Page]:
+    import docx
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
 
-def extract_text_from_docx(content: bytes, source: str) -> List[Tuple[str, int, str]]:
-    from io import BytesIO
     doc = docx.Document(BytesIO(content))
-    full_text = "\n".join([para.text for para in doc.paragraphs])
-    return [(full_text, 1, source)]  # Treat as one page
+    lines = []
+    # Section headers first, each distinct header once
+    seen_headers = set()
+    for section in doc.sections:
+        header = "\n".join(p.text for p in section.header.paragraphs if p.text.strip())
+        if header and header not in seen_headers:
+            seen_headers.add(header)
+            lines.append(header)
+    # Body paragraphs and tables in document order
+    for child in doc.element.body.iterchildren():
+        tag = child.tag.rsplit("}", 1)[-1]
+        if tag == "p":
+            lines.append(Paragraph(child, doc).text)
+        elif tag == "tbl":
+            lines.extend(_docx_table_lines(Table(child, doc)))
+    yield "\n".join(lines), 1, source  # Treat as one page
+
+
+def extract_text_from_docx(content: bytes, source: str) -> List[Page]:
+    return list(iter_docx_pages(content, source))
+
+
+def _pptx_shape_lines(shape) -> Iterator[str]:
+    if getattr(shape, "has_text_frame", False) and shape.has_text_frame:
+        yield shape.text_frame.text
+    elif getattr(shape, "has_table", False) and shape.has_table:
+        for row in shape.table.rows:
+            yield " | ".join(cell.text.strip() for cell in row.cells)
+    elif hasattr(shape, "shapes"):  # group shape
+        for child in shape.shapes:
+            yield from _pptx_shape_lines(child)
+
+
+@register_loader(".pptx")
+def iter_pptx_pages(content: bytes, source: str) -> Iterator[Page]:
+    from pptx import Presentation
 
-def extract_text_from_pptx(content: bytes, source: str) -> List[Tuple[str, int, str]]:
-    from io import BytesIO
     prs = Presentation(BytesIO(content))
-    pages = []
     for i, slide in enumerate(prs.slides):
-        slide_text = ""
-        for shape in slide.shapes:
-            if hasattr(shape, "text"):
-                slide_text += shape.text + "\n"
-        pages.append((slide_text.strip(), i + 1, source))
-    return pages
-
-def extract_text_from_txt(content: bytes, source: str) -> List[Tuple[str, int, str]]:
+        lines = [line for shape in slide.shapes for line in _pptx_shape_lines(shape)]
+        yield "\n".join(lines).strip(), i + 1, source
+
+
+def extract_text_from_pptx(content: bytes, source: str) -> List[Page]:
+    return list(iter_pptx_pages(content, source))
+
+
+@register_loader(".txt")
+def iter_txt_pages(content: bytes, source: str) -> Iterator[Page]:
     text = content.decode("utf-8", errors="ignore")
-    return [(text, 1, source)]  # Treat as one page
+    yield text, 1, source  # Treat as one page
+
+
+def extract_text_from_txt(content: bytes, source: str) -> List[Page]:
+    return list(iter_txt_pages(content, source))
@@ -0,0 +1,244 @@
+# jobs.py
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from build_vector_store import build_and_save_index
+from file_handler import extract_document
+import observability
+import summaries
+from observability import timed
+from workers import MAX_CONCURRENT_UPLOADS, MAX_QUEUED_UPLOADS, ServerBusyError, run_cpu_with_progress, run_ingest
+
+# Job state lives in SQLite so GET /jobs/{id} works from any uvicorn worker;
+# the queue itself is in-process (no broker needed).
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.db")
+
+logger = logging.getLogger(__name__)
+
+_queue: Optional[asyncio.Queue] = None
+_worker_tasks: List[asyncio.Task] = []
+_db_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(JOBS_DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def init_db() -> None:
+    with _db_lock, _connect() as conn:
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS job_files (
+                job_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                file_name TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                status TEXT,
+                pages_processed INTEGER NOT NULL DEFAULT 0,
+                chunks INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                PRIMARY KEY (job_id, position)
+            );
+        """)
+        # Which process runs the job; older databases get the column
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if "owner_pid" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN owner_pid INTEGER")
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def fail_interrupted_jobs() -> int:
+    """
+    The queue is in memory, so jobs left queued/running by a process that is
+    gone (restart, crash) will never finish: mark them failed. Jobs owned by
+    other live uvicorn workers are left alone. Returns how many were failed.
+    """
+    me = os.getpid()
+    with _db_lock, _connect() as conn:
+        rows = conn.execute("SELECT job_id, owner_pid FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+        # Our own pid can only belong to a previous run (e.g. pid 1 in a container)
+        stale = [
+            r["job_id"] for r in rows
+            if r["owner_pid"] is None or r["owner_pid"] == me or not _process_alive(r["owner_pid"])
+        ]
+        now = time.time()
+        conn.executemany(
+            "UPDATE jobs SET status = 'failed', updated_at = ? WHERE job_id = ?", [(now, j) for j in stale]
+        )
+        conn.executemany(
+            "UPDATE job_files SET stage = 'failed', status = 'failed', error = ? "
+            "WHERE job_id = ? AND stage NOT IN ('done', 'failed')",
+            [("Interrupted by a server restart, please upload again", j) for j in stale],
+        )
+    return len(stale)
+
+
+def _set_job_status(job_id: str, status: str) -> None:
+    with _db_lock, _connect() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?",
+            (status, time.time(), job_id),
+        )
+
+
+def _update_file(job_id: str, position: int, **fields) -> None:
+    columns = ", ".join(f"{key} = ?" for key in fields)
+    with _db_lock, _connect() as conn:
+        conn.execute(
+            f"UPDATE job_files SET {columns} WHERE job_id = ? AND position = ?",
+            (*fields.values(), job_id, position),
+        )
+        conn.execute("UPDATE jobs SET updated_at = ? WHERE job_id = ?", (time.time(), job_id))
+
+
+def get_job(job_id: str) -> Optional[Dict]:
+    """
+    Return {"job_id", "status", "files": [...]} or None if unknown.
+    """
+    with _connect() as conn:
+        job = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if job is None:
+            return None
+        files = conn.execute(
+            "SELECT file_name, stage, status, pages_processed, chunks, error "
+            "FROM job_files WHERE job_id = ? ORDER BY position",
+            (job_id,),
+        ).fetchall()
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "files": [dict(f) for f in files],
+    }
+
+
+def _insert_job(job_id: str, files: List[Tuple[str, bytes]]) -> None:
+    now = time.time()
+    with _db_lock, _connect() as conn:
+        conn.execute(
+            "INSERT INTO jobs (job_id, status, created_at, updated_at, owner_pid) VALUES (?, 'queued', ?, ?, ?)",
+            (job_id, now, now, os.getpid()),
+        )
+        conn.executemany(
+            "INSERT INTO job_files (job_id, position, file_name, stage) VALUES (?, ?, ?, 'queued')",
+            [(job_id, i, name) for i, (name, _) in enumerate(files)],
+        )
+
+
+async def enqueue(files: List[Tuple[str, bytes]]) -> str:
+    """
+    Record a new ingestion job for [(file_name, content)] and queue it.
+    Raises ServerBusyError if the queue is full.
+    """
+    if _queue is None:
+        raise RuntimeError("Ingestion workers are not running")
+    if _queue.full():
+        raise ServerBusyError("Too many pending uploads, please retry shortly")
+
+    job_id = str(uuid.uuid4())
+    await asyncio.to_thread(_insert_job, job_id, files)
+    try:
+        _queue.put_nowait((job_id, files))
+    except asyncio.QueueFull:
+        # Filled up by another upload while the row was being written
+        await asyncio.to_thread(_set_job_status, job_id, "failed")
+        raise ServerBusyError("Too many pending uploads, please retry shortly")
+    return job_id
+
+
+async def _ingest_file(job_id: str, position: int, file_name: str, content: bytes) -> bool:
+    try:
+        await asyncio.to_thread(_update_file, job_id, position, stage="extracting")
+
+        # Relayed from the extraction process while it reads and OCRs pages
+        def extracted(pages_done: int):
+            _update_file(job_id, position, pages_processed=pages_done)
+
+        pages, extraction = await timed(
+            "extract", run_cpu_with_progress(extracted, extract_document, file_name, content)
+        )
+        await asyncio.to_thread(_update_file, job_id, position, pages_processed=len(pages))
+        observability.INGEST_BYTES.inc(len(content))
+        observability.INGEST_PAGES.inc(len(pages))
+        observability.INGEST_OCR_PAGES.inc(extraction["ocr_pages"])
+
+        # Called from the ingestion thread, so it can write directly
+        def progress(stage: str, **fields):
+            _update_file(job_id, position, stage=stage, **fields)
+
+        result = await timed("index", run_ingest(build_and_save_index, pages, progress))
+        await asyncio.to_thread(_update_file, job_id, position, stage="done", status=result["status"])
+        observability.INGEST_CHUNKS.inc(result.get("chunks", 0))
+        observability.INGEST_FILES.labels(result["status"]).inc()
+        logger.info("file ingested", extra=dict(result, pages=len(pages), bytes=len(content), **extraction))
+        # The summary tree is built in the background; the file is searchable already
+        await summaries.schedule(pages)
+        return True
+    except Exception as e:
+        observability.INGEST_FILES.labels("failed").inc()
+        logger.exception("ingestion failed", extra={"file": file_name})
+        await asyncio.to_thread(_update_file, job_id, position, stage="failed", status="failed", error=str(e))
+        return False
+
+
+async def _worker() -> None:
+    while True:
+        job_id, files = await _queue.get()
+        # Logs for this job carry its id in place of a request id
+        observability.request_id_var.set(job_id)
+        try:
+            await asyncio.to_thread(_set_job_status, job_id, "running")
+            ok = True
+            for position, (file_name, content) in enumerate(files):
+                ok = await _ingest_file(job_id, position, file_name, content) and ok
+            await asyncio.to_thread(_set_job_status, job_id, "done" if ok else "failed")
+        except Exception as e:
+            logger.exception("job crashed")
+            await asyncio.to_thread(_set_job_status, job_id, "failed")
+        finally:
+            _queue.task_done()
+
+
+async def start_workers() -> None:
+    """
+    Fail jobs interrupted by a restart, then create the queue and
+    MAX_CONCURRENT_UPLOADS worker tasks. Called from FastAPI startup.
+    """
+    global _queue
+    await asyncio.to_thread(init_db)
+    interrupted = await asyncio.to_thread(fail_interrupted_jobs)
+    if interrupted:
+        logger.warning("marked interrupted jobs as failed", extra={"jobs": interrupted})
+    _queue = asyncio.Queue(maxsize=MAX_QUEUED_UPLOADS)
+    for _ in range(MAX_CONCURRENT_UPLOADS):
+        _worker_tasks.append(asyncio.create_task(_worker()))
+
+
+async def stop_workers() -> None:
+    for task in _worker_tasks:
+        task.cancel()
+    await asyncio.gather(*_worker_tasks, return_exceptions=True)
+    _worker_tasks.clear()
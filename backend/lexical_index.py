@@ -0,0 +1,366 @@
+# lexical_index.py
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from chunk import tokenize
+from vector_store import Range
+
+# BM25 inverted index over chunk texts, kept next to the vector store so
+# exact terms (clause numbers, party names, defined terms) can be matched.
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "lexical_index.db")
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+# Rebuild postings once this fraction of documents has been deleted
+COMPACT_RATIO = 0.3
+# How often (seconds) each process applies index changes made by other
+# uvicorn workers; searches never wait for it
+LEXICAL_SYNC_INTERVAL = float(os.getenv("LEXICAL_SYNC_INTERVAL", "2"))
+
+FILTER_FIELDS = ("file_id", "file_name", "page")
+
+logger = logging.getLogger(__name__)
+
+
+def terms(text: str) -> List[str]:
+    """
+    Lowercased word tokens from the chunker's tokenizer (punctuation dropped).
+    """
+    return [t.lower() for t in tokenize(text) if t[0].isalnum() or t[0] == "_"]
+
+
+def analyze(point_id: str, text: str, payload: dict) -> tuple:
+    """
+    (point_id, term counts, token count, FILTER_FIELDS values) for a chunk.
+    """
+    tokens = terms(text)
+    return point_id, dict(Counter(tokens)), len(tokens), tuple(payload.get(f) for f in FILTER_FIELDS)
+
+
+class LexicalIndex:
+    """
+    Postings are per-term int32 doc numbers + float32 term frequencies held
+    in array.array buffers, so appending is cheap and scoring views them as
+    NumPy arrays without copying. Deletes are tombstones until compaction.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.doc_ids: List[Optional[str]] = []      # doc number -> point id (None if deleted)
+        self.doc_fields: List[tuple] = []           # doc number -> values of FILTER_FIELDS
+        self.doc_len = array("f")
+        self.alive = bytearray()                    # doc number -> 1 if live
+        self.doc_row: Dict[str, int] = {}           # point id -> doc number
+        self.fields: Dict[str, Dict[str, set]] = {f: {} for f in FILTER_FIELDS}
+        self.live = 0
+        self.total_len = 0.0
+
+    def add(self, point_id: str, counts: Dict[str, int], length: int, fields: tuple) -> None:
+        """
+        Index a document given its term counts, token count and the values
+        of FILTER_FIELDS (see `analyze`).
+        """
+        if point_id in self.doc_row:
+            self.remove([point_id])
+        doc = len(self.doc_ids)
+        self.doc_ids.append(point_id)
+        self.doc_len.append(length)
+        self.alive.append(1)
+        self.doc_row[point_id] = doc
+        self.doc_fields.append(tuple(fields))
+        for field, value in zip(FILTER_FIELDS, self.doc_fields[doc]):
+            if value is not None:
+                self.fields[field].setdefault(value, set()).add(doc)
+        for term, tf in counts.items():
+            docs, tfs = self.postings.setdefault(term, (array("i"), array("f")))
+            docs.append(doc)
+            tfs.append(tf)
+        self.live += 1
+        self.total_len += length
+
+    def remove(self, point_ids: Iterable[str]) -> None:
+        for point_id in point_ids:
+            doc = self.doc_row.pop(point_id, None)
+            if doc is None:
+                continue
+            self.doc_ids[doc] = None
+            self.alive[doc] = 0
+            for field, value in zip(FILTER_FIELDS, self.doc_fields[doc]):
+                docs = self.fields[field].get(value)
+                if docs is not None:
+                    docs.discard(doc)
+                    if not docs:
+                        del self.fields[field][value]
+            self.live -= 1
+            self.total_len -= self.doc_len[doc]
+        if self.doc_ids and (len(self.doc_ids) - self.live) / len(self.doc_ids) > COMPACT_RATIO:
+            self._compact()
+
+    def point_ids_where(self, field: str, value: str) -> List[str]:
+        return [self.doc_ids[d] for d in self.fields[field].get(value, ()) if self.doc_ids[d] is not None]
+
+    def _docs_where(self, field: str, value) -> set:
+        values = self.fields.get(field, {})
+        if isinstance(value, Range):
+            return set().union(*(docs for v, docs in values.items() if v in value))
+        return values.get(value, set())
+
+    def _compact(self) -> None:
+        alive = np.frombuffer(self.alive, dtype=bool).copy()
+        remap = np.cumsum(alive, dtype=np.int64) - 1
+        postings = {}
+        for term, (docs, tfs) in self.postings.items():
+            d = np.frombuffer(docs, dtype=np.int32)
+            keep = alive[d]
+            if keep.any():
+                postings[term] = (
+                    array("i", remap[d[keep]].astype(np.int32).tobytes()),
+                    array("f", np.frombuffer(tfs, dtype=np.float32)[keep].tobytes()),
+                )
+        self.postings = postings
+        self.doc_len = array("f", np.frombuffer(self.doc_len, dtype=np.float32)[alive].tobytes())
+        self.doc_fields = [f for f, a in zip(self.doc_fields, alive) if a]
+        self.alive = bytearray([1]) * int(alive.sum())
+        self.doc_ids = [d for d in self.doc_ids if d is not None]
+        self.doc_row = {pid: i for i, pid in enumerate(self.doc_ids)}
+        self.fields = {field: {} for field in FILTER_FIELDS}
+        for doc, values in enumerate(self.doc_fields):
+            for field, value in zip(FILTER_FIELDS, values):
+                if value is not None:
+                    self.fields[field].setdefault(value, set()).add(doc)
+
+    def search(self, query: str, limit: int, where: Optional[dict] = None) -> List[Tuple[str, float]]:
+        """
+        Top `limit` (point_id, bm25_score) pairs, optionally restricted to
+        documents matching {file_id/file_name/page: value or Range}.
+        """
+        n_docs = len(self.doc_ids)
+        if not self.live or not n_docs:
+            return []
+        alive = np.frombuffer(self.alive, dtype=bool)
+        allowed = alive
+        if where:
+            docs = None
+            for field, value in where.items():
+                matching = self._docs_where(field, value)
+                docs = matching if docs is None else docs & matching
+            if not docs:
+                return []
+            allowed = np.zeros(n_docs, dtype=bool)
+            allowed[list(docs)] = True
+            allowed &= alive
+
+        doc_len = np.frombuffer(self.doc_len, dtype=np.float32)
+        avgdl = self.total_len / self.live
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len / max(avgdl, 1e-9))
+        scores = np.zeros(n_docs, dtype=np.float32)
+        for term in set(terms(query)):
+            if term not in self.postings:
+                continue
+            docs, tfs = self.postings[term]
+            d = np.frombuffer(docs, dtype=np.int32)
+            tf = np.frombuffer(tfs, dtype=np.float32)
+            df = int(np.count_nonzero(alive[d]))
+            if df == 0:
+                continue
+            idf = math.log(1 + (self.live - df + 0.5) / (df + 0.5))
+            scores += np.bincount(d, weights=idf * tf * (BM25_K1 + 1) / (tf + norm[d]), minlength=n_docs).astype(np.float32)
+
+        scores[~allowed] = 0.0
+        candidates = np.flatnonzero(scores > 0)
+        if candidates.size == 0:
+            return []
+        k = min(limit, candidates.size)
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [(self.doc_ids[d], float(scores[d])) for d in top]
+
+
+# The index is persisted in SQLite as an append-only change log: one row per
+# added chunk (its term counts) and one per deleted chunk. SQLite's write
+# lock serializes writers across uvicorn workers, and each process keeps the
+# in-memory LexicalIndex above and applies the rows it has not seen yet.
+# When the log is mostly superseded rows it is rewritten and the generation
+# bumped, which makes other processes reload it in full.
+_index = LexicalIndex()
+_seq = 0
+_generation = None
+_conn: Optional[sqlite3.Connection] = None
+_sync_thread: Optional[threading.Thread] = None
+_lock = threading.RLock()
+
+
+def _connect() -> sqlite3.Connection:
+    # Caller holds _lock
+    global _conn
+    if _conn is None:
+        # Only publish the connection once it is fully set up, so a failure
+        # here is retried on the next call instead of leaving a half-made one
+        conn = sqlite3.connect(LEXICAL_INDEX_PATH, timeout=30, check_same_thread=False, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    point_id TEXT NOT NULL,
+                    fields TEXT,
+                    length INTEGER,
+                    counts TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_changes_point_id ON changes (point_id);
+            """)
+        except sqlite3.Error:
+            conn.close()
+            raise
+        _conn = conn
+    return _conn
+
+
+def _sync(conn: sqlite3.Connection) -> None:
+    """
+    Apply changes written since the last sync (by any process). Caller
+    holds _lock and is inside a transaction.
+    """
+    global _index, _seq, _generation
+    row = conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+    generation = row[0] if row else 0
+    if generation != _generation:
+        _index, _seq, _generation = LexicalIndex(), 0, generation
+    deleted = []
+    for seq, point_id, fields, length, counts in conn.execute(
+        "SELECT seq, point_id, fields, length, counts FROM changes WHERE seq > ? ORDER BY seq", (_seq,)
+    ):
+        if fields is None:
+            deleted.append(point_id)
+        else:
+            if deleted:
+                _index.remove(deleted)
+                deleted = []
+            _index.add(point_id, json.loads(counts), length, tuple(json.loads(fields)))
+        _seq = seq
+    if deleted:
+        _index.remove(deleted)
+
+
+def _sync_loop() -> None:
+    while True:
+        time.sleep(LEXICAL_SYNC_INTERVAL)
+        try:
+            with _lock:
+                conn = _connect()
+                conn.execute("BEGIN")
+                try:
+                    _sync(conn)
+                finally:
+                    conn.execute("COMMIT")
+        except Exception:
+            logger.exception("lexical index sync failed")
+
+
+def _get_index() -> LexicalIndex:
+    """
+    The in-memory index, loaded on first use. Caller holds _lock.
+    """
+    global _sync_thread
+    if _generation is None:
+        conn = _connect()
+        conn.execute("BEGIN")
+        try:
+            _sync(conn)
+        finally:
+            conn.execute("COMMIT")
+    if _sync_thread is None:
+        _sync_thread = threading.Thread(target=_sync_loop, name="lexical-sync", daemon=True)
+        _sync_thread.start()
+    return _index
+
+
+def _write(adds: List[tuple], removes=lambda index: (), reset: bool = False) -> None:
+    """
+    Append `adds` (from `analyze`) and deletions of the point ids returned
+    by removes(index) in one write transaction, after catching up with
+    other writers so removes sees every chunk. reset=True drops every
+    chunk indexed so far.
+    """
+    global _generation
+    with _lock:
+        conn = _connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _sync(conn)
+            if reset:
+                conn.execute("DELETE FROM changes")
+                # Makes every process, this one included, start over
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('generation', ?)", (_generation + 1,)
+                )
+            removed = [(pid,) for pid in removes(_index)]
+            conn.executemany("INSERT INTO changes (point_id) VALUES (?)", removed)
+            conn.executemany(
+                "INSERT INTO changes (point_id, fields, length, counts) VALUES (?, ?, ?, ?)",
+                [(pid, json.dumps(fields), length, json.dumps(counts)) for pid, counts, length, fields in adds],
+            )
+            _sync(conn)
+            rows = conn.execute("SELECT COUNT(*) FROM changes").fetchone()[0]
+            if rows > 1000 and rows > 3 * _index.live:
+                # Keep only each live chunk's latest row
+                conn.execute(
+                    "DELETE FROM changes WHERE fields IS NULL "
+                    "OR seq NOT IN (SELECT MAX(seq) FROM changes GROUP BY point_id)"
+                )
+                _generation += 1
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('generation', ?)", (_generation,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            # Memory may hold changes that were rolled back; reload on next use
+            _generation = None
+            raise
+
+
+def add_chunks(chunks: Iterable[Tuple[str, str, dict]]) -> None:
+    """
+    Index [(point_id, text, payload)] and persist.
+    """
+    adds = [analyze(point_id, text, payload) for point_id, text, payload in chunks]
+    _write(adds)
+
+
+def remove_chunks(point_ids: Iterable[str]) -> None:
+    point_ids = list(point_ids)
+    _write([], lambda index: [p for p in point_ids if p in index.doc_row])
+
+
+def remove_where(field: str, value: str) -> None:
+    _write([], lambda index: index.point_ids_where(field, value))
+
+
+def search(query: str, limit: int, where: Optional[dict] = None) -> List[Tuple[str, float]]:
+    with _lock:
+        return _get_index().search(query, limit, where)
+
+
+def is_empty() -> bool:
+    with _lock:
+        return _get_index().live == 0
+
+
+def rebuild(records) -> None:
+    """
+    Rebuild from scratch from vector store records (payload must include text).
+    """
+    _write([analyze(r.id, r.payload.get("text", ""), r.payload) for r in records], reset=True)
@@ -0,0 +1,312 @@
+# llm_gateway.py
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import re
+import time
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Dict, Optional
+
+from observability import LLM_FIRST_CHUNK_SECONDS, LLM_TOTAL_SECONDS
+from workers import Limiter, ServerBusyError
+
+# Async front door for answer generation. Every upstream call goes through
+# one gateway per worker: a bounded concurrency limiter, a first-token and a
+# total timeout, jittered retries while nothing has been streamed yet, and
+# coalescing so identical prompts in flight share one upstream stream.
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini").lower()  # gemini | fake
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUED = int(os.getenv("LLM_MAX_QUEUED", "64"))
+LLM_FIRST_TOKEN_TIMEOUT = float(os.getenv("LLM_FIRST_TOKEN_TIMEOUT", "20"))
+LLM_TOTAL_TIMEOUT = float(os.getenv("LLM_TOTAL_TIMEOUT", "120"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "50"))
+
+logger = logging.getLogger(__name__)
+
+
+class LLMError(Exception):
+    """Generation failed; /ask maps it to 502 when nothing was streamed yet."""
+
+
+class LLMTimeoutError(LLMError):
+    """No first token, or no complete answer, within the configured timeout."""
+
+
+class LLMProvider(ABC):
+    name = "provider"
+
+    @abstractmethod
+    def stream(self, prompt: str) -> AsyncIterator[str]:
+        """Yield the answer text piece by piece."""
+
+    def is_transient(self, error: Exception) -> bool:
+        return isinstance(error, (ConnectionError, asyncio.TimeoutError))
+
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self):
+        # Configures the API key and holds the shared model (and its channel)
+        import gemini_setup
+        self.model = gemini_setup.model
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        response = await self.model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:  # a chunk without text parts (e.g. safety metadata)
+                continue
+            if text:
+                yield text
+
+    def is_transient(self, error: Exception) -> bool:
+        from google.api_core import exceptions as gexc
+        transient = (
+            gexc.ServiceUnavailable, gexc.InternalServerError, gexc.DeadlineExceeded,
+            gexc.ResourceExhausted, gexc.TooManyRequests,
+        )
+        return isinstance(error, transient) or super().is_transient(error)
+
+
+class FakeProvider(LLMProvider):
+    """
+    Local stand-in for tests and load benchmarks: streams a short answer
+    quoting the first source in the prompt, spread over FAKE_LLM_LATENCY_MS.
+    """
+    name = "fake"
+
+    def __init__(self, latency_ms: float = FAKE_LLM_LATENCY_MS):
+        self.latency = latency_ms / 1000
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        # Skip the "[Source: <file_name> ...]" / "[Source: ... - Page ...]" templates
+        match = re.search(r"\[Source: [^<.\]][^\]]*\]", prompt)
+        source = match.group(0) if match else "[Source: none]"
+        pieces = ["Based on the provided documents, ", "the answer is set out in the cited clause. ", source]
+        for piece in pieces:
+            await asyncio.sleep(self.latency / len(pieces))
+            yield piece
+
+
+def get_provider(name: str = LLM_PROVIDER) -> LLMProvider:
+    if name == "gemini":
+        return GeminiProvider()
+    if name == "fake":
+        return FakeProvider()
+    raise ValueError(f"Unsupported LLM_PROVIDER: {name}")
+
+
+class _Flight:
+    """
+    One upstream generation and the pieces streamed so far; any number of
+    subscribers replay it from the start and then follow it live.
+    """
+
+    def __init__(self):
+        self.pieces = []
+        self.done = False
+        self.error: Optional[Exception] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self.abandoned = False
+        self._changed = asyncio.Event()
+
+    def push(self, piece: str) -> None:
+        self.pieces.append(piece)
+        self._notify()
+
+    def finish(self, error: Optional[Exception] = None) -> None:
+        self.error = error
+        self.done = True
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        i = 0
+        while True:
+            if i < len(self.pieces):
+                yield self.pieces[i]
+                i += 1
+                continue
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class _Subscription:
+    """
+    One caller's stream of a flight. The caller is unsubscribed once, when
+    the stream ends, fails, is closed, or is dropped without being read
+    (e.g. the client disconnected before the response body started).
+    """
+
+    def __init__(self, unsubscribe, first: Optional[str], rest: AsyncIterator[str]):
+        self._unsubscribe = unsubscribe
+        self._first = first
+        self._rest = rest
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        if self._first is not None:
+            piece, self._first = self._first, None
+            return piece
+        try:
+            # No first piece means the flight ended empty; this stops at once
+            return await self._rest.__anext__()
+        except BaseException:
+            self._close()
+            raise
+
+    async def aclose(self) -> None:
+        self._close()
+        await self._rest.aclose()
+
+    def _close(self) -> None:
+        if self._unsubscribe is not None:
+            unsubscribe, self._unsubscribe = self._unsubscribe, None
+            unsubscribe()
+
+    def __del__(self):
+        self._close()
+
+
+class LLMGateway:
+    def __init__(self, provider: LLMProvider):
+        self.provider = provider
+        self.limiter = Limiter("llm", LLM_MAX_CONCURRENCY, LLM_MAX_QUEUED)
+        self._flights: Dict[str, _Flight] = {}
+        self._stats = {"calls": 0, "coalesced": 0, "retries": 0, "timeouts": 0, "errors": 0, "cancelled": 0}
+
+    async def open_stream(self, prompt: str) -> AsyncIterator[str]:
+        """
+        Start (or join) the generation for prompt and wait for its first
+        piece. Raises LLMError/ServerBusyError if generation fails before
+        anything is streamed; returns an async iterator over the full answer.
+        A failure after that ends the iterator with LLMError. Once every
+        caller of a generation has stopped reading, it is cancelled.
+        """
+        key = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+            flight.task = asyncio.create_task(self._run(key, flight, prompt))
+        else:
+            self._stats["coalesced"] += 1
+        flight.subscribers += 1
+
+        pieces = flight.subscribe()
+        try:
+            first = await pieces.__anext__()
+        except StopAsyncIteration:
+            first = None
+        except BaseException:
+            # Includes the caller being cancelled while waiting (client gone)
+            self._unsubscribe(key, flight)
+            raise
+        return _Subscription(lambda: self._unsubscribe(key, flight), first, pieces)
+
+    def _unsubscribe(self, key: str, flight: _Flight) -> None:
+        flight.subscribers -= 1
+        if flight.subscribers == 0 and not flight.done:
+            # Nobody is reading any more: stop the upstream call and free its
+            # limiter slot. Later identical prompts start a new generation.
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            self._stats["cancelled"] += 1
+            flight.abandoned = True
+            flight.task.cancel()
+
+    async def _run(self, key: str, flight: _Flight, prompt: str) -> None:
+        error = None
+        try:
+            async with self.limiter.slot():
+                error = await self._generate(flight, prompt)
+        except ServerBusyError as e:
+            error = e
+        except Exception as e:  # never leave subscribers waiting
+            error = LLMError(str(e))
+        except asyncio.CancelledError:
+            # Every subscriber left; anyone still attached gets an error, not a cut-off answer
+            flight.finish(LLMError("Answer generation was cancelled"))
+            raise
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if error is not None:
+                self._stats["errors"] += 1
+                logger.warning("llm generation failed", extra={"error": str(error), "streamed": bool(flight.pieces)})
+            if not flight.done:
+                flight.finish(error)
+
+    async def _generate(self, flight: _Flight, prompt: str) -> Optional[Exception]:
+        for attempt in range(LLM_RETRIES + 1):
+            self._stats["calls"] += 1
+            start = time.monotonic()
+            deadline = start + LLM_TOTAL_TIMEOUT
+            pieces = self.provider.stream(prompt)
+            try:
+                while True:
+                    if flight.pieces:
+                        timeout = deadline - time.monotonic()
+                    else:
+                        timeout = min(LLM_FIRST_TOKEN_TIMEOUT, deadline - time.monotonic())
+                    try:
+                        piece = await asyncio.wait_for(pieces.__anext__(), max(timeout, 0))
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        self._stats["timeouts"] += 1
+                        stage = "next" if flight.pieces else "first"
+                        raise LLMTimeoutError(f"No {stage} token from {self.provider.name} within the timeout")
+                    # wait_for can swallow a cancel that lands as a piece arrives
+                    if flight.abandoned:
+                        raise asyncio.CancelledError()
+                    if not flight.pieces:
+                        LLM_FIRST_CHUNK_SECONDS.observe(time.monotonic() - start)
+                    flight.push(piece)
+                LLM_TOTAL_SECONDS.observe(time.monotonic() - start)
+                return None
+            except Exception as e:
+                # Once text has been streamed, a retry would repeat it
+                if flight.pieces:
+                    return e if isinstance(e, LLMError) else LLMError(f"Answer stream interrupted: {e}")
+                transient = isinstance(e, LLMTimeoutError) or self.provider.is_transient(e)
+                if attempt < LLM_RETRIES and transient:
+                    self._stats["retries"] += 1
+                    # Full jitter, so callers retrying together spread out
+                    await asyncio.sleep(random.uniform(0, LLM_RETRY_BACKOFF * (2 ** attempt)))
+                    continue
+                return e if isinstance(e, LLMError) else LLMError(str(e))
+            finally:
+                await pieces.aclose()
+        return LLMError("LLM retries exhausted")
+
+    def stats(self) -> dict:
+        return {"provider": self.provider.name, "in_flight": len(self._flights), **self._stats}
+
+
+_gateway: Optional[LLMGateway] = None
+
+
+def get_gateway() -> LLMGateway:
+    global _gateway
+    if _gateway is None:
+        _gateway = LLMGateway(get_provider())
+    return _gateway
+
+
+async def open_stream(prompt: str) -> AsyncIterator[str]:
+    return await get_gateway().open_stream(prompt)
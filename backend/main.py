@@ -1,15 +1,38 @@
-from fastapi import FastAPI, File, UploadFile, Form
+from fastapi import FastAPI, File, UploadFile, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
-from chat_history import update_chat_history, get_chat_context, clear_chat_history
-from file_handler import extract_text_from_file
-from build_vector_store import build_and_save_index
-from retrieval import search_similar_chunks, delete_file_chunks, list_files
-from gemini_setup import stream_answer
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from fastapi.concurrency import run_in_threadpool
+import asyncio
+import json
+import logging
+from typing import Optional
+from chat_history import update_chat_history, get_chat_context, clear_chat_history, DEFAULT_SESSION
+from retrieval import search_similar_chunks_async, search_batch_async, delete_file_chunks_async, list_files_async, backfill_indexes, search_scope
+import llm_gateway
+from llm_gateway import LLMError, LLMTimeoutError
 from prompt_utils import format_prompt
 from legalprompt import system_prompt
+import embedder
+import reranker
+import embedding_cache
+import answer_cache
+import context_builder
+from semantic_cache import semantic_cache
+import catalog
+import summaries
+from question_utils import is_summary_question
+import qdrant_connection
+import jobs
+import workers
+from workers import ServerBusyError, ask_limiter, run_embedding, MAX_BATCH_QUESTIONS, BATCH_LLM_CONCURRENCY
+import observability
+from observability import span, timed
+
+observability.configure_logging()
+logger = logging.getLogger("legal.api")
 
 app = FastAPI()
+app.add_middleware(observability.RequestContextMiddleware)
 
 # ✅ Enable CORS
 app.add_middleware(
@@ -20,60 +43,187 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def get_session_id(request: Request) -> str:
+    # Chat history is per client: X-Session-Id header, else a session_id cookie
+    session_id = request.headers.get("x-session-id") or request.cookies.get("session_id")
+    return session_id.strip()[:128] if session_id and session_id.strip() else DEFAULT_SESSION
+
+
+@app.on_event("startup")
+async def load_embedder():
+    # Load the embedding model once per worker, before serving traffic
+    await run_in_threadpool(embedder.warm_up)
+    await run_in_threadpool(reranker.warm_up)
+
+
+@app.on_event("startup")
+async def load_indexes():
+    await run_in_threadpool(backfill_indexes)
+    # Summarize documents left without a summary tree, now and periodically
+    summaries.start_backfill()
+
+
+@app.on_event("startup")
+async def start_ingestion_workers():
+    await jobs.start_workers()
+
+
+@app.on_event("shutdown")
+async def release_resources():
+    await jobs.stop_workers()
+    await summaries.cancel_pending()
+    await qdrant_connection.close_clients()
+    workers.shutdown()
+
+
 @app.get("/")
 async def root():
     return {"message": "Legal AI Assistant API is running!"}
 
 
+@app.get("/ready")
+async def ready():
+    if not embedder.is_ready():
+        return JSONResponse(status_code=503, content={"status": "loading"})
+    return {"status": "ready"}
+
+
+@app.get("/metrics")
+async def metrics():
+    body, content_type = observability.render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/stats")
+async def stats():
+    cache = embedding_cache.get_cache()
+    return {
+        "embedding_cache": cache.stats() if cache else None,
+        "ask_cache": answer_cache.stats(),
+        "semantic_cache": semantic_cache.stats() if semantic_cache else None,
+        "context": context_builder.stats(),
+        "reranker": reranker.stats(),
+        "llm": llm_gateway.get_gateway().stats(),
+    }
+
+
 
 @app.post("/upload")
-async def upload_file(files: list[UploadFile] = File(...)):
+async def upload_file(request: Request, files: list[UploadFile] = File(...)):
     try:
-        results = []
-        for file in files:
-            content = await file.read()
-            page_chunks = extract_text_from_file(file.filename, content)
-            status = build_and_save_index(page_chunks)  
-            results.append(status)
+        # Ingestion runs in the background; poll GET /jobs/{job_id} for progress
+        contents = [(file.filename, await file.read()) for file in files]
+        job_id = await jobs.enqueue(contents)
 
-        clear_chat_history()  # reset on new upload
-        return {"results": results}
+        await run_in_threadpool(clear_chat_history, get_session_id(request))  # reset the uploader's session only
+        return JSONResponse(status_code=202, content={"job_id": job_id})
 
+    except ServerBusyError as e:
+        return JSONResponse(status_code=429, content={"error": str(e)})
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 
 
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await run_in_threadpool(jobs.get_job, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Job '{job_id}' not found."})
+    return job
+
+
+
 @app.post("/ask")
-async def ask_question(question: str = Form(...)):
+async def ask_question(
+    request: Request,
+    question: str = Form(...),
+    file_id: Optional[str] = Form(None),
+    file_name: Optional[str] = Form(None),
+    page_from: Optional[int] = Form(None),
+    page_to: Optional[int] = Form(None),
+):
+    session_id = get_session_id(request)
+    # Optional scope: one document and/or a page range
+    where = search_scope(file_id, file_name, page_from, page_to)
     try:
-        print(f"📨 Question received: {question}")
+        logger.info("question received", extra={"question_chars": len(question), "scoped": where is not None})
 
-        # Always check available files
-        files = list_files()
-        print(f"📂 Files available in Qdrant: {files}")
+        async with ask_limiter.slot():
+            # Summary questions are answered from the precomputed document
+            # summaries once every document in scope has one
+            if page_from is None and page_to is None and is_summary_question(question):
+                with span("summary_lookup"):
+                    summary_context = await run_in_threadpool(summaries.summary_context, file_id, file_name)
+                if summary_context is not None:
+                    logger.info("answering from document summaries")
+                    corpus_version = await run_in_threadpool(catalog.corpus_version)
+                    history_context = await run_in_threadpool(get_chat_context, session_id)
+                    prompt = summaries.format_summary_prompt(summary_context, question, history_context)
+                    await run_in_threadpool(update_chat_history, question, session_id)
+                    return StreamingResponse(
+                        await answer_cache.cached_stream(prompt, corpus_version, llm_gateway.open_stream),
+                        media_type="text/plain"
+                    )
 
-        # Search in vector DB
-        top_chunks, similarity_score = search_similar_chunks(question)
-        history_context = get_chat_context()
+            # Always check available files
+            files = await timed("list_files", list_files_async())
+            logger.info("files available", extra={"files": len(files)})
+
+            # Search in vector DB (retrieval results are cached per corpus version)
+            corpus_version = await timed("corpus_version", run_in_threadpool(catalog.corpus_version))
+            key = answer_cache.retrieval_key(question, corpus_version, file_id, file_name, page_from, page_to)
+            cached = answer_cache.retrieval_cache.get(key)
+            semantic_entry, semantic_hit = None, False
+            if cached is None:
+                query_vec = (await timed("encode_query", run_embedding(embedder.encode_queries, [question])))[0]
+                # Paraphrases of a recent unscoped question reuse its results
+                if semantic_cache is not None and where is None:
+                    with span("semantic_lookup"):
+                        semantic_entry = semantic_cache.lookup(query_vec, corpus_version)
+                    semantic_hit = semantic_entry is not None
+                if semantic_hit:
+                    cached = (semantic_entry.chunks, semantic_entry.score)
+                else:
+                    cached = await timed(
+                        "search", search_similar_chunks_async(question, query_vec=query_vec.tolist(), where=where)
+                    )
+                    if semantic_cache is not None and where is None:
+                        semantic_entry = semantic_cache.add(query_vec, corpus_version, question, *cached)
+                answer_cache.retrieval_cache.put(key, cached)
+            else:
+                logger.info("retrieval cache hit")
+            top_chunks, similarity_score = cached
+        history_context = await run_in_threadpool(get_chat_context, session_id)
 
         # Handle greetings separately
         greetings = ["hi", "hello", "hey", "greetings", "good morning", "good afternoon", "good evening"]
         if question.strip().lower() in greetings:
             greeting_text = "Hello! How can I help you with your uploaded documents today?"
-            return StreamingResponse(stream_answer(greeting_text), media_type="text/plain")
+            return StreamingResponse(await llm_gateway.open_stream(greeting_text), media_type="text/plain")
+
+        # Case A: Relevant chunks found (retrieval drops results under the
+        # reranker or cosine relevance threshold)
+        if top_chunks:
+            # Merge overlapping chunks, drop near-duplicates and pack under the token budget
+            with span("context_build"):
+                context, report = context_builder.build_context(top_chunks)
+            logger.info("context built", extra=report)
 
-        # Case A: Relevant chunks found
-        if top_chunks and similarity_score >= 0.10:
-            context_parts = []
-            for chunk in top_chunks:
-                meta = f"[Source: {chunk['file_name']} - Page {chunk['page']}]"
-                context_parts.append(f"{meta}\n{chunk['text']}")
-            context = "\n\n".join(context_parts)
+            with span("prompt_format"):
+                prompt = format_prompt(context, question, history_context)
+            await run_in_threadpool(update_chat_history, question, session_id)
+            if semantic_hit and semantic_entry.answer:
+                return StreamingResponse(answer_cache.replay(semantic_entry.answer), media_type="text/plain")
 
-            prompt = format_prompt(context, question, history_context)
-            update_chat_history(question)
-            return StreamingResponse(stream_answer(prompt), media_type="text/plain")
+            def remember_answer(answer: str):
+                if semantic_entry is not None:
+                    semantic_entry.answer = answer
+
+            return StreamingResponse(
+                await answer_cache.cached_stream(prompt, corpus_version, llm_gateway.open_stream, remember_answer),
+                media_type="text/plain"
+            )
 
         # Case B: Files exist but no relevant info
         if files:
@@ -82,14 +232,128 @@ async def ask_question(question: str = Form(...)):
                 f"{history_context}\n\n"
                 f"{question}\n\n"
             )
-            update_chat_history(question)
-            return StreamingResponse(stream_answer(prompt), media_type="text/plain")
+            await run_in_threadpool(update_chat_history, question, session_id)
+            return StreamingResponse(
+                await answer_cache.cached_stream(prompt, corpus_version, llm_gateway.open_stream),
+                media_type="text/plain"
+            )
 
         # Case C: No files at all
         return JSONResponse({"message": "⚠️ No legal documents found. Please upload a document to begin."})
 
+    except ServerBusyError as e:
+        return JSONResponse(status_code=429, content={"error": str(e)})
+    except LLMTimeoutError as e:
+        return JSONResponse(status_code=504, content={"error": str(e)})
+    except LLMError as e:
+        return JSONResponse(status_code=502, content={"error": f"Answer generation failed: {e}"})
+    except Exception as e:
+        logger.exception("error in /ask")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+
+
+async def answer_batch_item(question: str, chunks: list, corpus_version: int) -> dict:
+    # Same prompts as /ask, without chat history: checklist questions stand alone
+    if chunks:
+        context, _ = context_builder.build_context(chunks)
+        prompt = format_prompt(context, question)
+    else:
+        prompt = f"{system_prompt}\n\n\n\n{question}\n\n"
+    # A failure partway through must become the item's "error", not a cut-off answer
+    stream = await answer_cache.cached_stream(prompt, corpus_version, llm_gateway.open_stream, raise_errors=True)
+    answer = "".join([piece async for piece in stream])
+    sources = list(dict.fromkeys((c["file_name"], c["page"]) for c in chunks))
+    return {"answer": answer, "sources": [{"file_name": f, "page": p} for f, p in sources]}
+
+
+async def stream_batch_answers(questions: list, retrieved: list, corpus_version: int):
+    """
+    Answer every question with at most BATCH_LLM_CONCURRENCY generations at
+    once, yielding one NDJSON line per question as soon as it completes.
+    """
+    semaphore = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+
+    async def run(index: int, question: str, chunks: list) -> dict:
+        async with semaphore:
+            try:
+                result = await answer_batch_item(question, chunks, corpus_version)
+            except (LLMError, ServerBusyError) as e:
+                result = {"error": str(e)}
+            except Exception as e:
+                logger.exception("error in /ask/batch item")
+                result = {"error": str(e)}
+        return {"index": index, "question": question, **result}
+
+    tasks = [
+        asyncio.create_task(run(i, q, chunks))
+        for i, (q, (chunks, _)) in enumerate(zip(questions, retrieved))
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield json.dumps(await next_done, ensure_ascii=False) + "\n"
+    finally:
+        # The client went away: stop generating the rest
+        for task in tasks:
+            task.cancel()
+
+
+
+@app.post("/ask/batch")
+async def ask_batch(
+    questions: list[str] = Form(...),
+    file_id: Optional[str] = Form(None),
+    file_name: Optional[str] = Form(None),
+    page_from: Optional[int] = Form(None),
+    page_to: Optional[int] = Form(None),
+):
+    """
+    Run a checklist of questions (repeated `questions` form fields) against the
+    documents, optionally scoped like /ask. All questions are encoded and
+    searched in one batch; answers stream back as NDJSON lines
+    {"index", "question", "answer", "sources"} (or "error") in completion order.
+    """
+    questions = [q.strip() for q in questions if q.strip()]
+    if not questions:
+        return JSONResponse(status_code=400, content={"error": "No questions given."})
+    if len(questions) > MAX_BATCH_QUESTIONS:
+        return JSONResponse(
+            status_code=400, content={"error": f"At most {MAX_BATCH_QUESTIONS} questions per batch."}
+        )
+    where = search_scope(file_id, file_name, page_from, page_to)
+    try:
+        logger.info("batch received", extra={"questions": len(questions), "scoped": where is not None})
+
+        async with ask_limiter.slot():
+            files = await timed("list_files", list_files_async())
+            if not files:
+                return JSONResponse({"message": "⚠️ No legal documents found. Please upload a document to begin."})
+
+            corpus_version = await timed("corpus_version", run_in_threadpool(catalog.corpus_version))
+            keys = [
+                answer_cache.retrieval_key(q, corpus_version, file_id, file_name, page_from, page_to)
+                for q in questions
+            ]
+            retrieved = [answer_cache.retrieval_cache.get(key) for key in keys]
+            misses = [i for i, cached in enumerate(retrieved) if cached is None]
+            if misses:
+                # One encode call and one vector search for every uncached question
+                pending = [questions[i] for i in misses]
+                query_vecs = await timed("encode_query", run_embedding(embedder.encode_queries, pending))
+                results = await timed("search", search_batch_async(pending, query_vecs.tolist(), where=where))
+                for i, result in zip(misses, results):
+                    retrieved[i] = result
+                    answer_cache.retrieval_cache.put(keys[i], result)
+            logger.info("batch retrieved", extra={"questions": len(questions), "cache_hits": len(questions) - len(misses)})
+
+        return StreamingResponse(
+            stream_batch_answers(questions, retrieved, corpus_version), media_type="application/x-ndjson"
+        )
+
+    except ServerBusyError as e:
+        return JSONResponse(status_code=429, content={"error": str(e)})
     except Exception as e:
-        print(f"❌ Error in /ask: {str(e)}")
+        logger.exception("error in /ask/batch")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 
@@ -97,7 +361,7 @@ async def ask_question(question: str = Form(...)):
 @app.get("/files")
 async def get_files():
     try:
-        return list_files()
+        return await list_files_async()
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
@@ -106,7 +370,7 @@ async def get_files():
 @app.delete("/delete/{file_name}")
 async def delete_file(file_name: str):
     try:
-        delete_file_chunks(file_name)
+        await delete_file_chunks_async(file_name)
         return {"message": f"File '{file_name}' deleted successfully."}
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": f"Error deleting file: {str(e)}"})
@@ -114,6 +378,6 @@ async def delete_file(file_name: str):
 
 
 @app.delete("/clear")
-async def clear_history():
-    clear_chat_history()
+async def clear_history(request: Request):
+    await run_in_threadpool(clear_chat_history, get_session_id(request))
     return {"message": "Chat history cleared"}
@@ -0,0 +1,130 @@
+# migrate_collection.py
+"""
+Rebuild the Qdrant collection with the current layout settings
+(QDRANT_QUANTIZATION, QDRANT_ON_DISK, HNSW_M, HNSW_EF_CONSTRUCT, HNSW_ON_DISK).
+
+    python migrate_collection.py [--batch-size 256] [--check 100] [--dry-run]
+
+Every point is copied into a new physical collection <COLLECTION_NAME>_<ts>,
+recall@10 of the new layout is measured against exact search on the old one,
+and COLLECTION_NAME is then pointed at the new collection as an alias. Once
+COLLECTION_NAME is an alias, later migrations switch over atomically. Pause
+uploads while this runs; points written meanwhile are not copied.
+"""
+import argparse
+import time
+
+from qdrant_client.models import (
+    CreateAlias, CreateAliasOperation, DeleteAlias, DeleteAliasOperation, PointStruct, SearchParams,
+)
+
+from qdrant_connection import get_client
+from vector_store import COLLECTION_NAME, collection_config, create_payload_indexes, search_params
+
+RECALL_K = 10
+
+
+def resolve(client, name: str):
+    """
+    Return (physical collection, is_alias) for name, or (None, False).
+    """
+    for alias in client.get_aliases().aliases:
+        if alias.alias_name == name:
+            return alias.collection_name, True
+    if client.collection_exists(name):
+        return name, False
+    return None, False
+
+
+def copy_points(client, source: str, target: str, batch_size: int) -> int:
+    copied, offset = 0, None
+    while True:
+        points, offset = client.scroll(
+            collection_name=source, limit=batch_size, offset=offset, with_payload=True, with_vectors=True
+        )
+        if points:
+            client.upsert(
+                collection_name=target,
+                points=[PointStruct(id=p.id, vector=p.vector, payload=p.payload) for p in points],
+                wait=True
+            )
+            copied += len(points)
+            print(f"   copied {copied} points")
+        if offset is None:
+            return copied
+
+
+def measure_recall(client, source: str, target: str, n_queries: int) -> float:
+    """
+    Mean overlap between exact top-k on the source and the configured
+    (approximate, possibly quantized) top-k on the target, using stored
+    vectors as queries.
+    """
+    queries, _ = client.scroll(collection_name=source, limit=n_queries, with_vectors=True)
+    if not queries:
+        return 1.0
+    total = 0.0
+    for q in queries:
+        exact = client.query_points(
+            collection_name=source, query=q.vector, limit=RECALL_K, search_params=SearchParams(exact=True)
+        ).points
+        approx = client.query_points(
+            collection_name=target, query=q.vector, limit=RECALL_K, search_params=search_params()
+        ).points
+        expected = {p.id for p in exact}
+        total += len(expected & {p.id for p in approx}) / max(len(expected), 1)
+    return total / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the Qdrant collection with the current settings")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--check", type=int, default=100, help="queries used to measure recall (0 to skip)")
+    parser.add_argument("--dry-run", action="store_true", help="build and measure, but do not switch over")
+    args = parser.parse_args()
+
+    client = get_client()
+    source, is_alias = resolve(client, COLLECTION_NAME)
+    if source is None:
+        print(f"⚠️ Collection '{COLLECTION_NAME}' does not exist, nothing to migrate.")
+        return
+
+    dim = client.get_collection(source).config.params.vectors.size
+    target = f"{COLLECTION_NAME}_{int(time.time() * 1000)}"
+    print(f"🔧 Rebuilding '{source}' as '{target}' ({dim}-d)")
+    client.create_collection(collection_name=target, **collection_config(dim))
+    create_payload_indexes(client, target)
+
+    copied = copy_points(client, source, target, args.batch_size)
+    expected = client.count(collection_name=source, exact=True).count
+    if client.count(collection_name=target, exact=True).count != expected:
+        print(f"❌ Copied {copied} points but '{source}' has {expected}; keeping '{target}' for inspection.")
+        return
+
+    if args.check:
+        recall = measure_recall(client, source, target, args.check)
+        print(f"📏 recall@{RECALL_K} vs exact search: {recall:.4f}")
+
+    if args.dry_run:
+        print(f"✅ Dry run done; '{COLLECTION_NAME}' still points at '{source}'.")
+        return
+
+    if is_alias:
+        # Atomic switch, then drop the old physical collection
+        client.update_collection_aliases(change_aliases_operations=[
+            DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=COLLECTION_NAME)),
+            CreateAliasOperation(create_alias=CreateAlias(collection_name=target, alias_name=COLLECTION_NAME)),
+        ])
+        client.delete_collection(source)
+    else:
+        # First migration: the name is a real collection, so it has to go
+        # before the alias can take its place
+        client.delete_collection(source)
+        client.update_collection_aliases(change_aliases_operations=[
+            CreateAliasOperation(create_alias=CreateAlias(collection_name=target, alias_name=COLLECTION_NAME)),
+        ])
+    print(f"✅ '{COLLECTION_NAME}' now serves '{target}' ({copied} points)")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,3 +8,5 @@ class ChunkMetadata(BaseModel):
     file_id: str = Field(..., description="Unique ID for the uploaded document")
     file_name: str = Field(..., description="Original filename")
     chunk_index: Optional[int] = Field(None, description="Position of the chunk in the document")
+    doc_hash: Optional[str] = Field(None, description="Content hash of the whole document revision")
+    chunk_hash: Optional[str] = Field(None, description="Content hash of the chunk text")
@@ -0,0 +1,153 @@
+# observability.py
+import contextvars
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest,
+)
+
+# Structured logs (one JSON object per line, LOG_FORMAT=text for humans) and
+# Prometheus metrics served at /metrics. With several uvicorn workers, set
+# PROMETHEUS_MULTIPROC_DIR so every worker's samples are aggregated.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Request id of the current /ask or /upload call, or the job id in ingestion
+request_id_var: contextvars.ContextVar = contextvars.ContextVar("request_id", default="-")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_SECONDS = Histogram(
+    "legal_stage_seconds", "Time spent in each request or ingestion stage", ["stage"], buckets=LATENCY_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    "legal_request_seconds", "HTTP request latency until the response starts", ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS
+)
+LLM_FIRST_CHUNK_SECONDS = Histogram(
+    "legal_llm_first_chunk_seconds", "Time from LLM call to the first streamed chunk", buckets=LATENCY_BUCKETS
+)
+LLM_TOTAL_SECONDS = Histogram(
+    "legal_llm_total_seconds", "Time from LLM call to the end of the stream", buckets=LATENCY_BUCKETS
+)
+INGEST_FILES = Counter("legal_ingest_files_total", "Ingested files by outcome", ["status"])
+INGEST_BYTES = Counter("legal_ingest_bytes_total", "Bytes of uploaded files ingested")
+INGEST_PAGES = Counter("legal_ingest_pages_total", "Pages extracted from uploaded files")
+INGEST_OCR_PAGES = Counter("legal_ingest_ocr_pages_total", "Pages that needed OCR")
+INGEST_CHUNKS = Counter("legal_ingest_chunks_total", "Chunks produced by ingestion")
+
+logger = logging.getLogger("legal.stages")
+
+_STANDARD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class _RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        # Fields passed with extra={...}
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging() -> None:
+    handler = logging.StreamHandler()
+    handler.addFilter(_RequestIdFilter())
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+
+
+@contextmanager
+def span(stage: str):
+    """
+    Time a block as `stage`: observed in legal_stage_seconds and logged at DEBUG.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        logger.debug("stage done", extra={"stage": stage, "ms": round(elapsed * 1000, 2)})
+
+
+async def timed(stage: str, awaitable):
+    """
+    Await `awaitable` inside span(stage); handy inside asyncio.gather.
+    """
+    with span(stage):
+        return await awaitable
+
+
+def render_metrics():
+    """
+    (body, content_type) for the /metrics endpoint.
+    """
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class RequestContextMiddleware:
+    """
+    ASGI middleware: assigns each HTTP request an id (X-Request-Id if the
+    client sent one), exposes it to logs, echoes it in the response headers
+    and records the request latency.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode("latin-1"))]
+                route = getattr(scope.get("route"), "path", "unmatched")
+                REQUEST_SECONDS.labels(scope["method"], route, str(status["code"])).observe(time.perf_counter() - start)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id_var.reset(token)
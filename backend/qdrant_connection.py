@@ -0,0 +1,131 @@
+# qdrant_connection.py
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable
+
+import httpx
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
+
+# Remote cluster (default) or local mode for tests/benchmarks:
+#   QDRANT_LOCATION=":memory:"  -> in-process, non-persistent
+#   QDRANT_PATH="./qdrant_data" -> in-process, persisted on disk
+QDRANT_URL = os.getenv("QDRANT_URL")
+QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
+QDRANT_LOCATION = os.getenv("QDRANT_LOCATION")
+QDRANT_PATH = os.getenv("QDRANT_PATH")
+
+QDRANT_TIMEOUT = int(os.getenv("QDRANT_TIMEOUT", "10"))
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "false").lower() == "true"
+QDRANT_POOL_SIZE = int(os.getenv("QDRANT_POOL_SIZE", "20"))
+QDRANT_RETRIES = int(os.getenv("QDRANT_RETRIES", "3"))
+QDRANT_RETRY_BACKOFF = float(os.getenv("QDRANT_RETRY_BACKOFF", "0.5"))
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_async_client = None
+_lock = threading.Lock()
+
+
+def is_local() -> bool:
+    return bool(QDRANT_LOCATION or QDRANT_PATH)
+
+
+def _client_kwargs() -> dict:
+    if QDRANT_PATH:
+        return {"path": QDRANT_PATH}
+    if QDRANT_LOCATION:
+        return {"location": QDRANT_LOCATION}
+    return {
+        "url": QDRANT_URL,
+        "api_key": QDRANT_API_KEY,
+        "timeout": QDRANT_TIMEOUT,
+        "prefer_grpc": QDRANT_PREFER_GRPC,
+        # Keep-alive pool shared by every request in this worker
+        "limits": httpx.Limits(
+            max_connections=QDRANT_POOL_SIZE,
+            max_keepalive_connections=QDRANT_POOL_SIZE,
+        ),
+    }
+
+
+def get_client() -> QdrantClient:
+    """
+    Return the process-wide synchronous Qdrant client.
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = QdrantClient(**_client_kwargs())
+    return _client
+
+
+def get_async_client() -> AsyncQdrantClient:
+    """
+    Return the process-wide async Qdrant client for the FastAPI handlers.
+    Local mode has a single in-process store, so callers go through
+    run_async, which uses get_client() in a thread instead.
+    """
+    global _async_client
+    if is_local():
+        raise RuntimeError("Async client is not available in local Qdrant mode")
+    if _async_client is None:
+        _async_client = AsyncQdrantClient(**_client_kwargs())
+    return _async_client
+
+
+def _is_transient(e: Exception) -> bool:
+    if isinstance(e, (ResponseHandlingException, httpx.TransportError)):
+        return True
+    if isinstance(e, UnexpectedResponse):
+        return e.status_code == 429 or e.status_code >= 500
+    return False
+
+
+def with_retries(fn: Callable[[QdrantClient], Any]) -> Any:
+    """
+    Call fn(client), retrying transient network/server errors with backoff.
+    """
+    for attempt in range(QDRANT_RETRIES + 1):
+        try:
+            return fn(get_client())
+        except Exception as e:
+            if attempt == QDRANT_RETRIES or not _is_transient(e):
+                raise
+            logger.warning("qdrant call failed, retrying", extra={"error": str(e), "attempt": attempt + 1})
+            time.sleep(QDRANT_RETRY_BACKOFF * (2 ** attempt))
+
+
+async def run_async(fn: Callable[[Any], Any]) -> Any:
+    """
+    Async counterpart of with_retries. fn receives a client and must only use
+    methods shared by QdrantClient and AsyncQdrantClient: against a remote
+    cluster it is awaited on the async client, in local mode it runs on the
+    sync client in a thread.
+    """
+    if is_local():
+        return await asyncio.to_thread(with_retries, fn)
+
+    for attempt in range(QDRANT_RETRIES + 1):
+        try:
+            return await fn(get_async_client())
+        except Exception as e:
+            if attempt == QDRANT_RETRIES or not _is_transient(e):
+                raise
+            logger.warning("qdrant call failed, retrying", extra={"error": str(e), "attempt": attempt + 1})
+            await asyncio.sleep(QDRANT_RETRY_BACKOFF * (2 ** attempt))
+
+
+async def close_clients() -> None:
+    global _client, _async_client
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+    if _client is not None:
+        _client.close()
+        _client = None
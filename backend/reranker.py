@@ -0,0 +1,111 @@
+# reranker.py
+import logging
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# Optional second stage for /ask: a small cross-encoder rescores the
+# (question, chunk) pairs of a larger candidate set on CPU. Scoring runs in
+# batches against a per-request deadline; if the budget runs out the caller
+# falls back to the first-stage order.
+RERANKER_ENABLED = os.getenv("RERANKER_ENABLED", "false").lower() == "true"
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "30"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "300"))
+# Minimum reranker score for the best chunk to count as relevant. ms-marco
+# cross-encoders return raw logits; rerank() maps them through a sigmoid so
+# this is a 0-1 relevance (0.2 is a logit of about -1.4)
+RERANK_MIN_SCORE = float(os.getenv("RERANK_MIN_SCORE", "0.2"))
+RERANK_MAX_LENGTH = 512
+
+logger = logging.getLogger(__name__)
+
+_model = None
+_lock = threading.Lock()
+_stats = {"reranked": 0, "fallbacks": 0}
+
+
+def get_model():
+    """
+    Return the process-wide CrossEncoder, loading it on first use.
+    """
+    global _model
+    if _model is None:
+        with _lock:
+            if _model is None:
+                from sentence_transformers import CrossEncoder
+                _model = CrossEncoder(RERANKER_MODEL, max_length=RERANK_MAX_LENGTH, device="cpu")
+    return _model
+
+
+def warm_up() -> None:
+    if not RERANKER_ENABLED:
+        return
+    get_model().predict([("warm up", "warm up")], batch_size=1, show_progress_bar=False)
+    logger.info("reranker ready", extra={"model": RERANKER_MODEL})
+
+
+def candidate_count(top_k: int) -> int:
+    """
+    How many first-stage results to fetch for a final top_k.
+    """
+    return max(top_k, RERANK_CANDIDATES) if RERANKER_ENABLED else top_k
+
+
+def request_deadline() -> float:
+    return time.monotonic() + RERANK_BUDGET_MS / 1000
+
+
+def rerank(
+    query: str,
+    chunks: List[Dict[str, Any]],
+    top_k: int,
+    deadline: Optional[float] = None
+) -> Optional[Tuple[List[Dict[str, Any]], List[float]]]:
+    """
+    Rescore chunks against query and return (top_k chunks, their 0-1
+    scores), best first. Returns None when the deadline would be missed; a batch is
+    only started if the previous one suggests it will finish in time.
+    """
+    if deadline is None:
+        deadline = request_deadline()
+    model = get_model()
+    scores: List[float] = []
+    last_batch = 0.0
+    for start in range(0, len(chunks), RERANK_BATCH_SIZE):
+        if time.monotonic() + last_batch > deadline:
+            _count("fallbacks")
+            return None
+        began = time.monotonic()
+        batch = chunks[start:start + RERANK_BATCH_SIZE]
+        pairs = [(query, chunk["text"]) for chunk in batch]
+        logits = model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        scores.extend(_sigmoid(float(s)) for s in logits)
+        last_batch = time.monotonic() - began
+    if time.monotonic() > deadline:
+        _count("fallbacks")
+        return None
+
+    order = sorted(range(len(chunks)), key=lambda i: scores[i], reverse=True)[:top_k]
+    _count("reranked")
+    return [chunks[i] for i in order], [scores[i] for i in order]
+
+
+def _sigmoid(logit: float) -> float:
+    # Clamped so extreme logits cannot overflow math.exp
+    return 1 / (1 + math.exp(-max(-50.0, min(50.0, logit))))
+
+
+def _count(name: str) -> None:
+    # rerank() runs on several embedding-pool threads at once
+    with _lock:
+        _stats[name] += 1
+
+
+def stats() -> dict:
+    with _lock:
+        counts = dict(_stats)
+    return {"enabled": RERANKER_ENABLED, "model": RERANKER_MODEL if RERANKER_ENABLED else None, **counts}
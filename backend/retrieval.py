@@ -1,79 +1,269 @@
-from typing import List, Dict, Any, Tuple
-from qdrant_client import QdrantClient
-from qdrant_client.models import Filter, FieldCondition, MatchValue
-from sentence_transformers import SentenceTransformer
+from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import logging
 import os
-from models import ChunkMetadata 
-from qdrant_client.models import Filter, FilterSelector
+from models import ChunkMetadata
+from embedder import encode_queries
+from vector_store import get_store, Range
+from workers import run_embedding
+import lexical_index
+import catalog
+import reranker
+from observability import span, timed
 
-COLLECTION_NAME = "legal_chunks"
-EMBEDDER_MODEL = "all-MiniLM-L6-v2"
+logger = logging.getLogger(__name__)
+
+# Hybrid retrieval: fuse vector and BM25 rankings with reciprocal rank fusion
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+RRF_K = int(os.getenv("RRF_K", "60"))
+CANDIDATE_MULTIPLIER = int(os.getenv("CANDIDATE_MULTIPLIER", "3"))
+# Best cosine score for results to count as relevant when not reranked
+MIN_SIMILARITY = float(os.getenv("MIN_SIMILARITY", "0.10"))
+
+
+def _validated_chunks(results) -> Tuple[List[Dict[str, Any]], float]:
+    chunks, scores = [], []
+    for r in results:
+        try:
+            validated = ChunkMetadata(**(r.payload or {}))
+            chunks.append(validated.dict())
+            if r.score is not None:
+                scores.append(r.score)
+        except Exception as e:
+            logger.warning("skipping invalid payload", extra={"error": str(e)})
+
+    return chunks, (max(scores) if scores else 0.0)
+
+
+def _rrf_order(vector_hits, lexical_hits, top_k: int) -> List[str]:
+    """
+    Reciprocal rank fusion of the two rankings; returns the top_k point ids.
+    """
+    fused = {}
+    for rank, r in enumerate(vector_hits):
+        fused[r.id] = fused.get(r.id, 0.0) + 1.0 / (RRF_K + rank + 1)
+    for rank, (point_id, _) in enumerate(lexical_hits):
+        fused[point_id] = fused.get(point_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return sorted(fused, key=fused.get, reverse=True)[:top_k]
+
+
+def _fused_results(order: List[str], vector_hits, fetched) -> list:
+    # Keep the cosine score from the vector side; lexical-only hits have none
+    by_id = {r.id: r for r in vector_hits}
+    by_id.update({r.id: r for r in fetched})
+    return [by_id[i] for i in order if i in by_id]
+
+
+def search_scope(
+    file_id: Optional[str] = None,
+    file_name: Optional[str] = None,
+    page_from: Optional[int] = None,
+    page_to: Optional[int] = None
+) -> Optional[dict]:
+    """
+    Build a store `where` filter restricting search to one document and/or a
+    page range. Returns None when nothing is restricted.
+    """
+    where = {}
+    if file_id:
+        where["file_id"] = file_id
+    if file_name:
+        where["file_name"] = file_name
+    if page_from is not None or page_to is not None:
+        where["page"] = Range(gte=page_from, lte=page_to)
+    return where or None
+
+
+def _ranked(
+    query: str,
+    chunks: List[Dict[str, Any]],
+    best_cosine: float,
+    top_k: int,
+    deadline: Optional[float] = None
+) -> Tuple[List[Dict[str, Any]], float]:
+    """
+    Final top_k and relevance score: the reranker's order and best score when
+    it finishes within budget, else first-stage order and best cosine score.
+    Returns no chunks when the best score is under the matching threshold.
+    """
+    if reranker.RERANKER_ENABLED and chunks:
+        try:
+            with span("rerank"):
+                reranked = reranker.rerank(query, chunks, top_k, deadline)
+        except Exception as e:
+            logger.warning("reranking failed, using vector order", extra={"error": str(e)})
+            reranked = None
+        if reranked is None:
+            logger.info("rerank budget exceeded, using vector order")
+        if reranked is not None:
+            chunks, scores = reranked
+            best = scores[0] if scores else 0.0
+            return (chunks, best) if best >= reranker.RERANK_MIN_SCORE else ([], best)
+    chunks = chunks[:top_k]
+    return (chunks, best_cosine) if best_cosine >= MIN_SIMILARITY else ([], best_cosine)
 
 
 # MULTI-DOCUMENT SEARCH
 def search_similar_chunks(
     query: str,
-    top_k: int = 10
+    top_k: int = 10,
+    where: Optional[dict] = None
 ) -> Tuple[List[Dict[str, Any]], float]:
     """
-    Vector search across ALL documents.
-    Returns (matched_chunks, best_score)
+    Hybrid (vector + BM25) search across ALL documents, or only the chunks
+    matching `where` (see search_scope), optionally reranked.
+    Returns (matched_chunks, best_score); best_score is the best reranker
+    score, or the best cosine score when not reranked. matched_chunks is
+    empty when nothing is relevant enough.
     """
-    client = QdrantClient(
-        url=os.getenv("QDRANT_URL"),
-        api_key=os.getenv("QDRANT_API_KEY")
-    )
-    model = SentenceTransformer(EMBEDDER_MODEL)
-    query_vec = model.encode([query]).tolist()[0]
+    query_vec = encode_queries([query])[0].tolist()
+    store = get_store()
+    fetch_k = reranker.candidate_count(top_k)
+    n_candidates = fetch_k * CANDIDATE_MULTIPLIER if HYBRID_SEARCH else fetch_k
 
     try:
-        results = client.search(
-            collection_name=COLLECTION_NAME,
-            query_vector=query_vec,
-            limit=top_k,
-            with_payload=True
-        )
+        with span("vector_search"):
+            results = store.search(query_vec, n_candidates, where)
+        if HYBRID_SEARCH:
+            with span("lexical_search"):
+                lexical_hits = lexical_index.search(query, n_candidates, where)
+            order = _rrf_order(results, lexical_hits, fetch_k)
+            seen = {r.id for r in results}
+            missing = [i for i in order if i not in seen]
+            fetched = store.retrieve(missing) if missing else []
+            results = _fused_results(order, results, fetched)
     except Exception as e:
-        print(f"❌ Qdrant search error: {e}")
+        logger.error("vector search error", extra={"error": str(e)})
         return [], 0.0
 
-    chunks, scores = [], []
-    for r in results:
-        try:
-            validated = ChunkMetadata(**(r.payload or {}))
-            chunks.append(validated.dict())
-            scores.append(r.score)
-        except Exception as e:
-            print(f"⚠️ Skipping invalid payload: {e}")
+    chunks, best_cosine = _validated_chunks(results)
+    return _ranked(query, chunks, best_cosine, top_k)
 
-    return chunks, (max(scores) if scores else 0.0)
+
+async def search_similar_chunks_async(
+    query: str,
+    top_k: int = 10,
+    query_vec: List[float] = None,
+    where: Optional[dict] = None
+) -> Tuple[List[Dict[str, Any]], float]:
+    """
+    Same as search_similar_chunks, for the async handlers: the query is
+    encoded in the embedding pool (unless query_vec is given) and searched
+    with the async Qdrant client. Reranking also runs in the embedding pool.
+    """
+    if query_vec is None:
+        query_vec = (await run_embedding(encode_queries, [query]))[0].tolist()
+    store = get_store()
+    fetch_k = reranker.candidate_count(top_k)
+    n_candidates = fetch_k * CANDIDATE_MULTIPLIER if HYBRID_SEARCH else fetch_k
+
+    try:
+        if HYBRID_SEARCH:
+            results, lexical_hits = await asyncio.gather(
+                timed("vector_search", store.search_async(query_vec, n_candidates, where)),
+                timed("lexical_search", asyncio.to_thread(lexical_index.search, query, n_candidates, where)),
+            )
+            order = _rrf_order(results, lexical_hits, fetch_k)
+            seen = {r.id for r in results}
+            missing = [i for i in order if i not in seen]
+            fetched = await store.retrieve_async(missing) if missing else []
+            results = _fused_results(order, results, fetched)
+        else:
+            results = await timed("vector_search", store.search_async(query_vec, fetch_k, where))
+    except Exception as e:
+        logger.error("vector search error", extra={"error": str(e)})
+        return [], 0.0
+
+    chunks, best_cosine = _validated_chunks(results)
+    if not reranker.RERANKER_ENABLED:
+        return _ranked(query, chunks, best_cosine, top_k)
+    # The budget starts now, so time spent queued for the pool counts too
+    return await run_embedding(_ranked, query, chunks, best_cosine, top_k, reranker.request_deadline())
+
+
+async def search_batch_async(
+    queries: List[str],
+    query_vecs: List[List[float]],
+    top_k: int = 10,
+    where: Optional[dict] = None
+) -> List[Tuple[List[Dict[str, Any]], float]]:
+    """
+    search_similar_chunks_async for many questions at once (already encoded,
+    one vector per query): one batched vector search, BM25 per query, and a
+    single retrieve for every lexical-only hit. Returns one
+    (matched_chunks, best_score) per query, in order.
+    """
+    if not queries:
+        return []
+    store = get_store()
+    fetch_k = reranker.candidate_count(top_k)
+    n_candidates = fetch_k * CANDIDATE_MULTIPLIER if HYBRID_SEARCH else fetch_k
+
+    try:
+        if HYBRID_SEARCH:
+            vector_hits, lexical_hits = await asyncio.gather(
+                timed("vector_search", store.search_batch_async(query_vecs, n_candidates, where)),
+                timed("lexical_search", asyncio.gather(
+                    *(asyncio.to_thread(lexical_index.search, q, n_candidates, where) for q in queries)
+                )),
+            )
+            orders = [_rrf_order(v, l, fetch_k) for v, l in zip(vector_hits, lexical_hits)]
+            seen = {r.id for hits in vector_hits for r in hits}
+            missing = list({i: None for order in orders for i in order if i not in seen})
+            fetched = await store.retrieve_async(missing) if missing else []
+            results = [_fused_results(o, v, fetched) for o, v in zip(orders, vector_hits)]
+        else:
+            results = await timed("vector_search", store.search_batch_async(query_vecs, fetch_k, where))
+    except Exception as e:
+        logger.error("vector search error", extra={"error": str(e), "queries": len(queries)})
+        return [([], 0.0) for _ in queries]
+
+    validated = [_validated_chunks(hits) for hits in results]
+    if not reranker.RERANKER_ENABLED:
+        return [_ranked(query, chunks, best_cosine, top_k) for query, (chunks, best_cosine) in zip(queries, validated)]
+    # Every query is reranked in the pool at once, against one shared budget
+    deadline = reranker.request_deadline()
+    return list(await asyncio.gather(*(
+        run_embedding(_ranked, query, chunks, best_cosine, top_k, deadline)
+        for query, (chunks, best_cosine) in zip(queries, validated)
+    )))
+
+
+def backfill_indexes() -> None:
+    """
+    Build the BM25 index and the document catalog from stored chunks when
+    they are missing, e.g. for a corpus ingested before they existed.
+    """
+    need_lexical = HYBRID_SEARCH and lexical_index.is_empty()
+    need_catalog = catalog.is_empty()
+    if not (need_lexical or need_catalog):
+        return
+    try:
+        records = get_store().scroll(fields=["text", "page", "file_id", "file_name", "doc_hash"])
+    except Exception as e:
+        logger.warning("could not backfill indexes", extra={"error": str(e)})
+        return
+    if not records:
+        return
+    if need_lexical:
+        lexical_index.rebuild(records)
+        logger.info("lexical index rebuilt", extra={"chunks": len(records)})
+    if need_catalog:
+        catalog.rebuild(records)
+        logger.info("document catalog rebuilt")
 
 
 # LIST FILES FOR FRONTEND DROPDOWN
-def list_files(limit: int = 5000) -> List[Dict[str, str]]:
-    """
-    Return unique {file_id, file_name} pairs present in Qdrant.
-    """
-    client = QdrantClient(
-        url=os.getenv("QDRANT_URL"),
-        api_key=os.getenv("QDRANT_API_KEY")
-    )
-
-    points, _ = client.scroll(
-        collection_name=COLLECTION_NAME,
-        with_payload=True,
-        limit=limit
-    )
-    seen = {}
-    for p in points:
-        try:
-            validated = ChunkMetadata(**(p.payload or {}))
-            if validated.file_id not in seen:
-                seen[validated.file_id] = validated.file_name
-        except Exception as e:
-            print(f"⚠️ Skipping invalid payload: {e}")
+def list_files() -> List[Dict[str, Any]]:
+    """
+    Return the documents in the catalog: file_id, file_name, doc_hash,
+    page_count, chunk_count, ingested_at.
+    """
+    return catalog.list_documents()
 
-    return [{"file_id": fid, "file_name": name} for fid, name in seen.items()]
+
+async def list_files_async() -> List[Dict[str, Any]]:
+    return await asyncio.to_thread(catalog.list_documents)
 
 
 # DELETE BY FILE NAME
@@ -81,16 +271,12 @@ def delete_file_chunks(file_name: str) -> None:
     """
     Delete all chunks belonging to a given file_name.
     """
-    client = QdrantClient(
-        url=os.getenv("QDRANT_URL"),
-        api_key=os.getenv("QDRANT_API_KEY")
-    )
-    client.delete(
-        collection_name=COLLECTION_NAME,
-        points_selector=FilterSelector(
-            filter=Filter(
-                must=[FieldCondition(key="file_name", match=MatchValue(value=file_name))]
-            )
-        ),
-        wait=True
-    )
+    get_store().delete({"file_name": file_name})
+    lexical_index.remove_where("file_name", file_name)
+    catalog.delete_document(file_name)
+
+
+async def delete_file_chunks_async(file_name: str) -> None:
+    await get_store().delete_async({"file_name": file_name})
+    await asyncio.to_thread(lexical_index.remove_where, "file_name", file_name)
+    await asyncio.to_thread(catalog.delete_document, file_name)
@@ -0,0 +1,96 @@
+# semantic_cache.py
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# Reuses retrieval results (and answers) for paraphrased questions: a new
+# question whose embedding is within SEMANTIC_CACHE_THRESHOLD cosine of a
+# recent one skips the vector search and, once available, the LLM call.
+# The index is a fixed-size normalized matrix scanned with one matmul, which
+# is exact and sub-millisecond at these sizes.
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1000"))
+
+
+@dataclass
+class Entry:
+    question: str
+    chunks: List[Dict[str, Any]]
+    score: float
+    answer: Optional[str] = None
+
+
+class SemanticCache:
+    def __init__(self, max_entries: int, threshold: float):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._vectors = None
+        self._entries: List[Optional[Entry]] = [None] * max_entries
+        self._next = 0
+        self._count = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Best-match similarity of every lookup, in 0.1 buckets, for tuning
+        self._histogram = [0] * 10
+
+    def _reset(self, corpus_version: int) -> None:
+        self._vectors = None
+        self._entries = [None] * self.max_entries
+        self._next = 0
+        self._count = 0
+        self._version = corpus_version
+
+    def lookup(self, vector: np.ndarray, corpus_version: int) -> Optional[Entry]:
+        query = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        with self._lock:
+            if corpus_version != self._version:
+                self._reset(corpus_version)
+            if not self._count:
+                self.misses += 1
+                return None
+            sims = self._vectors[:self._count] @ query
+            best = int(np.argmax(sims))
+            similarity = float(sims[best])
+            self._histogram[min(max(int(similarity * 10), 0), 9)] += 1
+            if similarity >= self.threshold:
+                self.hits += 1
+                return self._entries[best]
+            self.misses += 1
+            return None
+
+    def add(self, vector: np.ndarray, corpus_version: int, question: str, chunks, score: float) -> Entry:
+        entry = Entry(question=question, chunks=chunks, score=score)
+        with self._lock:
+            if corpus_version != self._version:
+                self._reset(corpus_version)
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            # Ring buffer: the oldest entry is overwritten once full
+            slot = self._next
+            self._vectors[slot] = vector / max(float(np.linalg.norm(vector)), 1e-12)
+            self._entries[slot] = entry
+            self._next = (slot + 1) % self.max_entries
+            self._count = min(self._count + 1, self.max_entries)
+        return entry
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": self._count,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "best_similarity_histogram": {
+                f"{i / 10:.1f}-{(i + 1) / 10:.1f}": n for i, n in enumerate(self._histogram)
+            },
+        }
+
+
+semantic_cache = SemanticCache(SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD) if SEMANTIC_CACHE_ENABLED else None
@@ -0,0 +1,308 @@
+# summaries.py
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import catalog
+import llm_gateway
+from chunk import tokenize
+from context_builder import CONTEXT_TOKEN_BUDGET, stitch_chunks
+from legalprompt import system_prompt
+from observability import span
+from vector_store import get_store
+
+# Per-document summary trees, built in the background after ingestion:
+# pages are grouped into sections of about SUMMARY_SECTION_TOKENS tokens,
+# each section is summarized (map), then SUMMARY_FANOUT summaries at a time
+# are combined (reduce) until one document summary is left. Summary-style
+# questions are answered from these in one small LLM call.
+SUMMARIES_ENABLED = os.getenv("SUMMARIES_ENABLED", "true").lower() == "true"
+SUMMARY_SECTION_TOKENS = int(os.getenv("SUMMARY_SECTION_TOKENS", "2000"))
+SUMMARY_FANOUT = max(2, int(os.getenv("SUMMARY_FANOUT", "6")))
+SUMMARY_WORDS = int(os.getenv("SUMMARY_WORDS", "200"))
+# Summary calls share the LLM gateway with /ask; keep them to a few at a time
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "2"))
+# Documents still without a summary (ingested before summaries existed,
+# failed, or cut off by a shutdown) are picked up every
+# SUMMARY_BACKFILL_INTERVAL seconds; a failed or abandoned attempt is
+# retried once SUMMARY_RETRY_AFTER seconds have passed since it started
+SUMMARY_BACKFILL_INTERVAL = float(os.getenv("SUMMARY_BACKFILL_INTERVAL", "300"))
+SUMMARY_RETRY_AFTER = float(os.getenv("SUMMARY_RETRY_AFTER", "600"))
+# Document summaries cut from an over-budget context are listed by name, up
+# to this many
+OMITTED_NAMES_SHOWN = 20
+
+logger = logging.getLogger(__name__)
+
+_semaphore = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+_tasks: Set[asyncio.Task] = set()
+_pending: Set[Tuple[str, str]] = set()
+
+MAP_PROMPT = """You are summarizing part of a legal document so questions about it can be answered later.
+Summarize the section below of {file_name} (pages {page_from}-{page_to}) in at most {words} words.
+Keep the parties, dates, amounts, obligations, termination and liability terms and governing law.
+Cite pages like [Source: {file_name} - Page X].
+
+--- SECTION START ---
+{text}
+--- SECTION END ---
+
+Summary:"""
+
+REDUCE_PROMPT = """You are summarizing a legal document so questions about it can be answered later.
+Combine these consecutive partial summaries of {file_name} (pages {page_from}-{page_to}) into one
+summary of at most {words} words. Keep the most important terms and the [Source: ...] citations.
+
+{text}
+
+Summary:"""
+
+
+def sections(pages: list) -> List[Tuple[int, int, str]]:
+    """
+    Group (text, page, source) pages into (page_from, page_to, text) sections
+    of about SUMMARY_SECTION_TOKENS tokens, never splitting a page.
+    """
+    result, texts, first, last, size = [], [], None, None, 0
+    for text, page, _ in pages:
+        n = len(tokenize(text))
+        if texts and size + n > SUMMARY_SECTION_TOKENS:
+            result.append((first, last, "\n\n".join(texts)))
+            texts, first, size = [], None, 0
+        if first is None:
+            first = page
+        texts.append(f"[Page {page}]\n{text}")
+        last, size = page, size + n
+    if texts:
+        result.append((first, last, "\n\n".join(texts)))
+    return result
+
+
+async def _complete(prompt: str) -> str:
+    async with _semaphore:
+        stream = await llm_gateway.open_stream(prompt)
+        return "".join([piece async for piece in stream]).strip()
+
+
+async def build_tree(file_name: str, pages: list) -> Tuple[str, List[Dict]]:
+    """
+    Map-reduce the document. Returns (document_summary, nodes), nodes being
+    every level of the tree as {"level", "position", "page_from", "page_to", "text"}.
+    """
+    level_nodes = [
+        {"level": 0, "position": i, "page_from": a, "page_to": b, "text": text}
+        for i, (a, b, text) in enumerate(sections(pages))
+    ]
+    texts = await asyncio.gather(*(
+        _complete(MAP_PROMPT.format(file_name=file_name, words=SUMMARY_WORDS, **n)) for n in level_nodes
+    ))
+    for node, text in zip(level_nodes, texts):
+        node["text"] = text
+    nodes = list(level_nodes)
+
+    level = 0
+    while len(level_nodes) > 1:
+        level += 1
+        groups = [level_nodes[i:i + SUMMARY_FANOUT] for i in range(0, len(level_nodes), SUMMARY_FANOUT)]
+        level_nodes = [
+            {"level": level, "position": i, "page_from": g[0]["page_from"], "page_to": g[-1]["page_to"],
+             "text": "\n\n".join(n["text"] for n in g)}
+            for i, g in enumerate(groups)
+        ]
+        texts = await asyncio.gather(*(
+            _complete(REDUCE_PROMPT.format(file_name=file_name, words=SUMMARY_WORDS, **n)) for n in level_nodes
+        ))
+        for node, text in zip(level_nodes, texts):
+            node["text"] = text
+        nodes.extend(level_nodes)
+
+    return level_nodes[0]["text"], nodes
+
+
+def pages_from_store(file_id: str) -> list:
+    """
+    Rebuild a stored document's (text, page, source) pages from its chunks,
+    stitching the chunk overlaps back together.
+    """
+    records = get_store().scroll({"file_id": file_id}, fields=["text", "page", "file_name"])
+    by_page: Dict[int, list] = {}
+    for r in records:
+        by_page.setdefault(r.payload.get("page") or 0, []).append(r.payload)
+    return [
+        ("\n".join(c["text"] for c in stitch_chunks(chunks)), page, chunks[0].get("file_name"))
+        for page, chunks in sorted(by_page.items())
+    ]
+
+
+async def summarize_document(file_id: str, doc_hash: str, file_name: str, pages: Optional[list] = None) -> None:
+    """
+    Build and save the summary tree; pages are read back from the vector
+    store when not given.
+    """
+    start = time.perf_counter()
+    try:
+        if pages is None:
+            pages = await asyncio.to_thread(pages_from_store, file_id)
+        with span("summarize"):
+            summary, nodes = await build_tree(file_name, pages)
+        if not summary:
+            raise llm_gateway.LLMError("empty summary")
+        saved = await asyncio.to_thread(catalog.save_summary, file_id, doc_hash, summary, nodes)
+        logger.info("document summarized", extra={
+            "file": file_name, "nodes": len(nodes), "saved": saved,
+            "ms": round((time.perf_counter() - start) * 1000, 1),
+        })
+    except Exception as e:
+        # Summary questions fall back to chunk retrieval until the backfill retries it
+        logger.warning("summarization failed", extra={"file": file_name, "error": str(e)})
+    finally:
+        _pending.discard((file_id, doc_hash))
+
+
+def _copy_summary(doc: Dict) -> bool:
+    """
+    Give the document the summary tree of an already summarized document
+    with the same content (re-uploaded under another name). False if none.
+    """
+    if not doc["doc_hash"]:
+        return False
+    source = catalog.find_summary(doc["doc_hash"], doc["file_id"])
+    if source is None:
+        return False
+    # Citations name the file
+    old, new = f"[Source: {source['file_name']} - ", f"[Source: {doc['file_name']} - "
+    nodes = [dict(n, text=n["text"].replace(old, new)) for n in source["nodes"]]
+    return catalog.save_summary(doc["file_id"], doc["doc_hash"], source["summary"].replace(old, new), nodes)
+
+
+async def _claim(doc: Dict) -> bool:
+    """
+    True if the caller should summarize `doc`: it is not summarized, not
+    being summarized here or by another worker, and has no twin to copy from.
+    """
+    key = (doc["file_id"], doc["doc_hash"])
+    if key in _pending:
+        return False
+    if await asyncio.to_thread(_copy_summary, doc):
+        logger.info("summary copied from identical document", extra={"file": doc["file_name"]})
+        return False
+    if not await asyncio.to_thread(catalog.claim_summary, doc["file_id"], doc["doc_hash"], SUMMARY_RETRY_AFTER):
+        return False
+    _pending.add(key)
+    return True
+
+
+def _track(coro) -> None:
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def schedule(pages: list) -> None:
+    """
+    Start building the summary tree of a just-ingested document unless its
+    current revision already has one (or is being summarized).
+    """
+    if not SUMMARIES_ENABLED or not pages:
+        return
+    file_name = pages[0][2]
+    doc = await asyncio.to_thread(catalog.get_document, file_name)
+    if doc is None or doc["summary"] or not await _claim(doc):
+        return
+    _track(summarize_document(doc["file_id"], doc["doc_hash"], file_name, pages))
+
+
+async def backfill() -> None:
+    """
+    Summarize, one at a time, the documents that still have no summary.
+    """
+    for doc in await asyncio.to_thread(catalog.documents_without_summary):
+        if await _claim(doc):
+            await summarize_document(doc["file_id"], doc["doc_hash"], doc["file_name"])
+
+
+async def _backfill_loop() -> None:
+    while True:
+        try:
+            await backfill()
+        except Exception as e:
+            logger.warning("summary backfill failed", extra={"error": str(e)})
+        await asyncio.sleep(SUMMARY_BACKFILL_INTERVAL)
+
+
+def start_backfill() -> None:
+    """
+    Run the summary backfill now and every SUMMARY_BACKFILL_INTERVAL seconds.
+    Called from FastAPI startup, after backfill_indexes.
+    """
+    if SUMMARIES_ENABLED:
+        _track(_backfill_loop())
+
+
+async def cancel_pending() -> None:
+    interrupted = list(_pending)
+    for task in list(_tasks):
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    # Let the next start retry these right away instead of after SUMMARY_RETRY_AFTER
+    for file_id, doc_hash in interrupted:
+        await asyncio.to_thread(catalog.release_summary_claim, file_id, doc_hash)
+
+
+def summary_context(file_id: Optional[str] = None, file_name: Optional[str] = None) -> Optional[str]:
+    """
+    Prompt context for a summary question: every document summary in scope,
+    plus the section summaries when the scope is a single document, packed
+    under CONTEXT_TOKEN_BUDGET. Document summaries that do not fit are named
+    in a closing note so the answer can say it is partial. None if any
+    document in scope has no summary yet (or there are no documents).
+    """
+    docs = catalog.get_summaries(file_id, file_name)
+    if not docs or any(not d["summary"] for d in docs):
+        return None
+    parts = [
+        (d["file_name"], f"[Document: {d['file_name']} - {d['page_count']} pages]\n{d['summary']}") for d in docs
+    ]
+    # A one-section document's summary is its only section; skip the repeat
+    sections_ = catalog.get_summary_nodes(docs[0]["file_id"]) if len(docs) == 1 and (file_id or file_name) else []
+    if len(sections_) > 1:
+        for node in sections_:
+            parts.append(
+                (None, f"[Section: {docs[0]['file_name']} - Pages {node['page_from']}-{node['page_to']}]\n{node['text']}")
+            )
+
+    # Like context_builder: skip what does not fit, but never return nothing
+    selected, omitted, used = [], [], 0
+    for name, part in parts:
+        size = len(tokenize(part))
+        if selected and used + size > CONTEXT_TOKEN_BUDGET:
+            if name is not None:
+                omitted.append(name)
+            continue
+        selected.append(part)
+        used += size
+    if len(selected) < len(parts):
+        logger.info("summary context truncated", extra={"parts": len(parts), "kept": len(selected), "tokens": used})
+    if omitted:
+        shown = ", ".join(omitted[:OMITTED_NAMES_SHOWN])
+        more = f" and {len(omitted) - OMITTED_NAMES_SHOWN} more" if len(omitted) > OMITTED_NAMES_SHOWN else ""
+        selected.append(
+            f"[Omitted: {len(omitted)} of {len(docs)} document summaries did not fit in this context: {shown}{more}]"
+        )
+    return "\n\n".join(selected)
+
+
+def format_summary_prompt(context: str, question: str, history_context: str = "") -> str:
+    return (
+        f"{system_prompt}\n\n"
+        "The context below holds precomputed summaries of the documents. "
+        "If it ends with an [Omitted: ...] note, say that your answer covers only the documents "
+        "summarised here and name the ones left out. "
+        "Include references to the [Source: ... - Page ...] in your answer wherever relevant.\n\n"
+        f"{history_context}\n\n"
+        f"--- DOCUMENT SUMMARIES START ---\n{context}\n--- DOCUMENT SUMMARIES END ---\n\n"
+        f"User Question: {question}\n\n"
+        "Answer:"
+    )
@@ -0,0 +1,58 @@
+# conftest.py
+import hashlib
+import os
+import re
+import sys
+import tempfile
+import types
+
+import numpy as np
+
+# Backend modules read their configuration at import time, so every store
+# is pointed at a scratch directory (and the LLM at the fake provider)
+# before any test imports them.
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from benchmark import configure_environment  # noqa: E402
+
+configure_environment("local", tempfile.mkdtemp(prefix="legal-doc-tests-"), llm_latency_ms=0, caches=True)
+
+
+class HashingSentenceTransformer:
+    """
+    Deterministic stand-in for sentence_transformers.SentenceTransformer:
+    each word is hashed to a signed slot of a fixed-size vector, so texts
+    sharing words are close. Good enough for ingestion and index bookkeeping
+    checks, not for retrieval quality floors.
+    """
+
+    dimension = 64
+
+    def __init__(self, model_name: str, **kwargs):
+        self.model_name = model_name
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, show_progress_bar=False, **kwargs):
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                digest = hashlib.md5(word.encode()).digest()
+                vectors[row, digest[0] % self.dimension] += 1.0 if digest[1] & 1 else -1.0
+            norm = np.linalg.norm(vectors[row])
+            if norm:
+                vectors[row] /= norm
+        return vectors
+
+
+# Without sentence_transformers the embedder runs on the hashing stand-in, so
+# the ingestion tests still run; tests that need the real model check
+# REAL_EMBEDDER
+try:
+    import sentence_transformers  # noqa: F401
+    REAL_EMBEDDER = True
+except ImportError:
+    sys.modules["sentence_transformers"] = types.SimpleNamespace(SentenceTransformer=HashingSentenceTransformer)
+    REAL_EMBEDDER = False
@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+import answer_cache
+import catalog
+from llm_gateway import LLMError
+from answer_cache import TTLCache
+from embedding_cache import EmbeddingCache, text_hash
+from semantic_cache import SemanticCache
+
+
+def test_ttl_cache_evicts_oldest_and_expires():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # a is now the most recent
+    cache.put("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+
+    short = TTLCache(max_size=2, ttl=0.01)
+    short.put("a", 1)
+    time.sleep(0.02)
+    assert short.get("a") is None
+
+
+def test_corpus_changes_invalidate_cached_answers():
+    before = catalog.corpus_version()
+    assert answer_cache.retrieval_key(" What is the RENT? ", before) == answer_cache.retrieval_key("what is the rent", before)
+
+    catalog.upsert_document("f1", "cached.txt", "h1", 1, 1)
+    after_upload = catalog.corpus_version()
+    catalog.delete_document("cached.txt")
+    after_delete = catalog.corpus_version()
+    assert before < after_upload < after_delete
+    assert answer_cache.answer_key("prompt", before) != answer_cache.answer_key("prompt", after_upload)
+
+
+def test_cached_stream_replays_complete_answers_only():
+    calls = []
+
+    async def open_stream(prompt):
+        calls.append(prompt)
+
+        async def pieces():
+            yield "an "
+            yield "answer"
+        return pieces()
+
+    async def read(stream):
+        return "".join([piece async for piece in await stream])
+
+    async def scenario():
+        first = await read(answer_cache.cached_stream("cache me", 1, open_stream))
+        second = await read(answer_cache.cached_stream("cache me", 1, open_stream))
+        other_version = await read(answer_cache.cached_stream("cache me", 2, open_stream))
+        return first, second, other_version
+
+    answer_cache.clear()
+    assert asyncio.run(scenario()) == ("an answer",) * 3
+    assert len(calls) == 2
+
+
+def test_interrupted_answers_are_not_cached_and_can_raise():
+    async def open_stream(prompt):
+        async def pieces():
+            yield "The governing law is "
+            raise LLMError("upstream reset")
+        return pieces()
+
+    async def read(stream):
+        return "".join([piece async for piece in await stream])
+
+    async def scenario():
+        # /ask: headers are sent, the stream just ends
+        partial = await read(answer_cache.cached_stream("fails", 1, open_stream))
+        with pytest.raises(LLMError):
+            await read(answer_cache.cached_stream("fails", 1, open_stream, raise_errors=True))
+        return partial
+
+    answer_cache.clear()
+    assert asyncio.run(scenario()) == "The governing law is "
+    assert answer_cache.answer_cache.get(answer_cache.answer_key("fails", 1)) is None
+
+
+def test_semantic_cache_resets_on_new_corpus_version():
+    cache = SemanticCache(max_entries=4, threshold=0.9)
+    vector = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+    cache.add(vector, 1, "what is the rent", [{"text": "rent"}], 0.8)
+    assert cache.lookup(np.array([0.99, 0.05, 0.0], dtype=np.float32), 1).question == "what is the rent"
+    assert cache.lookup(np.array([0.0, 1.0, 0.0], dtype=np.float32), 1) is None
+    assert cache.lookup(vector, 2) is None
+
+
+def test_embedding_cache_round_trip_and_eviction(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.db"), max_entries=2)
+    vectors = {text_hash(t): np.full(4, i, dtype=np.float32) for i, t in enumerate(["a", "b", "c"])}
+    cache.put_many("model", dict(list(vectors.items())[:2]))
+    found = cache.get_many("model", list(vectors))
+    assert set(found) == set(list(vectors)[:2])
+    assert cache.get_many("other-model", list(vectors)) == {}
+    cache.put_many("model", dict(list(vectors.items())[2:]))
+    assert cache.stats()["entries"] == 2
+    np.testing.assert_array_equal(cache.get_many("model", [text_hash("c")])[text_hash("c")], np.full(4, 2))
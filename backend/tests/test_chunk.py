@@ -0,0 +1,42 @@
+from chunk import chunk_text, tokenize
+
+
+def pages(*texts, source="doc.txt"):
+    return [{"text": text, "page": i + 1, "source": source} for i, text in enumerate(texts)]
+
+
+def test_chunks_respect_size_and_carry_overlap():
+    text = " ".join(f"w{i}" for i in range(100))
+    chunks = chunk_text(pages(text), chunk_size=30, overlap=5)
+    assert all(len(tokenize(c["text"])) <= 30 for c in chunks)
+    for prev, nxt in zip(chunks, chunks[1:]):
+        assert tokenize(prev["text"])[-5:] == tokenize(nxt["text"])[:5]
+    # Every word is covered
+    covered = set().union(*(tokenize(c["text"]) for c in chunks))
+    assert covered == set(tokenize(text))
+
+
+def test_cut_before_heading_without_overlap():
+    text = " ".join(f"a{i}" for i in range(20)) + "\nSection 2. " + " ".join(f"b{i}" for i in range(20))
+    chunks = chunk_text(pages(text), chunk_size=30, overlap=5)
+    assert chunks[0]["text"].split()[-1] == "a19"
+    assert chunks[1]["text"].startswith("Section 2.")
+
+
+def test_cut_after_sentence_end():
+    text = " ".join(f"a{i}" for i in range(20)) + ". " + " ".join(f"b{i}" for i in range(20))
+    chunks = chunk_text(pages(text), chunk_size=30, overlap=0)
+    assert chunks[0]["text"].endswith("a19.")
+
+
+def test_hard_cut_without_boundaries():
+    text = " ".join(f"w{i}" for i in range(50))
+    chunks = chunk_text(pages(text), chunk_size=20, overlap=0)
+    assert [len(tokenize(c["text"])) for c in chunks] == [20, 20, 10]
+
+
+def test_chunks_span_pages_and_keep_start_page():
+    chunks = chunk_text(pages("one two three", "four five six"), chunk_size=200, overlap=0)
+    assert len(chunks) == 1
+    assert chunks[0]["page"] == 1
+    assert tokenize(chunks[0]["text"]) == ["one", "two", "three", "four", "five", "six"]
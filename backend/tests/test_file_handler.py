@@ -0,0 +1,24 @@
+# test_file_handler.py
+import asyncio
+
+import file_handler
+import workers
+
+
+def test_extract_document_reports_progress_from_the_process_pool(monkeypatch):
+    monkeypatch.setattr(file_handler, "EXTRACT_PROGRESS_INTERVAL", 0.0)
+    content = b"Clause 1. The tenant pays rent monthly."
+    reported = []
+
+    async def extract():
+        try:
+            return await workers.run_cpu_with_progress(
+                reported.append, file_handler.extract_document, "lease.txt", content
+            )
+        finally:
+            workers.shutdown()
+
+    pages, stats = asyncio.run(extract())
+
+    assert stats == {"ocr_pages": 0}
+    assert reported == [len(pages)] == [1]
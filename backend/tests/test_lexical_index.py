@@ -0,0 +1,99 @@
+import multiprocessing
+from types import SimpleNamespace
+
+import pytest
+
+import lexical_index
+from vector_store import Range
+
+
+def _reset_state():
+    # What a freshly started worker sees: nothing loaded yet
+    lexical_index._conn = None
+    lexical_index._generation = None
+    lexical_index._index = lexical_index.LexicalIndex()
+    lexical_index._seq = 0
+
+
+@pytest.fixture(autouse=True)
+def index_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "lexical_index.db")
+    monkeypatch.setattr(lexical_index, "LEXICAL_INDEX_PATH", path)
+    for name in ("_conn", "_generation", "_index", "_seq"):
+        monkeypatch.setattr(lexical_index, name, getattr(lexical_index, name))
+    _reset_state()
+    return path
+
+
+def chunk(point_id, text, file_name="a.txt", page=1):
+    return point_id, text, {"file_id": file_name, "file_name": file_name, "page": page}
+
+
+def test_bm25_ranks_exact_terms_first():
+    lexical_index.add_chunks([
+        chunk("1", "The tenant shall pay rent monthly."),
+        chunk("2", "Clause 14.2 limits the liability of Acme Holdings."),
+        chunk("3", "The landlord shall repair the roof."),
+    ])
+    hits = lexical_index.search("Acme liability", 3)
+    assert hits[0][0] == "2"
+    assert all(score > 0 for _, score in hits)
+    assert lexical_index.search("unrelated words", 3) == []
+
+
+def test_filters():
+    lexical_index.add_chunks([
+        chunk("1", "rent is due", "a.txt", 1),
+        chunk("2", "rent is due", "b.txt", 2),
+        chunk("3", "rent is due", "b.txt", 5),
+    ])
+    assert {p for p, _ in lexical_index.search("rent", 5, {"file_name": "b.txt"})} == {"2", "3"}
+    assert [p for p, _ in lexical_index.search("rent", 5, {"file_name": "b.txt", "page": Range(4, 6)})] == ["3"]
+    assert lexical_index.search("rent", 5, {"file_name": "c.txt"}) == []
+
+
+def test_remove_and_replace():
+    lexical_index.add_chunks([chunk("1", "rent"), chunk("2", "rent", "b.txt"), chunk("3", "deposit")])
+    lexical_index.remove_chunks(["1"])
+    lexical_index.remove_where("file_name", "b.txt")
+    assert lexical_index.search("rent", 5) == []
+    lexical_index.add_chunks([chunk("3", "rent now")])
+    assert [p for p, _ in lexical_index.search("rent", 5)] == ["3"]
+    assert lexical_index.search("deposit", 5) == []
+
+
+def test_changes_are_persisted_for_other_workers():
+    lexical_index.add_chunks([chunk("1", "rent"), chunk("2", "deposit")])
+    lexical_index.remove_chunks(["2"])
+    _reset_state()
+    assert [p for p, _ in lexical_index.search("rent", 5)] == ["1"]
+    assert lexical_index.search("deposit", 5) == []
+
+
+def test_rebuild_replaces_everything():
+    lexical_index.add_chunks([chunk("1", "rent")])
+    lexical_index.rebuild([SimpleNamespace(id="9", payload={"text": "deposit", "file_name": "z.txt"})])
+    assert lexical_index.search("rent", 5) == []
+    _reset_state()
+    assert [p for p, _ in lexical_index.search("deposit", 5)] == ["9"]
+
+
+def _write_chunks(path, worker, n):
+    lexical_index.LEXICAL_INDEX_PATH = path
+    _reset_state()
+    for i in range(n):
+        lexical_index.add_chunks([chunk(f"{worker}-{i}", f"indemnity clause {i}", f"w{worker}.txt")])
+
+
+def test_concurrent_writers_lose_nothing(index_path):
+    # Not fork: the lexical-sync thread may hold _lock at that moment, and a
+    # forked child would inherit it locked
+    ctx = multiprocessing.get_context("spawn")
+    workers = [ctx.Process(target=_write_chunks, args=(index_path, w, 25)) for w in range(3)]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
+        assert p.exitcode == 0
+    _reset_state()
+    assert len(lexical_index.search("indemnity", 100)) == 75
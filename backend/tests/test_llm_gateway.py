@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+import llm_gateway
+from llm_gateway import LLMGateway, LLMProvider, LLMTimeoutError
+
+
+class ScriptedProvider(LLMProvider):
+    """
+    Streams `pieces` with `delay` seconds before each; counts calls and
+    closed streams.
+    """
+    name = "scripted"
+
+    def __init__(self, pieces=("a", "b", "c"), delay=0.01, first_delay=None):
+        self.pieces = pieces
+        self.delay = delay
+        self.first_delay = first_delay
+        self.calls = 0
+        self.closed = 0
+
+    async def stream(self, prompt):
+        self.calls += 1
+        try:
+            for i, piece in enumerate(self.pieces):
+                await asyncio.sleep(self.first_delay if i == 0 and self.first_delay is not None else self.delay)
+                yield piece
+        finally:
+            self.closed += 1
+
+
+async def read(stream):
+    return "".join([piece async for piece in stream])
+
+
+def test_identical_prompts_share_one_generation():
+    async def scenario():
+        provider = ScriptedProvider()
+        gateway = LLMGateway(provider)
+        streams = await asyncio.gather(*(gateway.open_stream("same prompt") for _ in range(5)))
+        answers = await asyncio.gather(*(read(s) for s in streams))
+        other = await read(await gateway.open_stream("other prompt"))
+        return provider, gateway, answers, other
+
+    provider, gateway, answers, other = asyncio.run(scenario())
+    assert answers == ["abc"] * 5 and other == "abc"
+    assert provider.calls == 2
+    assert gateway.stats()["coalesced"] == 4
+    assert gateway.stats()["in_flight"] == 0
+
+
+def test_first_token_timeout_is_retried_then_raised(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "LLM_FIRST_TOKEN_TIMEOUT", 0.05)
+    monkeypatch.setattr(llm_gateway, "LLM_RETRIES", 1)
+    monkeypatch.setattr(llm_gateway, "LLM_RETRY_BACKOFF", 0.0)
+
+    async def scenario():
+        provider = ScriptedProvider(first_delay=1.0)
+        gateway = LLMGateway(provider)
+        with pytest.raises(LLMTimeoutError):
+            await gateway.open_stream("slow prompt")
+        return provider, gateway
+
+    provider, gateway = asyncio.run(scenario())
+    assert provider.calls == 2
+    assert gateway.stats()["timeouts"] == 2
+    assert gateway.stats()["retries"] == 1
+
+
+def test_generation_is_cancelled_when_every_reader_leaves():
+    async def scenario():
+        provider = ScriptedProvider(pieces=[f"p{i} " for i in range(100)])
+        gateway = LLMGateway(provider)
+        first, second = await asyncio.gather(gateway.open_stream("prompt"), gateway.open_stream("prompt"))
+        await first.aclose()
+        await asyncio.sleep(0.03)
+        still_running = gateway.stats()["in_flight"]
+        await second.__anext__()
+        await second.aclose()
+        await asyncio.sleep(0.03)
+        return provider, gateway, still_running
+
+    provider, gateway, still_running = asyncio.run(scenario())
+    assert still_running == 1
+    assert provider.closed == 1
+    assert gateway.stats()["cancelled"] == 1
+    assert gateway.stats()["in_flight"] == 0
+    # The limiter slot was given back
+    assert gateway.limiter._sem._value == llm_gateway.LLM_MAX_CONCURRENCY
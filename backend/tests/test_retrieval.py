@@ -0,0 +1,85 @@
+import pytest
+
+import catalog
+import lexical_index
+from benchmark import bench_ingestion, bench_retrieval, generate_corpus
+from build_vector_store import build_and_save_index
+from conftest import REAL_EMBEDDER
+from retrieval import _rrf_order, delete_file_chunks
+from vector_store import Record, get_store
+
+# Floors for the labelled synthetic corpus; a drop below them is a regression
+RECALL_AT_5_FLOOR = 0.8
+MRR_FLOOR = 0.6
+
+
+@pytest.fixture(scope="module")
+def questions():
+    documents, questions = generate_corpus(n_docs=8, n_pages=3, seed=7)
+    bench_ingestion(documents)
+    return questions
+
+
+def store_ids(file_name):
+    return {str(r.id) for r in get_store().scroll({"file_name": file_name}, fields=False)}
+
+
+def lexical_ids(file_name):
+    with lexical_index._lock:
+        return set(lexical_index._get_index().point_ids_where("file_name", file_name))
+
+
+def renamed(pages, file_name):
+    return [(text, page, file_name) for text, page, _ in pages]
+
+
+def test_rrf_rewards_agreement_between_rankings():
+    vector_hits = [Record(id=i, payload={}) for i in ("a", "b", "c")]
+    lexical_hits = [("c", 3.0), ("d", 2.0)]
+    assert _rrf_order(vector_hits, lexical_hits, 2) == ["c", "a"]
+    assert _rrf_order(vector_hits, [], 5) == ["a", "b", "c"]
+
+
+@pytest.mark.skipif(not REAL_EMBEDDER, reason="quality floors are for the real embedding model")
+def test_recall_and_mrr_floors(questions):
+    report = bench_retrieval(questions, k=5)
+    assert report["recall_at_5"] >= RECALL_AT_5_FLOOR, report
+    assert report["mrr"] >= MRR_FLOOR, report
+
+
+def test_ingest_revision_and_delete_keep_indexes_in_sync(questions):
+    documents, _ = generate_corpus(n_docs=1, n_pages=3, seed=11)
+    pages = renamed(documents[0], "contract.txt")
+
+    result = build_and_save_index(pages)
+    ids = store_ids("contract.txt")
+    doc = catalog.get_document("contract.txt")
+    assert result["status"] == "uploaded" and result["chunks"] == len(ids) > 0
+    assert lexical_ids("contract.txt") == ids
+    assert (doc["chunk_count"], doc["page_count"]) == (len(ids), 3)
+
+    # Unchanged upload: nothing happens, caches stay valid
+    version = catalog.corpus_version()
+    assert build_and_save_index(pages)["status"] == "skipped"
+    assert catalog.corpus_version() == version
+
+    # New revision: same file_id, only changed chunks embedded, stale ones gone
+    revised = pages[:2] + [("Section 9. Notices\nAll notices go to the registered office.", 3, "contract.txt")]
+    result = build_and_save_index(revised)
+    revised_ids = store_ids("contract.txt")
+    assert result["reused"] > 0 and result["embedded"] < result["chunks"]
+    assert catalog.get_document("contract.txt")["file_id"] == doc["file_id"]
+    assert catalog.corpus_version() > version
+    assert lexical_ids("contract.txt") == revised_ids
+    assert result["deleted"] == len(ids - revised_ids)
+    assert all("registered office" in r.payload["text"] or r.payload["page"] < 3
+               for r in get_store().scroll({"file_name": "contract.txt"}))
+
+    # Same content under another name reuses the vectors
+    result = build_and_save_index(renamed(revised, "contract copy.txt"))
+    assert result["embedded"] == 0 and result["reused"] == len(revised_ids)
+
+    delete_file_chunks("contract.txt")
+    assert store_ids("contract.txt") == set() and lexical_ids("contract.txt") == set()
+    assert catalog.get_document("contract.txt") is None
+    assert len(store_ids("contract copy.txt")) == len(revised_ids)
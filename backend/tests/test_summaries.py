@@ -0,0 +1,38 @@
+# test_summaries.py
+import pytest
+
+import catalog
+import summaries
+
+
+@pytest.fixture(autouse=True)
+def catalog_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, "CATALOG_DB_PATH", str(tmp_path / "catalog.db"))
+    monkeypatch.setattr(catalog, "_initialized", False)
+
+
+def _add_summarized(file_name: str, summary: str) -> None:
+    file_id = f"id-{file_name}"
+    catalog.upsert_document(file_id, file_name, f"hash-{file_name}", 1, 1)
+    assert catalog.save_summary(file_id, f"hash-{file_name}", summary, [])
+
+
+def test_summary_context_names_documents_that_did_not_fit(monkeypatch):
+    monkeypatch.setattr(summaries, "CONTEXT_TOKEN_BUDGET", 60)
+    for i in range(4):
+        _add_summarized(f"lease_{i}.txt", " ".join(["rent"] * 40))
+
+    context = summaries.summary_context()
+
+    assert "[Document: lease_0.txt" in context
+    assert context.endswith("]")
+    note = context.rsplit("\n\n", 1)[1]
+    assert note.startswith("[Omitted: 3 of 4 document summaries")
+    assert all(f"lease_{i}.txt" in note for i in range(1, 4))
+
+
+def test_summary_context_waits_for_every_summary():
+    _add_summarized("lease.txt", "A lease.")
+    catalog.upsert_document("id-nda", "nda.txt", "hash-nda", 1, 1)
+
+    assert summaries.summary_context() is None
@@ -0,0 +1,102 @@
+import time
+
+import numpy as np
+import pytest
+
+import vector_store
+from vector_store import LocalVectorStore, Range, Record
+
+
+def records(n, start=0, file_name="a.txt", dim=8, seed=0):
+    rng = np.random.default_rng(seed + start)
+    return [
+        Record(id=f"p{start + i}", vector=rng.normal(size=dim).tolist(),
+               payload={"file_id": file_name, "file_name": file_name, "page": i % 10, "text": f"chunk {start + i}"})
+        for i in range(n)
+    ]
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = LocalVectorStore(str(tmp_path / "store"))
+    s.ensure_collection(8)
+    return s
+
+
+def wait_for_compaction(s):
+    for _ in range(200):
+        if not s._compacting:
+            return
+        time.sleep(0.01)
+
+
+def test_search_finds_nearest(store):
+    points = records(50)
+    store.upsert(points)
+    hits = store.search(points[7].vector, 3)
+    assert hits[0].id == "p7"
+    assert hits[0].score == pytest.approx(1.0, abs=1e-5)
+    batch = store.search_batch([points[3].vector, points[9].vector], 1)
+    assert [[h.id for h in hits] for hits in batch] == [["p3"], ["p9"]]
+
+
+def test_filters(store):
+    store.upsert(records(20, 0, "a.txt") + records(20, 100, "b.txt"))
+    assert {r.payload["file_name"] for r in store.scroll({"file_name": "b.txt"})} == {"b.txt"}
+    assert len(store.scroll({"file_name": "b.txt", "page": Range(2, 3)})) == 4
+    query = records(1, 100, "b.txt")[0].vector
+    assert all(h.payload["file_name"] == "a.txt" for h in store.search(query, 5, {"file_name": "a.txt"}))
+    assert store.search(query, 5, {"file_name": "missing.txt"}) == []
+
+
+def test_deletes_and_payload_updates(store):
+    points = records(20)
+    store.upsert(points)
+    store.delete_ids(["p1"])
+    store.delete({"page": 2})
+    store.set_payload(["p3"], {"doc_hash": "h"})
+    ids = {r.id for r in store.scroll()}
+    assert "p1" not in ids and "p2" not in ids and "p12" not in ids
+    assert all(h.id != "p1" for h in store.search(points[1].vector, 20))
+    assert store.retrieve(["p3"])[0].payload["doc_hash"] == "h"
+    assert store.scroll({"doc_hash": "h"})[0].id == "p3"
+
+
+def test_upsert_replaces_existing_id(store):
+    store.upsert(records(5))
+    replacement = Record(id="p0", vector=[1.0] + [0.0] * 7, payload={"file_name": "c.txt"})
+    store.upsert([replacement])
+    assert len(store.scroll()) == 5
+    assert store.retrieve(["p0"])[0].payload == {"file_name": "c.txt"}
+    assert store.search(replacement.vector, 1)[0].id == "p0"
+
+
+def test_state_survives_reload(store, tmp_path):
+    points = records(30)
+    store.upsert(points)
+    store.delete_ids(["p4"])
+    store.set_payload(["p5"], {"x": 1})
+    reloaded = LocalVectorStore(str(tmp_path / "store"))
+    assert len(reloaded.scroll()) == 29
+    assert reloaded.retrieve(["p5"])[0].payload["x"] == 1
+    assert reloaded.search(points[6].vector, 1)[0].id == "p6"
+
+
+def test_compaction_keeps_live_points(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_store, "LOCAL_GROW_ROWS", 16)
+    s = LocalVectorStore(str(tmp_path / "store"))
+    s.ensure_collection(8)
+    s.upsert(records(100, 0, "a.txt") + records(20, 200, "b.txt"))
+    s.delete({"file_name": "a.txt"})
+    # Writes racing the background compaction are carried over
+    s.upsert(records(10, 300, "c.txt"))
+    s.delete_ids(["p300"])
+    wait_for_compaction(s)
+    assert s._generation == 2
+    assert s._count < 120
+    expected = {f"p{i}" for i in range(200, 220)} | {f"p{i}" for i in range(301, 310)}
+    assert {r.id for r in s.scroll()} == expected
+    reloaded = LocalVectorStore(str(tmp_path / "store"))
+    assert {r.id for r in reloaded.scroll()} == expected
+    vector = reloaded.retrieve(["p305"], with_vectors=True)[0].vector
+    assert reloaded.search(vector, 1)[0].id == "p305"
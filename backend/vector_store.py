@@ -0,0 +1,809 @@
+# vector_store.py
+import asyncio
+import json
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from qdrant_client.models import (
+    Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue,
+    FilterSelector, PointIdsList, PayloadSchemaType, HnswConfigDiff, SearchParams,
+    QuantizationSearchParams, ScalarQuantization, ScalarQuantizationConfig, ScalarType,
+    BinaryQuantization, BinaryQuantizationConfig, QueryRequest,
+)
+from qdrant_client.models import Range as QdrantRange
+
+from qdrant_connection import get_client, is_local, with_retries, run_async
+
+logger = logging.getLogger(__name__)
+
+# "qdrant" (cluster or local Qdrant, see qdrant_connection) or "local"
+# (NumPy/FAISS on this node, no network hop)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "qdrant").lower()
+COLLECTION_NAME = os.getenv("COLLECTION_NAME", "legal_chunks")
+LOCAL_STORE_PATH = os.getenv("LOCAL_STORE_PATH", "vector_store")
+LOCAL_INDEX = os.getenv("LOCAL_INDEX", "flat").lower()  # flat | hnsw (needs faiss)
+# Local store files grow by at least this many rows at a time; tombstoned
+# rows are compacted away once they exceed this fraction of all rows
+LOCAL_GROW_ROWS = int(os.getenv("LOCAL_GROW_ROWS", "4096"))
+LOCAL_COMPACT_RATIO = float(os.getenv("LOCAL_COMPACT_RATIO", "0.3"))
+
+# Qdrant collection layout, applied when a collection is created (run
+# migrate_collection.py to rebuild an existing one). With quantization the
+# compressed vectors stay in RAM and the float32 originals can live on disk
+# (QDRANT_ON_DISK=true); searches oversample and rescore with the originals.
+QDRANT_QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "none").lower()  # none | scalar | binary
+QDRANT_ON_DISK = os.getenv("QDRANT_ON_DISK", "false").lower() == "true"
+QDRANT_RESCORE = os.getenv("QDRANT_RESCORE", "true").lower() == "true"
+QDRANT_OVERSAMPLING = float(os.getenv("QDRANT_OVERSAMPLING", "2.0"))
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCT = int(os.getenv("HNSW_EF_CONSTRUCT", "100"))
+HNSW_ON_DISK = os.getenv("HNSW_ON_DISK", "false").lower() == "true"
+# Search-time beam width; unset uses the server default
+HNSW_EF = int(os.getenv("HNSW_EF")) if os.getenv("HNSW_EF") else None
+
+# Payload fields every backend keeps an index for
+INDEXED_FIELDS = ("file_id", "file_name", "doc_hash", "page")
+PAYLOAD_SCHEMA = {
+    "file_id": PayloadSchemaType.KEYWORD,
+    "file_name": PayloadSchemaType.KEYWORD,
+    "doc_hash": PayloadSchemaType.KEYWORD,
+    "page": PayloadSchemaType.INTEGER,
+}
+
+
+@dataclass(frozen=True)
+class Range:
+    """
+    Inclusive numeric range for a `where` value, e.g. {"page": Range(3, 7)}.
+    Either bound may be None.
+    """
+    gte: Optional[float] = None
+    lte: Optional[float] = None
+
+    def __contains__(self, value) -> bool:
+        if value is None:
+            return False
+        return (self.gte is None or value >= self.gte) and (self.lte is None or value <= self.lte)
+
+
+@dataclass
+class Record:
+    id: str
+    payload: Dict[str, Any]
+    vector: Optional[List[float]] = None
+    score: Optional[float] = None
+
+
+class VectorStore(ABC):
+    """
+    Storage for chunk vectors + payloads. `where` arguments are
+    {payload_field: value} filters combined with AND; a value is matched
+    exactly, or by bounds when it is a Range.
+    """
+
+    @abstractmethod
+    def ensure_collection(self, dim: int) -> None: ...
+
+    @abstractmethod
+    def upsert(self, records: List[Record], wait: bool = True) -> None: ...
+
+    @abstractmethod
+    def search(self, vector: List[float], limit: int, where: Optional[dict] = None) -> List[Record]: ...
+
+    @abstractmethod
+    def scroll(self, where: Optional[dict] = None, fields=True, with_vectors: bool = False, limit: Optional[int] = None) -> List[Record]: ...
+
+    @abstractmethod
+    def retrieve(self, ids: List[str], with_vectors: bool = False) -> List[Record]: ...
+
+    @abstractmethod
+    def set_payload(self, ids: List[str], payload: dict) -> None: ...
+
+    @abstractmethod
+    def delete_ids(self, ids: List[str]) -> None: ...
+
+    @abstractmethod
+    def delete(self, where: dict) -> None: ...
+
+    def search_batch(self, vectors: List[List[float]], limit: int, where: Optional[dict] = None) -> List[List[Record]]:
+        """
+        One result list per query vector; backends with a native batch API
+        answer all of them in a single call.
+        """
+        return [self.search(v, limit, where) for v in vectors]
+
+    def exists(self, where: dict) -> bool:
+        return bool(self.scroll(where, fields=False, limit=1))
+
+    # Async variants for the FastAPI handlers; backends without a native
+    # async client run the sync call in a thread.
+    async def search_async(self, vector: List[float], limit: int, where: Optional[dict] = None) -> List[Record]:
+        return await asyncio.to_thread(self.search, vector, limit, where)
+
+    async def search_batch_async(self, vectors: List[List[float]], limit: int, where: Optional[dict] = None) -> List[List[Record]]:
+        return await asyncio.to_thread(self.search_batch, vectors, limit, where)
+
+    async def scroll_async(self, where: Optional[dict] = None, fields=True, with_vectors: bool = False, limit: Optional[int] = None) -> List[Record]:
+        return await asyncio.to_thread(self.scroll, where, fields, with_vectors, limit)
+
+    async def retrieve_async(self, ids: List[str], with_vectors: bool = False) -> List[Record]:
+        return await asyncio.to_thread(self.retrieve, ids, with_vectors)
+
+    async def delete_async(self, where: dict) -> None:
+        await asyncio.to_thread(self.delete, where)
+
+
+def _to_filter(where: Optional[dict]) -> Optional[Filter]:
+    if not where:
+        return None
+    conditions = []
+    for key, value in where.items():
+        if isinstance(value, Range):
+            conditions.append(FieldCondition(key=key, range=QdrantRange(gte=value.gte, lte=value.lte)))
+        else:
+            conditions.append(FieldCondition(key=key, match=MatchValue(value=value)))
+    return Filter(must=conditions)
+
+
+def _quantization_config():
+    if QDRANT_QUANTIZATION == "scalar":
+        return ScalarQuantization(
+            scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+        )
+    if QDRANT_QUANTIZATION == "binary":
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+    if QDRANT_QUANTIZATION == "none":
+        return None
+    raise ValueError(f"Unsupported QDRANT_QUANTIZATION: {QDRANT_QUANTIZATION}")
+
+
+def collection_config(dim: int) -> dict:
+    """
+    create_collection arguments for the configured vector layout.
+    """
+    return dict(
+        vectors_config=VectorParams(size=dim, distance=Distance.COSINE, on_disk=QDRANT_ON_DISK),
+        hnsw_config=HnswConfigDiff(m=HNSW_M, ef_construct=HNSW_EF_CONSTRUCT, on_disk=HNSW_ON_DISK),
+        quantization_config=_quantization_config(),
+    )
+
+
+def search_params() -> Optional[SearchParams]:
+    quantization = None
+    if QDRANT_QUANTIZATION != "none":
+        quantization = QuantizationSearchParams(rescore=QDRANT_RESCORE, oversampling=QDRANT_OVERSAMPLING)
+    if HNSW_EF is None and quantization is None:
+        return None
+    return SearchParams(hnsw_ef=HNSW_EF, quantization=quantization)
+
+
+def create_payload_indexes(client, collection_name: str) -> None:
+    # Local Qdrant has no payload indexes
+    if is_local():
+        return
+    existing = client.get_collection(collection_name).payload_schema or {}
+    for field, schema in PAYLOAD_SCHEMA.items():
+        if field not in existing:
+            client.create_payload_index(
+                collection_name=collection_name,
+                field_name=field,
+                field_schema=schema,
+                wait=True
+            )
+
+
+def _to_record(point) -> Record:
+    return Record(
+        id=str(point.id),
+        payload=point.payload or {},
+        vector=getattr(point, "vector", None),
+        score=getattr(point, "score", None),
+    )
+
+
+class QdrantVectorStore(VectorStore):
+    def __init__(self, collection_name: str = COLLECTION_NAME):
+        self.collection_name = collection_name
+
+    def ensure_collection(self, dim: int) -> None:
+        # Create collection if not exists (do not delete existing data)
+        client = get_client()
+        if not client.collection_exists(self.collection_name):
+            client.create_collection(collection_name=self.collection_name, **collection_config(dim))
+        # Payload indexes keep filtered search, existence checks and deletes
+        # by file fast; collections created before they existed get them too
+        create_payload_indexes(client, self.collection_name)
+
+    def upsert(self, records: List[Record], wait: bool = True) -> None:
+        points = [PointStruct(id=r.id, vector=r.vector, payload=r.payload) for r in records]
+        with_retries(lambda c: c.upsert(collection_name=self.collection_name, points=points, wait=wait))
+
+    def _search_kwargs(self, vector, limit, where) -> dict:
+        return dict(
+            collection_name=self.collection_name,
+            query=vector,
+            query_filter=_to_filter(where),
+            search_params=search_params(),
+            limit=limit,
+            with_payload=True
+        )
+
+    def search(self, vector, limit, where=None) -> List[Record]:
+        kwargs = self._search_kwargs(vector, limit, where)
+        response = with_retries(lambda c: c.query_points(**kwargs))
+        return [_to_record(p) for p in response.points]
+
+    async def search_async(self, vector, limit, where=None) -> List[Record]:
+        kwargs = self._search_kwargs(vector, limit, where)
+        response = await run_async(lambda c: c.query_points(**kwargs))
+        return [_to_record(p) for p in response.points]
+
+    def _batch_requests(self, vectors, limit, where) -> List[QueryRequest]:
+        query_filter, params = _to_filter(where), search_params()
+        return [
+            QueryRequest(query=v, filter=query_filter, params=params, limit=limit, with_payload=True)
+            for v in vectors
+        ]
+
+    def search_batch(self, vectors, limit, where=None) -> List[List[Record]]:
+        requests = self._batch_requests(vectors, limit, where)
+        responses = with_retries(
+            lambda c: c.query_batch_points(collection_name=self.collection_name, requests=requests)
+        )
+        return [[_to_record(p) for p in r.points] for r in responses]
+
+    async def search_batch_async(self, vectors, limit, where=None) -> List[List[Record]]:
+        requests = self._batch_requests(vectors, limit, where)
+        responses = await run_async(
+            lambda c: c.query_batch_points(collection_name=self.collection_name, requests=requests)
+        )
+        return [[_to_record(p) for p in r.points] for r in responses]
+
+    def _scroll_page(self, client, where, fields, with_vectors, limit, offset):
+        return client.scroll(
+            collection_name=self.collection_name,
+            scroll_filter=_to_filter(where),
+            with_payload=fields,
+            with_vectors=with_vectors,
+            limit=limit,
+            offset=offset
+        )
+
+    def scroll(self, where=None, fields=True, with_vectors=False, limit=None) -> List[Record]:
+        records, offset = [], None
+        while True:
+            page_size = min(1000, limit - len(records)) if limit else 1000
+            batch, offset = with_retries(lambda c: self._scroll_page(c, where, fields, with_vectors, page_size, offset))
+            records.extend(_to_record(p) for p in batch)
+            if offset is None or (limit and len(records) >= limit):
+                return records
+
+    async def scroll_async(self, where=None, fields=True, with_vectors=False, limit=None) -> List[Record]:
+        records, offset = [], None
+        while True:
+            page_size = min(1000, limit - len(records)) if limit else 1000
+            batch, offset = await run_async(lambda c: self._scroll_page(c, where, fields, with_vectors, page_size, offset))
+            records.extend(_to_record(p) for p in batch)
+            if offset is None or (limit and len(records) >= limit):
+                return records
+
+    def retrieve(self, ids, with_vectors=False) -> List[Record]:
+        points = with_retries(lambda c: c.retrieve(self.collection_name, ids=ids, with_vectors=with_vectors))
+        return [_to_record(p) for p in points]
+
+    async def retrieve_async(self, ids, with_vectors=False) -> List[Record]:
+        points = await run_async(lambda c: c.retrieve(self.collection_name, ids=ids, with_vectors=with_vectors))
+        return [_to_record(p) for p in points]
+
+    def set_payload(self, ids, payload) -> None:
+        with_retries(lambda c: c.set_payload(collection_name=self.collection_name, payload=payload, points=ids))
+
+    def delete_ids(self, ids) -> None:
+        with_retries(lambda c: c.delete(
+            collection_name=self.collection_name, points_selector=PointIdsList(points=ids), wait=True
+        ))
+
+    def delete(self, where) -> None:
+        with_retries(lambda c: c.delete(
+            collection_name=self.collection_name,
+            points_selector=FilterSelector(filter=_to_filter(where)),
+            wait=True
+        ))
+
+    async def delete_async(self, where) -> None:
+        await run_async(lambda c: c.delete(
+            collection_name=self.collection_name,
+            points_selector=FilterSelector(filter=_to_filter(where)),
+            wait=True
+        ))
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Single-node store. Normalized float32 vectors live in a pre-grown,
+    memory-mapped file that rows are only ever appended to; ids and payloads
+    live in an append-only JSON-lines log replayed at startup. Writes cost
+    O(batch): deletes and replaced points leave tombstones, and a background
+    compaction rewrites both files as a new generation once tombstones pass
+    LOCAL_COMPACT_RATIO. Unfiltered search is brute-force NumPy (or FAISS
+    HNSW with LOCAL_INDEX=hnsw, grown incrementally and rebuilt in the
+    background); filtered search only scans the matching rows. Not shared
+    across processes, so run it with a single uvicorn worker.
+    """
+
+    def __init__(self, path: str = LOCAL_STORE_PATH, index_type: str = LOCAL_INDEX):
+        self.path = path
+        self.index_type = index_type
+        self._lock = threading.RLock()
+        self._ids: List[str] = []
+        self._payloads: List[Optional[dict]] = []
+        self._row: Dict[str, int] = {}
+        self._field_rows: Dict[str, Dict[Any, set]] = {f: {} for f in INDEXED_FIELDS}
+        self._dim: Optional[int] = None
+        self._mm = None  # memmap over the whole (pre-grown) vector file
+        self._count = 0  # rows in use, tombstones included
+        self._generation = 0
+        self._log = None
+        self._log_ops = 0
+        self._compacting = False
+        self._faiss_index = None
+        self._faiss_building = False
+        self._load()
+
+    @property
+    def _vectors(self):
+        return None if self._mm is None else self._mm[:self._count]
+
+    # --- persistence ---
+
+    def _files(self, generation: int):
+        return (
+            os.path.join(self.path, f"vectors.{generation}.f32"),
+            os.path.join(self.path, f"payloads.{generation}.jsonl"),
+        )
+
+    def _meta_file(self) -> str:
+        return os.path.join(self.path, "meta.json")
+
+    def _load(self) -> None:
+        if os.path.exists(self._meta_file()):
+            with open(self._meta_file(), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self._dim, self._generation = meta["dim"], meta["generation"]
+            self._open_generation()
+            self._replay()
+            self._remove_other_generations()
+            self._start_faiss_build()
+        elif os.path.exists(os.path.join(self.path, "payloads.json")):
+            self._migrate_single_file_store()
+
+    def _migrate_single_file_store(self) -> None:
+        # Stores written before the append-only layout: vectors.npy + payloads.json
+        with open(os.path.join(self.path, "payloads.json"), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        vectors = np.load(os.path.join(self.path, "vectors.npy"), mmap_mode="r")
+        live = [r for r, p in enumerate(data["payloads"]) if p is not None]
+        self._dim = vectors.shape[1]
+        self._write_generation(1, vectors, live, data["ids"], data["payloads"])
+        self._generation = 1
+        self._write_meta()
+        self._open_generation()
+        self._replay()
+        for name in ("vectors.npy", "payloads.json"):
+            os.remove(os.path.join(self.path, name))
+        logger.info("local vector store migrated", extra={"points": len(live)})
+        self._start_faiss_build()
+
+    def _write_meta(self) -> None:
+        tmp = self._meta_file() + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"dim": self._dim, "generation": self._generation}, f)
+        os.replace(tmp, self._meta_file())
+
+    def _open_generation(self) -> None:
+        vectors_file, log_file = self._files(self._generation)
+        os.makedirs(self.path, exist_ok=True)
+        for name in (vectors_file, log_file):
+            if not os.path.exists(name):
+                open(name, "wb").close()
+        capacity = os.path.getsize(vectors_file) // (4 * self._dim)
+        self._mm = None
+        if capacity:
+            self._mm = np.memmap(vectors_file, dtype=np.float32, mode="r+", shape=(capacity, self._dim))
+        self._log = open(log_file, "a", encoding="utf-8")
+
+    def _remove_other_generations(self) -> None:
+        current = set(self._files(self._generation))
+        for name in os.listdir(self.path):
+            full = os.path.join(self.path, name)
+            if name.startswith(("vectors.", "payloads.")) and full not in current:
+                try:
+                    os.remove(full)
+                except OSError:
+                    pass
+
+    def _replay(self) -> None:
+        _, log_file = self._files(self._generation)
+        good = 0
+        with open(log_file, "rb") as f:
+            for line in f:
+                # A torn last line (crash mid-write) ends the log
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    op = json.loads(line)
+                except ValueError:
+                    break
+                self._apply(op)
+                good += len(line)
+        if good < os.path.getsize(log_file):
+            self._log.flush()
+            with open(log_file, "r+b") as f:
+                f.truncate(good)
+        self._log_ops = sum(1 for _ in open(log_file, "rb"))
+
+    def _apply(self, op: dict) -> None:
+        kind, row = op["op"], op["row"]
+        if kind == "put":
+            old = self._row.get(op["id"])
+            if old is not None:
+                self._unindex_row(old)
+            self._ids.append(op["id"])
+            self._payloads.append(op["payload"])
+            self._index_row(row, op["id"], op["payload"])
+            self._count = row + 1
+        elif kind == "del":
+            if self._payloads[row] is not None:
+                self._unindex_row(row)
+        elif kind == "set":
+            if self._payloads[row] is not None:
+                point_id = self._ids[row]
+                self._unindex_row(row)
+                self._payloads[row] = op["payload"]
+                self._index_row(row, point_id, op["payload"])
+
+    def _append_log(self, ops: List[dict]) -> None:
+        self._log.write("".join(json.dumps(op) + "\n" for op in ops))
+        self._log.flush()
+        self._log_ops += len(ops)
+
+    def _grow(self, needed: int) -> None:
+        capacity = 0 if self._mm is None else self._mm.shape[0]
+        if self._count + needed <= capacity:
+            return
+        # Double the file so appends stay amortized O(batch)
+        capacity = max(LOCAL_GROW_ROWS, capacity * 2, self._count + needed)
+        vectors_file, _ = self._files(self._generation)
+        if self._mm is not None:
+            self._mm.flush()
+        with open(vectors_file, "r+b") as f:
+            f.truncate(capacity * self._dim * 4)
+        self._mm = np.memmap(vectors_file, dtype=np.float32, mode="r+", shape=(capacity, self._dim))
+
+    def _write_generation(self, generation: int, vectors, rows: List[int], ids: List[str], payloads: list) -> None:
+        """
+        Write `rows` of (vectors, ids, payloads) as a fresh generation's files.
+        """
+        vectors_file, log_file = self._files(generation)
+        os.makedirs(self.path, exist_ok=True)
+        capacity = max(LOCAL_GROW_ROWS, len(rows) * 2)
+        out = np.memmap(vectors_file, dtype=np.float32, mode="w+", shape=(capacity, self._dim))
+        for start in range(0, len(rows), LOCAL_GROW_ROWS):
+            part = rows[start:start + LOCAL_GROW_ROWS]
+            out[start:start + len(part)] = vectors[part]
+        out.flush()
+        del out
+        with open(log_file, "w", encoding="utf-8") as f:
+            for new_row, row in enumerate(rows):
+                f.write(json.dumps({"op": "put", "row": new_row, "id": ids[row], "payload": payloads[row]}) + "\n")
+
+    # --- compaction (background) ---
+
+    def _maybe_compact(self) -> None:
+        # Caller holds the lock
+        dead = self._count - len(self._row)
+        if self._compacting or not dead:
+            return
+        if dead > LOCAL_COMPACT_RATIO * self._count or self._log_ops > 3 * self._count:
+            self._compacting = True
+            threading.Thread(target=self._compact, name="local-store-compact", daemon=True).start()
+
+    def _compact(self) -> None:
+        """
+        Copy the live rows to the next generation without holding the lock,
+        then, under the lock, carry over writes made meanwhile and switch.
+        """
+        try:
+            with self._lock:
+                generation, count = self._generation, self._count
+                live = [r for r in range(count) if self._payloads[r] is not None]
+                ids, payloads = list(self._ids), list(self._payloads)
+                self._log.flush()
+                offset = os.path.getsize(self._files(generation)[1])
+            old_vectors_file, old_log_file = self._files(generation)
+            old = np.memmap(old_vectors_file, dtype=np.float32, mode="r", shape=(count, self._dim))
+            self._write_generation(generation + 1, old, live, ids, payloads)
+            del old
+
+            with self._lock:
+                # Writes since the snapshot, in old row numbers
+                with open(old_log_file, "rb") as f:
+                    f.seek(offset)
+                    tail = [json.loads(line) for line in f]
+                tail_vectors = {op["row"]: np.array(self._mm[op["row"]]) for op in tail if op["op"] == "put"}
+
+                self._log.close()
+                self._faiss_index = None
+                self._ids, self._payloads, self._count = [], [], 0
+                self._row, self._field_rows = {}, {f: {} for f in INDEXED_FIELDS}
+                self._generation = generation + 1
+                self._open_generation()
+                self._replay()
+
+                remap = {old_row: new_row for new_row, old_row in enumerate(live)}
+                for op in tail:
+                    if op["op"] == "put":
+                        remap[op["row"]] = self._count
+                        self._append([Record(id=op["id"], payload=op["payload"], vector=tail_vectors[op["row"]])])
+                    elif op["row"] in remap:
+                        op = dict(op, row=remap[op["row"]])
+                        self._apply(op)
+                        self._append_log([op])
+                self._write_meta()
+                self._remove_other_generations()
+                self._start_faiss_build()
+            logger.info("local vector store compacted", extra={"points": len(live), "dropped": count - len(live)})
+        except Exception:
+            logger.exception("local vector store compaction failed")
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    # --- FAISS (LOCAL_INDEX=hnsw) ---
+
+    def _start_faiss_build(self) -> None:
+        # Caller holds the lock; searches scan brute-force until the index is ready
+        if self.index_type != "hnsw" or self._faiss_building or self._faiss_index is not None or not self._count:
+            return
+        self._faiss_building = True
+        threading.Thread(
+            target=self._build_faiss, args=(self._generation, self._count), name="faiss-build", daemon=True
+        ).start()
+
+    def _build_faiss(self, generation: int, count: int) -> None:
+        try:
+            import faiss
+            vectors_file, _ = self._files(generation)
+            vectors = np.memmap(vectors_file, dtype=np.float32, mode="r", shape=(count, self._dim))
+            index = faiss.IndexHNSWFlat(self._dim, 32, faiss.METRIC_INNER_PRODUCT)
+            for start in range(0, count, LOCAL_GROW_ROWS):
+                index.add(np.ascontiguousarray(vectors[start:start + LOCAL_GROW_ROWS]))
+            with self._lock:
+                if self._generation == generation:
+                    # Rows appended while building
+                    if self._count > count:
+                        index.add(np.ascontiguousarray(self._mm[count:self._count]))
+                    self._faiss_index = index
+        except Exception:
+            logger.exception("FAISS index build failed")
+        finally:
+            with self._lock:
+                self._faiss_building = False
+                if self._generation != generation:
+                    self._start_faiss_build()
+
+    # --- in-memory indexes ---
+
+    def _index_row(self, row: int, point_id: str, payload: dict) -> None:
+        self._row[point_id] = row
+        for field in INDEXED_FIELDS:
+            if field in payload:
+                self._field_rows[field].setdefault(payload[field], set()).add(row)
+
+    def _unindex_row(self, row: int) -> None:
+        payload = self._payloads[row]
+        self._row.pop(self._ids[row], None)
+        for field in INDEXED_FIELDS:
+            if field in payload:
+                rows = self._field_rows[field].get(payload[field])
+                if rows is not None:
+                    rows.discard(row)
+                    if not rows:
+                        del self._field_rows[field][payload[field]]
+        self._payloads[row] = None
+
+    def _matching_rows(self, where: Optional[dict]) -> Optional[List[int]]:
+        """
+        Rows matching `where`, or None meaning every live row.
+        """
+        if not where:
+            return None
+        result = None
+        for field, value in where.items():
+            if isinstance(value, Range):
+                if field in self._field_rows:
+                    rows = set().union(*(r for v, r in self._field_rows[field].items() if v in value))
+                else:
+                    candidates = result if result is not None else range(len(self._payloads))
+                    rows = {r for r in candidates if self._payloads[r] is not None and self._payloads[r].get(field) in value}
+            elif field in self._field_rows:
+                rows = self._field_rows[field].get(value, set())
+            else:
+                candidates = result if result is not None else range(len(self._payloads))
+                rows = {r for r in candidates if self._payloads[r] is not None and self._payloads[r].get(field) == value}
+            result = rows if result is None else result & rows
+            if not result:
+                return []
+        return sorted(result)
+
+    def _live_rows(self) -> List[int]:
+        return [r for r, p in enumerate(self._payloads) if p is not None]
+
+    # --- VectorStore API ---
+
+    def ensure_collection(self, dim: int) -> None:
+        with self._lock:
+            if self._dim is None:
+                self._dim, self._generation = dim, 1
+                self._open_generation()
+                self._write_meta()
+
+    def _append(self, records: List[Record]) -> None:
+        # Caller holds the lock
+        vectors = np.asarray([r.vector for r in records], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        self._grow(len(records))
+        start = self._count
+        # Vectors first: a crash before the log line leaves only unused space
+        self._mm[start:start + len(records)] = vectors
+        ops = [
+            {"op": "put", "row": start + i, "id": r.id, "payload": dict(r.payload)}
+            for i, r in enumerate(records)
+        ]
+        self._append_log(ops)
+        for op in ops:
+            self._apply(op)
+        if self._faiss_index is not None:
+            if self._faiss_index.ntotal == start:
+                self._faiss_index.add(vectors)
+            else:
+                self._faiss_index = None
+                self._start_faiss_build()
+
+    def upsert(self, records: List[Record], wait: bool = True) -> None:
+        if not records:
+            return
+        with self._lock:
+            if self._dim is None:
+                self.ensure_collection(len(records[0].vector))
+            self._append(records)
+            self._maybe_compact()
+
+    def _search_rows(self, query: np.ndarray, limit: int) -> List[tuple]:
+        # FAISS search over every row; over-fetch to make up for tombstones
+        live = len(self._row)
+        dead = self._count - live
+        k = min(self._faiss_index.ntotal, limit + int(limit * 2 * dead / max(live, 1)))
+        scores, found = self._faiss_index.search(query[None, :], max(k, 1))
+        hits = [(int(r), float(s)) for r, s in zip(found[0], scores[0]) if r >= 0 and self._payloads[r] is not None]
+        return hits[:limit]
+
+    def search(self, vector, limit, where=None) -> List[Record]:
+        query = np.asarray(vector, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        with self._lock:
+            if self._vectors is None or not self._row:
+                return []
+            rows = self._matching_rows(where)
+            if rows is None and self._faiss_index is not None:
+                hits = self._search_rows(query, limit)
+            else:
+                rows = np.asarray(rows if rows is not None else self._live_rows(), dtype=np.int64)
+                if rows.size == 0:
+                    return []
+                scores = self._vectors[rows] @ query
+                k = min(limit, rows.size)
+                top = np.argpartition(-scores, k - 1)[:k]
+                top = top[np.argsort(-scores[top])]
+                hits = [(int(rows[i]), float(scores[i])) for i in top]
+            return [
+                Record(id=self._ids[r], payload=self._payloads[r], score=s)
+                for r, s in hits if self._payloads[r] is not None
+            ]
+
+    def search_batch(self, vectors, limit, where=None) -> List[List[Record]]:
+        if self._faiss_index is not None or not vectors:
+            return super().search_batch(vectors, limit, where)
+        queries = np.asarray(vectors, dtype=np.float32)
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        with self._lock:
+            if self._vectors is None or not self._row:
+                return [[] for _ in vectors]
+            rows = self._matching_rows(where)
+            rows = np.asarray(rows if rows is not None else self._live_rows(), dtype=np.int64)
+            if rows.size == 0:
+                return [[] for _ in vectors]
+            # One (rows x queries) matrix product instead of a scan per query
+            all_scores = self._vectors[rows] @ queries.T
+            k = min(limit, rows.size)
+            results = []
+            for scores in all_scores.T:
+                top = np.argpartition(-scores, k - 1)[:k]
+                top = top[np.argsort(-scores[top])]
+                results.append([
+                    Record(id=self._ids[rows[i]], payload=self._payloads[rows[i]], score=float(scores[i]))
+                    for i in top if self._payloads[rows[i]] is not None
+                ])
+            return results
+
+    def scroll(self, where=None, fields=True, with_vectors=False, limit=None) -> List[Record]:
+        with self._lock:
+            rows = self._matching_rows(where)
+            rows = rows if rows is not None else self._live_rows()
+            if limit:
+                rows = rows[:limit]
+            return [self._record(r, fields, with_vectors) for r in rows]
+
+    def _record(self, row: int, fields=True, with_vectors=False) -> Record:
+        payload = self._payloads[row]
+        if fields is False:
+            payload = {}
+        elif isinstance(fields, list):
+            payload = {k: payload[k] for k in fields if k in payload}
+        vector = self._vectors[row].tolist() if with_vectors else None
+        return Record(id=self._ids[row], payload=payload, vector=vector)
+
+    def retrieve(self, ids, with_vectors=False) -> List[Record]:
+        with self._lock:
+            return [self._record(self._row[i], True, with_vectors) for i in ids if i in self._row]
+
+    def set_payload(self, ids, payload) -> None:
+        with self._lock:
+            ops = [
+                {"op": "set", "row": self._row[i], "payload": dict(self._payloads[self._row[i]], **payload)}
+                for i in ids if i in self._row
+            ]
+            self._write_ops(ops)
+
+    def delete_ids(self, ids) -> None:
+        with self._lock:
+            self._write_ops([{"op": "del", "row": self._row[i]} for i in ids if i in self._row])
+
+    def delete(self, where) -> None:
+        with self._lock:
+            self._write_ops([{"op": "del", "row": row} for row in self._matching_rows(where) or []])
+
+    def _write_ops(self, ops: List[dict]) -> None:
+        # Caller holds the lock
+        if not ops:
+            return
+        self._append_log(ops)
+        for op in ops:
+            self._apply(op)
+        self._maybe_compact()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> VectorStore:
+    """
+    Return the process-wide vector store selected by VECTOR_BACKEND.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if VECTOR_BACKEND == "local":
+                    _store = LocalVectorStore()
+                elif VECTOR_BACKEND == "qdrant":
+                    _store = QdrantVectorStore()
+                else:
+                    raise ValueError(f"Unsupported VECTOR_BACKEND: {VECTOR_BACKEND}")
+    return _store
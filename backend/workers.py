@@ -0,0 +1,203 @@
+# workers.py
+import asyncio
+import contextvars
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+
+# CPU-bound parsing/OCR runs in processes, embedding in a bounded thread pool,
+# and network I/O stays on the event loop via the async Qdrant client.
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "2"))
+
+# Backpressure: how many ingestion jobs/questions run at once, and how many may wait
+MAX_CONCURRENT_UPLOADS = int(os.getenv("MAX_CONCURRENT_UPLOADS", "2"))
+MAX_QUEUED_UPLOADS = int(os.getenv("MAX_QUEUED_UPLOADS", "8"))
+MAX_CONCURRENT_ASKS = int(os.getenv("MAX_CONCURRENT_ASKS", "16"))
+MAX_QUEUED_ASKS = int(os.getenv("MAX_QUEUED_ASKS", "64"))
+# /ask/batch: questions per request, and how many of them are answered at once
+MAX_BATCH_QUESTIONS = int(os.getenv("MAX_BATCH_QUESTIONS", "100"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+
+_process_pool = None
+_embed_pool = None
+_ingest_pool = None
+_manager = None
+_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+class ServerBusyError(Exception):
+    """Raised when a limiter's wait queue is full; handlers map it to 429."""
+
+
+class Limiter:
+    """
+    Semaphore with a bounded wait queue, so overload is rejected quickly
+    instead of piling up requests behind slow work.
+    """
+
+    def __init__(self, name: str, limit: int, max_waiting: int):
+        self.name = name
+        self._sem = asyncio.Semaphore(limit)
+        self._max_waiting = max_waiting
+        self._waiting = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._sem.locked() and self._waiting >= self._max_waiting:
+            raise ServerBusyError(f"Too many concurrent {self.name} requests, please retry shortly")
+        self._waiting += 1
+        try:
+            await self._sem.acquire()
+        finally:
+            self._waiting -= 1
+        try:
+            yield
+        finally:
+            self._sem.release()
+
+
+ask_limiter = Limiter("ask", MAX_CONCURRENT_ASKS, MAX_QUEUED_ASKS)
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        with _lock:
+            if _process_pool is None:
+                _process_pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS)
+    return _process_pool
+
+
+def get_manager():
+    """
+    Return the process-wide multiprocessing manager whose queues carry
+    progress out of process-pool tasks.
+    """
+    global _manager
+    if _manager is None:
+        with _lock:
+            if _manager is None:
+                _manager = multiprocessing.Manager()
+    return _manager
+
+
+def get_embed_pool() -> ThreadPoolExecutor:
+    global _embed_pool
+    if _embed_pool is None:
+        with _lock:
+            if _embed_pool is None:
+                _embed_pool = ThreadPoolExecutor(max_workers=EMBED_WORKERS, thread_name_prefix="embed")
+    return _embed_pool
+
+
+def get_ingest_pool() -> ThreadPoolExecutor:
+    global _ingest_pool
+    if _ingest_pool is None:
+        with _lock:
+            if _ingest_pool is None:
+                _ingest_pool = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_UPLOADS, thread_name_prefix="ingest")
+    return _ingest_pool
+
+
+async def run_cpu(fn, *args, **kwargs):
+    """
+    Run a picklable CPU-bound function (text extraction, OCR) in the process pool.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), partial(fn, *args, **kwargs))
+
+
+def _relay(channel, on_progress, stop: threading.Event) -> None:
+    # Hand the newest value waiting on the channel to on_progress until the
+    # task has finished and the channel is empty
+    while True:
+        try:
+            value = channel.get(timeout=0.2)
+            while True:
+                try:
+                    value = channel.get_nowait()
+                except queue.Empty:
+                    break
+        except queue.Empty:
+            if stop.is_set():
+                return
+            continue
+        except (EOFError, OSError):
+            return  # manager shut down
+        try:
+            on_progress(value)
+        except Exception as e:
+            logger.warning("progress callback failed", extra={"error": str(e)})
+
+
+async def run_cpu_with_progress(on_progress, fn, *args, **kwargs):
+    """
+    run_cpu for a function taking a `progress` callback: each value it
+    reports from the worker process is passed to on_progress(value) in a
+    thread here (the newest one, if several are waiting).
+    """
+    channel = get_manager().Queue()
+    stop = threading.Event()
+    relay = asyncio.create_task(asyncio.to_thread(_relay, channel, on_progress, stop))
+    try:
+        return await run_cpu(fn, *args, progress=channel.put, **kwargs)
+    finally:
+        stop.set()
+        await relay
+
+
+async def run_embedding(fn, *args, **kwargs):
+    """
+    Run embedding work in the bounded embedding thread pool. The caller's
+    context (e.g. the request id used in logs) carries over to the thread.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(get_embed_pool(), partial(ctx.run, fn, *args, **kwargs))
+
+
+async def run_ingest(fn, *args, **kwargs):
+    """
+    Run an ingestion pipeline (chunking, store writes, waiting on uploads) in
+    its own thread pool, so it never holds an embedding thread while it is
+    not encoding. Encoding inside it goes through embed_blocking.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(get_ingest_pool(), partial(ctx.run, fn, *args, **kwargs))
+
+
+def embed_blocking(fn, *args, **kwargs):
+    """
+    Run one piece of embedding work in the embedding pool from a plain thread
+    and wait for it. /ask encodes queue alongside each batch instead of
+    behind a whole upload.
+    """
+    if threading.current_thread().name.startswith("embed"):
+        return fn(*args, **kwargs)  # already on a pool thread; don't wait on ourselves
+    ctx = contextvars.copy_context()
+    return get_embed_pool().submit(partial(ctx.run, fn, *args, **kwargs)).result()
+
+
+def shutdown() -> None:
+    global _process_pool, _embed_pool, _ingest_pool, _manager
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+    if _manager is not None:
+        _manager.shutdown()
+        _manager = None
+    if _embed_pool is not None:
+        _embed_pool.shutdown(wait=False, cancel_futures=True)
+        _embed_pool = None
+    if _ingest_pool is not None:
+        _ingest_pool.shutdown(wait=False, cancel_futures=True)
+        _ingest_pool = None
@@ -1,4 +1,5 @@
 import { useState } from 'react';
+import { sessionHeaders } from '@/lib/session';
 
 const API_BASE_URL = 'http://localhost:8000';
 
@@ -44,6 +45,7 @@ export const useChat = ({ onMessage, isDocumentUploaded }: UseChatProps) => {
 
       const response = await fetch(`${API_BASE_URL}/ask`, {
         method: 'POST',
+        headers: sessionHeaders(),
         body: formData,
       });
 
@@ -1,4 +1,5 @@
 import { useState } from 'react';
+import { sessionHeaders } from '@/lib/session';
 
 const API_BASE_URL = 'http://localhost:8000';
 
@@ -17,6 +18,7 @@ export const useChatHistory = ({ onMessage, onClearMessages, onRefreshFiles }: U
     try {
       const response = await fetch(`${API_BASE_URL}/clear`, {
         method: 'DELETE',
+        headers: sessionHeaders(),
       });
 
       const result = await response.json();
@@ -43,6 +45,7 @@ export const useChatHistory = ({ onMessage, onClearMessages, onRefreshFiles }: U
       // and inform user that individual file deletion is available
       const response = await fetch(`${API_BASE_URL}/clear`, {
         method: 'DELETE',
+        headers: sessionHeaders(),
       });
 
       const result = await response.json();
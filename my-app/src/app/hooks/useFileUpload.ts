@@ -1,6 +1,30 @@
 import { useState, useRef } from 'react';
+import { sessionHeaders } from '@/lib/session';
 
 const API_BASE_URL = 'http://localhost:8000';
+const JOB_POLL_INTERVAL_MS = 1500;
+// Stop polling after this long; the job keeps running on the server
+const JOB_POLL_TIMEOUT_MS = 15 * 60 * 1000;
+
+class JobTimeoutError extends Error {}
+
+// Poll the ingestion job until every file is done, skipped or failed
+const waitForJob = async (jobId: string) => {
+  const deadline = Date.now() + JOB_POLL_TIMEOUT_MS;
+  while (Date.now() < deadline) {
+    const response = await fetch(`${API_BASE_URL}/jobs/${jobId}`);
+    if (!response.ok) {
+      const errorData = await response.json().catch(() => ({}));
+      throw new Error(errorData.error || `HTTP error! status: ${response.status}`);
+    }
+    const job = await response.json();
+    if (job.status === 'done' || job.status === 'failed') {
+      return job;
+    }
+    await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+  }
+  throw new JobTimeoutError('Processing is taking longer than expected. Refresh the file list later to see if it finished.');
+};
 
 interface UseFileUploadProps {
   onMessage: (type: 'bot' | 'user', content: string, isFile?: boolean, updateId?: number) => any;
@@ -52,6 +76,7 @@ export const useFileUpload = ({ onMessage, onDocumentUploaded, onRefreshFiles }:
 
       const response = await fetch(`${API_BASE_URL}/upload`, {
         method: 'POST',
+        headers: sessionHeaders(),
         body: formData,
       });
 
@@ -61,7 +86,9 @@ export const useFileUpload = ({ onMessage, onDocumentUploaded, onRefreshFiles }:
         return;
       }
 
-      const data = await response.json();
+      const { job_id } = await response.json();
+      const job = await waitForJob(job_id);
+      const data = { results: job.files };
       
       // Handle response based on backend structure
       if (data.results && Array.isArray(data.results)) {
@@ -75,6 +102,8 @@ export const useFileUpload = ({ onMessage, onDocumentUploaded, onRefreshFiles }:
           } else if (result.status === 'skipped') {
             onMessage('bot', `⚠️ Document "${result.file_name}" was skipped (already exists)`);
             skippedCount++;
+          } else if (result.status === 'failed') {
+            onMessage('bot', `❌ Document "${result.file_name}" failed: ${result.error || 'Unknown error'}`);
           }
         });
 
@@ -99,7 +128,11 @@ export const useFileUpload = ({ onMessage, onDocumentUploaded, onRefreshFiles }:
       
     } catch (error) {
       console.error('Error uploading file:', error);
-      onMessage('bot', '❌ Upload failed. Please make sure the backend server is running and try again.');
+      if (error instanceof JobTimeoutError) {
+        onMessage('bot', `⏳ ${error.message}`);
+      } else {
+        onMessage('bot', '❌ Upload failed. Please make sure the backend server is running and try again.');
+      }
     } finally {
       setIsUploading(false);
       // Reset file input
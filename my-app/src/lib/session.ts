@@ -0,0 +1,16 @@
+const SESSION_STORAGE_KEY = 'legal-assistant-session-id';
+
+// Chat history is kept per session on the backend; the id lives in
+// localStorage so it survives reloads and is sent as X-Session-Id.
+export function getSessionId(): string {
+  let sessionId = localStorage.getItem(SESSION_STORAGE_KEY);
+  if (!sessionId) {
+    sessionId = crypto.randomUUID();
+    localStorage.setItem(SESSION_STORAGE_KEY, sessionId);
+  }
+  return sessionId;
+}
+
+export function sessionHeaders(): Record<string, string> {
+  return { 'X-Session-Id': getSessionId() };
+}